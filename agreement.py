@@ -0,0 +1,201 @@
+# Inter-annotator agreement for any number of annotators
+# (integer-coded label matrices, no display needed)
+
+import csv
+import json
+import numpy as np
+
+EXCLUDED_LABELS = ["same", "rem", "skip", "-", ""]
+
+def get_label_matrix(all_annotations, excluded_labels=EXCLUDED_LABELS, label_names=None):
+    """ Builds an integer-coded label matrix of shape (n_items, n_annotators),
+    with -1 where an annotator did not label the item.
+    Returns a tuple (label matrix, item ids, label names).
+    @ all_annotations: list of dictionaries (item id -> label), one per annotator,
+                       see process_annot.get_directness() / get_revision_success()
+    @ label_names:     fixed order of labels (default: sorted labels found)
+    """
+    items = sorted(set([item for annotations in all_annotations for item in annotations]))
+    if label_names is None:
+        label_names = sorted(set([label for annotations in all_annotations
+                                  for label in annotations.values() if label not in excluded_labels]))
+    item_ix = {item: ix for ix, item in enumerate(items)}
+    label_ix = {label: ix for ix, label in enumerate(label_names)}
+    label_matrix = np.full((len(items), len(all_annotations)), -1, dtype=np.int64)
+    for annotator, annotations in enumerate(all_annotations):
+        rows = [item_ix[item] for item, label in annotations.items() if label in label_ix]
+        codes = [label_ix[label] for item, label in annotations.items() if label in label_ix]
+        label_matrix[rows, annotator] = codes
+    # keep only items labelled by at least two annotators
+    multi = (label_matrix >= 0).sum(axis=1) > 1
+    return (label_matrix[multi], [item for item, keep in zip(items, multi) if keep], label_names)
+
+def get_label_counts(label_matrix, n_labels):
+    """ Number of annotators assigning each label to each item,
+    shape (n_items, n_labels).
+    """
+    n_items = label_matrix.shape[0]
+    rows = np.repeat(np.arange(n_items), label_matrix.shape[1])
+    codes = label_matrix.ravel()
+    valid = codes >= 0
+    counts = np.bincount(rows[valid] * n_labels + codes[valid], minlength=n_items*n_labels)
+    return counts.reshape(n_items, n_labels)
+
+def percentage_agreement(label_matrix, n_labels):
+    """ Percentage of items on which all annotators labelling the item agree.
+    """
+    counts = get_label_counts(label_matrix, n_labels)
+    if not len(counts):
+        return float("nan")
+    return 100 * float(((counts > 0).sum(axis=1) == 1).mean())
+
+def pair_confusion_matrix(label_matrix, annot_a, annot_b, n_labels):
+    """ Confusion matrix between two annotators over the items both labelled
+    (annotator a on the rows, annotator b on the columns).
+    """
+    labels_a = label_matrix[:, annot_a]
+    labels_b = label_matrix[:, annot_b]
+    both = (labels_a >= 0) & (labels_b >= 0)
+    cm = np.bincount(labels_a[both] * n_labels + labels_b[both], minlength=n_labels*n_labels)
+    return cm.reshape(n_labels, n_labels)
+
+def cohen_kappa(cm):
+    """ Cohen's kappa from a confusion matrix.
+    """
+    total = cm.sum()
+    if not total:
+        return float("nan")
+    p_obs = np.trace(cm) / total
+    p_exp = (cm.sum(axis=0) * cm.sum(axis=1)).sum() / total**2
+    if p_exp == 1:
+        return 1.0
+    return float((p_obs - p_exp) / (1 - p_exp))
+
+def pairwise_kappas(label_matrix, n_labels):
+    """ Cohen's kappa for each pair of annotators. Returns a symmetric
+    matrix of shape (n_annotators, n_annotators), NaN on the diagonal.
+    """
+    n_annotators = label_matrix.shape[1]
+    kappas = np.full((n_annotators, n_annotators), np.nan)
+    for a in range(n_annotators):
+        for b in range(a+1, n_annotators):
+            kappas[a, b] = kappas[b, a] = cohen_kappa(pair_confusion_matrix(label_matrix, a, b, n_labels))
+    return kappas
+
+def fleiss_kappa(label_matrix, n_labels):
+    """ Fleiss' kappa, generalised to items labelled by a varying number
+    of annotators (at least two).
+    """
+    counts = get_label_counts(label_matrix, n_labels).astype(float)
+    n_raters = counts.sum(axis=1)
+    counts = counts[n_raters > 1]
+    n_raters = n_raters[n_raters > 1]
+    if not len(counts):
+        return float("nan")
+    p_items = ((counts**2).sum(axis=1) - n_raters) / (n_raters * (n_raters-1))
+    p_labels = counts.sum(axis=0) / n_raters.sum()
+    p_obs = p_items.mean()
+    p_exp = (p_labels**2).sum()
+    if p_exp == 1:
+        return 1.0
+    return float((p_obs - p_exp) / (1 - p_exp))
+
+def krippendorff_alpha(label_matrix, n_labels):
+    """ Krippendorff's alpha for nominal data (handles missing labels).
+    """
+    counts = get_label_counts(label_matrix, n_labels).astype(float)
+    n_values = counts.sum(axis=1)
+    counts = counts[n_values > 1]
+    n_values = n_values[n_values > 1]
+    weights = 1 / (n_values - 1)
+    # coincidence matrix
+    coincid = (counts * weights[:, None]).T @ counts - np.diag((counts * weights[:, None]).sum(axis=0))
+    n_c = coincid.sum(axis=0)
+    n = n_c.sum()
+    disagr_obs = coincid.sum() - np.trace(coincid)
+    disagr_exp = n**2 - (n_c**2).sum()
+    if not disagr_exp:
+        return 1.0 if not disagr_obs else float("nan")
+    return float(1 - (n - 1) * disagr_obs / disagr_exp)
+
+def get_disagreements(label_matrix, items, label_names):
+    """ Returns a dictionary with the id of items with disagreement as key
+    and the labels assigned by each annotator as value ('' if missing).
+    """
+    n_labels = len(label_names)
+    disagr_rows = np.flatnonzero((get_label_counts(label_matrix, n_labels) > 0).sum(axis=1) > 1)
+    return {items[row]: [label_names[code] if code >= 0 else "" for code in label_matrix[row]]
+            for row in disagr_rows}
+
+def compute_agreement(all_annotations, annotator_names=None, excluded_labels=EXCLUDED_LABELS, label_names=None):
+    """ Computes percentage agreement, pairwise Cohen's kappa, Fleiss' kappa,
+    Krippendorff's alpha and pairwise confusion matrices for any number of
+    annotators. Returns a dictionary with the results.
+    @ all_annotations: list of dictionaries with annotation data per annotator
+    @ annotator_names: e.g. ["A1", "A2", "A3"] (default: A1..An)
+    """
+    if not annotator_names:
+        annotator_names = ["A" + str(ix+1) for ix in range(len(all_annotations))]
+    label_matrix, items, label_names = get_label_matrix(all_annotations, excluded_labels, label_names)
+    n_labels = len(label_names)
+    n_annotators = len(all_annotations)
+    kappas = pairwise_kappas(label_matrix, n_labels)
+    report = {"annotators": annotator_names,
+              "labels": label_names,
+              "nr_items": len(items),
+              "nr_disagreements": len(get_disagreements(label_matrix, items, label_names)),
+              "percentage_agreement": round(percentage_agreement(label_matrix, n_labels), 2),
+              "fleiss_kappa": round(fleiss_kappa(label_matrix, n_labels), 3),
+              "krippendorff_alpha": round(krippendorff_alpha(label_matrix, n_labels), 3),
+              "pairwise_kappa": {},
+              "confusion_matrices": {}}
+    for a in range(n_annotators):
+        for b in range(a+1, n_annotators):
+            pair = annotator_names[a] + "-" + annotator_names[b]
+            report["pairwise_kappa"][pair] = round(float(kappas[a, b]), 3)
+            report["confusion_matrices"][pair] = pair_confusion_matrix(label_matrix, a, b, n_labels).tolist()
+    return report
+
+def write_agreement_report(report, out_prefix, plot=True):
+    """ Saves the agreement results to files: a JSON summary (<out_prefix>.json),
+    one CSV per confusion matrix and, if matplotlib is available and plot is
+    True, one heatmap PNG per confusion matrix (rendered without a display).
+    """
+    with open(out_prefix + ".json", "w") as json_f:
+        json.dump(report, json_f, indent=2)
+    label_names = report["labels"]
+    for pair, cm in report["confusion_matrices"].items():
+        with open("{}_cm_{}.csv".format(out_prefix, pair), "w", newline="") as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow([""] + label_names)
+            for label, cm_row in zip(label_names, cm):
+                csv_writer.writerow([label] + cm_row)
+        if plot:
+            try:
+                import matplotlib
+                matplotlib.use("Agg")
+                import matplotlib.pyplot as plt
+            except ImportError:
+                continue
+            fig, ax = plt.subplots()
+            ax.imshow(np.array(cm), cmap="Blues")
+            ax.set_xticks(range(len(label_names)))
+            ax.set_xticklabels(label_names)
+            ax.set_yticks(range(len(label_names)))
+            ax.set_yticklabels(label_names)
+            ax.set_xlabel(pair.split("-")[1])
+            ax.set_ylabel(pair.split("-")[0])
+            for i, cm_row in enumerate(cm):
+                for j, val in enumerate(cm_row):
+                    ax.text(j, i, val, ha="center", va="center")
+            fig.savefig("{}_cm_{}.png".format(out_prefix, pair), bbox_inches="tight")
+            plt.close(fig)
+
+def print_agreement_report(report):
+    print("Nr of items (2+ annotators): {}".format(report["nr_items"]))
+    print("Nr of disagreements:         {}".format(report["nr_disagreements"]))
+    print("Percentage agreement:        {}".format(report["percentage_agreement"]))
+    for pair, kappa in report["pairwise_kappa"].items():
+        print("Kappa {:<22} {}".format(pair + ":", kappa))
+    print("Fleiss' kappa:               {}".format(report["fleiss_kappa"]))
+    print("Krippendorff's alpha:        {}".format(report["krippendorff_alpha"]))
@@ -0,0 +1,157 @@
+# Performance benchmarks on synthetic corpora of increasing size
+# (see synth_corpus.py). Results are saved as JSON for comparison between runs.
+#
+# Run:      python benchmark.py [nr_students ...]     e.g. python benchmark.py 5 20 80
+# Compare:  python benchmark.py --compare old.json new.json
+
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import process_corpus
+from filtering import filter_comment, get_praise_phrases
+from synth_corpus import generate_corpus, write_annot_csv, OPEN_COMMENTS, LINK_WORDS, WORDS
+
+def time_call(func, repeat=3):
+    """ Runs func repeat times. Returns a dictionary with the minimum and
+    median wall time (in seconds).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"min": round(times[0], 5), "median": round(times[len(times)//2], 5)}
+
+def get_essay_bundles(data_root, max_bundles=50):
+    """ Loaded (original, revision, word alignment, target token lists) of
+    some essays with notes, for benchmarking the per-note functions.
+    """
+    bundles = []
+    for dirpath, dirnames, filenames in os.walk(data_root):
+        for fname in sorted(filenames):
+            if "fixed_notes" in fname and len(bundles) < max_bundles:
+                notes = process_corpus.load_xml(os.path.join(dirpath, fname))
+                st_file = os.path.join(dirpath, fname.replace("_notes", ""))
+                rev_file, st_rev = process_corpus.load_revision(st_file)
+                alignments = process_corpus.load_xml(rev_file.replace("_fixed", "_fixed_wordAlign"))
+                targets = [process_corpus.get_target_tokens(note.attrib["target"].split("#")[1])
+                           for note in notes.iter("{http://www.tei-c.org/ns/1.0}note")]
+                bundles.append((process_corpus.load_xml(st_file), st_rev, alignments, targets))
+    return bundles
+
+def bench_note_functions(bundles, results):
+    def st_sentences():
+        for st_resp, _, _, targets in bundles:
+            for target in targets:
+                process_corpus.get_st_sentence(st_resp, target)
+    def revision_infos():
+        for _, st_rev, alignments, targets in bundles:
+            for target in targets:
+                process_corpus.get_revision_info(alignments, st_rev, target)
+    nr_notes = sum([len(bundle[3]) for bundle in bundles])
+    results["get_st_sentence"] = dict(time_call(st_sentences), nr_notes=nr_notes)
+    results["get_revision_info"] = dict(time_call(revision_infos), nr_notes=nr_notes)
+
+def bench_filters(results, nr_comments=5000, seed=9):
+    rng = random.Random(seed)
+    comments = [rng.choice(OPEN_COMMENTS).format(lw=rng.choice(LINK_WORDS), w=rng.choice(WORDS))
+                for _ in range(nr_comments)]
+    praise_phrases = get_praise_phrases(["good", "great", "nice", "excellent", "wonderful"], "LA")
+    def filters():
+        for comment in comments:
+            filter_comment(comment, "CTL1000", True, praise_phrases)
+    results["filter_comment"] = dict(time_call(filters), nr_comments=nr_comments)
+
+def bench_features(work_dir, results, nr_items=500):
+    """ Feature extraction needs a spaCy pipeline; skipped if not installed.
+    """
+    try:
+        from extract_features import get_nlp, extract_features_LA
+        nlp = get_nlp()
+    except (ImportError, OSError) as e:
+        results["extract_features_LA"] = {"skipped": str(e)}
+        return
+    annot_csv = os.path.join(work_dir, "annot.csv")
+    write_annot_csv(annot_csv, nr_items)
+    out = [os.path.join(work_dir, name) for name in ["f.data", "f.target", "f.names"]]
+    results["extract_features_LA"] = dict(time_call(lambda: extract_features_LA(annot_csv, *out, nlp), 1),
+                                          nr_items=nr_items)
+
+def run_benchmarks(scales=(5, 20), repeat=3, out_folder="benchmark_results", keep_corpus=False):
+    """ Generates a corpus per scale (number of students per assignment) and
+    times get_data() and the per-note functions on it. Returns the results
+    and saves them to a JSON file in out_folder.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+               "machine": platform.machine(), "scales": {}}
+    try:
+        results["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir,
+                                           capture_output=True, text=True).stdout.strip()
+    except OSError:
+        pass
+    orig_dir = os.getcwd()
+    for nr_students in scales:
+        work_dir = tempfile.mkdtemp(prefix="fb_bench")
+        scale_results = {}
+        try:
+            start = time.perf_counter()
+            data_root = generate_corpus(work_dir, nr_students=nr_students)
+            scale_results["generate_corpus"] = round(time.perf_counter() - start, 5)
+            scale_results["nr_files"] = sum([len(files) for _, _, files in os.walk(data_root)])
+            shutil.copy(os.path.join(repo_dir, "metaling.txt"), work_dir)
+            os.chdir(work_dir)      # get_data() reads freq_unigrams/freq_bigrams from the working dir
+            error_cats = os.path.join(work_dir, "error_cats.csv")
+            for feedback_type in ["open", "tagged"]:
+                scale_results["get_data_" + feedback_type] = time_call(
+                    lambda: process_corpus.get_data(data_root, error_cats, work_dir + os.sep, None,
+                                                    feedback_type=feedback_type, error_type="ALL"), repeat)
+            bench_note_functions(get_essay_bundles(data_root), scale_results)
+            bench_filters(scale_results)
+            bench_features(work_dir, scale_results)
+        finally:
+            os.chdir(orig_dir)
+            if not keep_corpus:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        results["scales"][str(nr_students)] = scale_results
+        print(nr_students, json.dumps(scale_results))
+    os.makedirs(out_folder, exist_ok=True)
+    out_file = os.path.join(out_folder, "bench_{}.json".format(time.strftime("%Y%m%d_%H%M%S")))
+    with open(out_file, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to", out_file)
+    return results
+
+def compare_results(old_file, new_file):
+    """ Prints the ratio new / old of the median times per benchmark and scale.
+    """
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print("{:<8}{:<22}{:<12}{:<12}{:<8}".format("Scale", "Benchmark", "Old (s)", "New (s)", "Ratio"))
+    for scale, new_scale in new["scales"].items():
+        old_scale = old["scales"].get(scale, {})
+        for name, new_res in new_scale.items():
+            old_res = old_scale.get(name)
+            if isinstance(new_res, dict) and "median" in new_res and isinstance(old_res, dict) \
+                                                                  and "median" in old_res:
+                ratio = new_res["median"] / old_res["median"] if old_res["median"] else float("nan")
+                print("{:<8}{:<22}{:<12}{:<12}{:<8}".format(scale, name, old_res["median"],
+                                                            new_res["median"], round(ratio, 2)))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--compare":
+        compare_results(sys.argv[2], sys.argv[3])
+    else:
+        run_benchmarks([int(arg) for arg in sys.argv[1:]] or (5, 20))
@@ -0,0 +1,162 @@
+# Bootstrap and permutation based evaluation of classifier scores
+# (confidence intervals and paired significance tests)
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+def get_resample_ix(y_test, n_boot, rng, stratify=True):
+    """ Draws n_boot bootstrap samples of test item indices at once.
+    Returns an array of shape (n_boot, n_items).
+    @ stratify: resample within each class, so that every bootstrap
+                sample keeps the label distribution of the test set
+    """
+    y_test = np.asarray(y_test)
+    n_items = len(y_test)
+    if not stratify:
+        return rng.integers(0, n_items, size=(n_boot, n_items))
+    resample_ix = np.empty((n_boot, n_items), dtype=np.int64)
+    col = 0
+    for label in np.unique(y_test):
+        label_ix = np.flatnonzero(y_test == label)
+        picks = rng.integers(0, len(label_ix), size=(n_boot, len(label_ix)))
+        resample_ix[:, col:col+len(label_ix)] = label_ix[picks]
+        col += len(label_ix)
+    return resample_ix
+
+def _bootstrap_chunk(correct, y_test, n_boot, seed, stratify):
+    """ Accuracy of each classifier on n_boot resamples of the test set.
+    Returns an array of shape (n_clfs, n_boot).
+    """
+    rng = np.random.default_rng(seed)
+    resample_ix = get_resample_ix(y_test, n_boot, rng, stratify)
+    return correct[:, resample_ix].mean(axis=2)
+
+def _split_work(n_boot, chunk_size, seed):
+    """ Splits n_boot resamples into chunks with independent random seeds.
+    """
+    sizes = [chunk_size] * (n_boot // chunk_size)
+    if n_boot % chunk_size:
+        sizes.append(n_boot % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return list(zip(sizes, seeds))
+
+def bootstrap_scores(y_test, preds, n_boot=2000, seed=9, stratify=True, n_jobs=1, chunk_size=250):
+    """ Resamples test predictions with replacement and computes the accuracy of
+    each classifier on every resample. Returns a dictionary with classifier
+    name as key and an array of n_boot accuracy values as value.
+    @ y_test:     gold labels of the test set
+    @ preds:      dictionary with classifier name as key and predicted labels as value
+    @ n_jobs:     number of worker processes (chunks of resamples run in parallel)
+    @ chunk_size: number of resamples drawn at once (bounds memory use per chunk)
+    """
+    y_test = np.asarray(y_test)
+    clf_names = list(preds.keys())
+    correct = np.array([np.asarray(preds[name]) == y_test for name in clf_names], dtype=float)
+    work = _split_work(n_boot, chunk_size, seed)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunks = list(executor.map(_bootstrap_chunk, *zip(*[(correct, y_test, size, chunk_seed, stratify)
+                                                                 for size, chunk_seed in work])))
+    else:
+        chunks = [_bootstrap_chunk(correct, y_test, size, chunk_seed, stratify)
+                  for size, chunk_seed in work]
+    boot_accs = np.concatenate(chunks, axis=1)
+    return {name: boot_accs[ix] for ix, name in enumerate(clf_names)}
+
+def _retrain_chunk(clf, X_train, y_train, X_test, y_test, n_boot, seed, stratify):
+    """ Refits the classifier on n_boot resamples of the training set and
+    scores it on the (fixed) test set.
+    """
+    from sklearn.base import clone
+    rng = np.random.default_rng(seed)
+    scores = []
+    for train_ix in get_resample_ix(y_train, n_boot, rng, stratify):
+        boot_clf = clone(clf)
+        boot_clf.fit(X_train[train_ix], y_train[train_ix])
+        scores.append(boot_clf.score(X_test, y_test))
+    return np.array(scores)
+
+def bootstrap_retrain(X_train, y_train, X_test, y_test, clfs, n_boot=200, seed=9, stratify=True,
+                      n_jobs=1, chunk_size=25):
+    """ Retrains each classifier on bootstrap resamples of the training set.
+    Captures the variance due to the training data as well (slower than
+    bootstrap_scores()). Returns the same format as bootstrap_scores().
+    @ clfs: list of (classifier name, classifier) tuples, see do_ml.get_classifiers()
+    """
+    if not hasattr(X_train, "tocsr"):   # scipy sparse matrices are indexed by row as they are
+        X_train = np.asarray(X_train)
+    y_train = np.asarray(y_train)
+    work = _split_work(n_boot, chunk_size, seed)
+    boot_scores = {}
+    with ProcessPoolExecutor(max_workers=max(n_jobs, 1)) as executor:
+        for clf_name, clf in clfs:
+            args = [(clf, X_train, y_train, X_test, y_test, size, chunk_seed, stratify)
+                    for size, chunk_seed in work]
+            boot_scores[clf_name.strip()] = np.concatenate(list(executor.map(_retrain_chunk, *zip(*args))))
+    return boot_scores
+
+def get_conf_interval(boot_vals, ci=0.95):
+    """ Percentile confidence interval of the bootstrap distribution.
+    """
+    alpha = (1 - ci) / 2
+    low, high = np.quantile(boot_vals, [alpha, 1-alpha])
+    return (low, high)
+
+def paired_bootstrap_test(boot_scores, clf_a, clf_b):
+    """ Two-sided p-value for the difference in score between two classifiers
+    evaluated on the same bootstrap resamples.
+    """
+    diffs = boot_scores[clf_a] - boot_scores[clf_b]
+    p_val = 2 * min((diffs <= 0).mean(), (diffs >= 0).mean())
+    return min(p_val, 1.0)
+
+def paired_permutation_test(y_test, pred_a, pred_b, n_perm=10000, seed=9):
+    """ Approximate randomisation test: randomly swaps the predictions of the
+    two classifiers per test item (sign flip of the per-item correctness
+    difference) and checks how often the accuracy difference is at least
+    as large as the observed one. Returns a tuple (observed diff, p-value).
+    """
+    y_test = np.asarray(y_test)
+    diffs = (np.asarray(pred_a) == y_test).astype(float) - (np.asarray(pred_b) == y_test)
+    observed = diffs.mean()
+    rng = np.random.default_rng(seed)
+    signs = rng.choice([-1.0, 1.0], size=(n_perm, len(diffs)))
+    perm_diffs = (signs * diffs).mean(axis=1)
+    p_val = ((np.abs(perm_diffs) >= abs(observed) - 1e-12).sum() + 1) / (n_perm + 1)
+    return (observed, p_val)
+
+def get_bootstrap_report(y_test, preds, boot_scores, ci=0.95, n_perm=10000, seed=9):
+    """ Summarises bootstrap results: point estimate and confidence interval
+    per classifier, and paired significance for all pairs of classifiers.
+    Returns a tuple of (per classifier rows, pairwise rows).
+    """
+    y_test = np.asarray(y_test)
+    clf_rows = []
+    for clf_name, boot_vals in boot_scores.items():
+        acc = (np.asarray(preds[clf_name]) == y_test).mean() if clf_name in preds else boot_vals.mean()
+        low, high = get_conf_interval(boot_vals, ci)
+        clf_rows.append((clf_name, acc, low, high, boot_vals.std()))
+    pair_rows = []
+    clf_names = list(boot_scores.keys())
+    for ix, clf_a in enumerate(clf_names):
+        for clf_b in clf_names[ix+1:]:
+            p_boot = paired_bootstrap_test(boot_scores, clf_a, clf_b)
+            if clf_a in preds and clf_b in preds:
+                diff, p_perm = paired_permutation_test(y_test, preds[clf_a], preds[clf_b], n_perm, seed)
+            else:
+                diff, p_perm = (boot_scores[clf_a] - boot_scores[clf_b]).mean(), float("nan")
+            pair_rows.append((clf_a, clf_b, diff, p_boot, p_perm))
+    return (clf_rows, pair_rows)
+
+def print_bootstrap_report(clf_rows, pair_rows, ci=0.95):
+    print("{:<12}{:<8}{:<18}{:<8}".format("Classifier", "Acc", "{}% CI".format(int(ci*100)), "SD"))
+    for clf_name, acc, low, high, sd in clf_rows:
+        print("{:<12}{:<8}{:<18}{:<8}".format(clf_name, round(acc, 3),
+                                             "[{}, {}]".format(round(low, 3), round(high, 3)), round(sd, 3)))
+    print()
+    print("{:<24}{:<8}{:<8}{:<8}".format("Pair", "Diff", "p_boot", "p_perm"))
+    for clf_a, clf_b, diff, p_boot, p_perm in pair_rows:
+        sign = " *" if p_perm < 0.05 or (p_perm != p_perm and p_boot < 0.05) else ""
+        print("{:<24}{:<8}{:<8}{:<8}{}".format(clf_a + " - " + clf_b, round(diff, 3),
+                                               round(p_boot, 3), round(p_perm, 3), sign))
+    print()
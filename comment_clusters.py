@@ -0,0 +1,148 @@
+# Clustering of near-duplicate teacher comments (e.g. reused comment templates
+# with small edits) with MinHash signatures and locality sensitive hashing
+#
+# Run: python comment_clusters.py open_ALL.csv open_ALL_clusters.csv [threshold]
+#      (input: CSV saved by process_corpus.get_data(), comments in column B)
+
+import csv
+import sys
+import zlib
+from collections import Counter
+import numpy as np
+
+def normalize(comment):
+    return " ".join(comment.lower().split())
+
+def get_shingles(comment, k=5):
+    """ Set of character k-grams of a (normalized) comment, hashed to 32 bits.
+    Comments shorter than k characters are one shingle.
+    """
+    if len(comment) <= k:
+        return np.array([zlib.crc32(comment.encode("utf-8"))], dtype=np.uint64)
+    shingles = set([comment[i:i+k] for i in range(len(comment)-k+1)])
+    return np.array(sorted([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]), dtype=np.uint64)
+
+def get_signatures(comments, num_perm=128, k=5, seed=9, batch_size=100000):
+    """ MinHash signatures of comments, computed for batches of comments at
+    once. Uses num_perm multiply-shift hash functions ((a*x + b) mod 2^64) >> 32.
+    Returns an array of shape (number of comments, num_perm).
+    @ batch_size: maximum number of shingles hashed at once (memory: 8 * num_perm * batch_size bytes)
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(comments), num_perm), dtype=np.uint32)
+    batch = []
+    batch_start = 0
+    nr_shingles = 0
+    for ix, comment in enumerate(comments):
+        shingles = get_shingles(comment, k)
+        batch.append(shingles)
+        nr_shingles += len(shingles)
+        if nr_shingles >= batch_size or ix == len(comments) - 1:
+            x = np.concatenate(batch)
+            starts = np.cumsum([0] + [len(shingles) for shingles in batch[:-1]])
+            hashes = (a[:, None] * x[None, :] + b[:, None]) >> np.uint64(32)
+            signatures[batch_start:ix+1] = np.minimum.reduceat(hashes, starts, axis=1).T
+            batch_start = ix + 1
+            batch = []
+            nr_shingles = 0
+    return signatures
+
+def find_root(parents, ix):
+    while parents[ix] != ix:
+        parents[ix] = parents[parents[ix]]
+        ix = parents[ix]
+    return ix
+
+def get_lsh_clusters(signatures, bands=32, threshold=0.5):
+    """ Groups signatures into clusters: signatures with an identical band
+    (rows of num_perm / bands values) are candidates, and a candidate joins the
+    cluster of the first signature of the bucket if their estimated Jaccard
+    similarity (share of equal MinHash values) is at least threshold.
+    Returns a cluster ID per signature (0 = first cluster found).
+    """
+    nr_sigs, num_perm = signatures.shape
+    rows = num_perm // bands
+    parents = list(range(nr_sigs))
+    for band in range(bands):
+        band_sig = np.ascontiguousarray(signatures[:, band*rows:(band+1)*rows])
+        keys = band_sig.view(np.dtype((np.void, band_sig.itemsize * rows))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        order = np.argsort(inverse, kind="stable")
+        bucket_ends = np.cumsum(counts)
+        for end, count in zip(bucket_ends, counts):
+            if count < 2:
+                continue
+            members = order[end-count:end]
+            first = members[0]
+            sims = (signatures[members[1:]] == signatures[first]).mean(axis=1)
+            for member, sim in zip(members[1:], sims):
+                if sim >= threshold:
+                    root_a, root_b = find_root(parents, first), find_root(parents, member)
+                    if root_a != root_b:
+                        parents[max(root_a, root_b)] = min(root_a, root_b)
+    cluster_ids = {}
+    return [cluster_ids.setdefault(find_root(parents, ix), len(cluster_ids)) for ix in range(nr_sigs)]
+
+def cluster_comments(comments, threshold=0.5, num_perm=128, bands=32, k=5, seed=9):
+    """ Cluster ID per comment; comments identical after normalization are
+    hashed once.
+    @ comments:  list of strings
+    @ threshold: minimum estimated Jaccard similarity of the character k-gram sets
+    @ num_perm:  number of MinHash functions (must be a multiple of bands)
+    @ bands:     number of LSH bands (more bands: more candidates with lower similarity)
+    """
+    unique_ixs = {}
+    comment_ixs = [unique_ixs.setdefault(normalize(comment), len(unique_ixs)) for comment in comments]
+    if not unique_ixs:
+        return []
+    signatures = get_signatures(list(unique_ixs.keys()), num_perm, k, seed)
+    unique_clusters = get_lsh_clusters(signatures, bands, threshold)
+    return [unique_clusters[ix] for ix in comment_ixs]
+
+def cluster_records(comments, **kwargs):
+    """ Cluster IDs for the output of process_corpus.get_data().
+    Returns a dictionary of error category -> list of cluster IDs (one per record).
+    @ comments: dictionary of error category -> list of records
+    @ kwargs:   see cluster_comments()
+    """
+    error_cats = list(comments.keys())
+    cluster_ids = cluster_comments([record[1] for error_cat in error_cats for record in comments[error_cat]],
+                                   **kwargs)
+    output = {}
+    start = 0
+    for error_cat in error_cats:
+        output[error_cat] = cluster_ids[start:start+len(comments[error_cat])]
+        start += len(comments[error_cat])
+    return output
+
+def cluster_csv(in_csv, out_csv, threshold=0.5, **kwargs):
+    """ Adds a cluster ID and cluster size column (first two columns) to a CSV saved
+    by get_data() and writes it sorted by cluster size and cluster ID.
+    Returns the cluster IDs.
+    """
+    with open(in_csv, newline="") as csvfile:
+        rows = [row for row in csv.reader(csvfile) if row]
+    cluster_ids = cluster_comments([row[1] for row in rows], threshold, **kwargs)
+    sizes = Counter(cluster_ids)
+    order = sorted(range(len(rows)), key=lambda ix: (-sizes[cluster_ids[ix]], cluster_ids[ix], ix))
+    with open(out_csv, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        for ix in order:
+            csv_writer.writerow([cluster_ids[ix], sizes[cluster_ids[ix]]] + rows[ix])
+    print_clusters([row[1] for row in rows], cluster_ids)
+    return cluster_ids
+
+def print_clusters(comments, cluster_ids, top_n=10):
+    sizes = Counter(cluster_ids)
+    examples = {}
+    for comment, cluster_id in zip(comments, cluster_ids):
+        examples.setdefault(cluster_id, comment)
+    print("{} comments, {} clusters ({} with more than one comment)".format(
+          len(comments), len(sizes), len([size for size in sizes.values() if size > 1])))
+    for cluster_id, size in sizes.most_common(top_n):
+        print("{:<8}{:<8}{}".format(cluster_id, size, examples[cluster_id][:80]))
+
+if __name__ == "__main__":
+    cluster_csv(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0.5)
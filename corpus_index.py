@@ -0,0 +1,233 @@
+# Positional inverted index over the words of the student essays (positions
+# map back to the essay ID and xml:id of the words) and over the open-ended
+# teacher comments, for phrase and proximity queries without a corpus pass
+# (e.g. counting the occurrences of the expressions of a lexicon)
+#
+# Run: python corpus_index.py build path_to_data corpus.idx [n_jobs]
+#      python corpus_index.py query corpus.idx "for example" ["in addition" max_distance]
+
+import os
+import pickle
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from process_corpus import filter_files, load_xml, get_essay_sentences
+from records import encode_tokens, decode_tokens
+
+doc_kinds = {"essay": 0, "note": 1}
+
+def tokenize(text):
+    """ Tokens of comments and queries: lowercased words and punctuation marks
+    (essay words are the lowercased <w> elements).
+    """
+    return re.findall(r"[\w']+|[^\w\s]", text.lower())
+
+def get_index_files(path_to_data):
+    """ (semester, path) of all essay versions and notes files of the corpus.
+    """
+    index_files = []
+    for semester in filter_files(path_to_data):
+        for course in filter_files(os.path.join(path_to_data,semester)):
+            for assignment in filter_files(os.path.join(path_to_data,semester,course)):
+                folder = os.path.join(path_to_data,semester,course,assignment)
+                index_files.extend([(semester, os.path.join(folder, data_file)) for data_file in filter_files(folder)
+                                    if data_file.endswith("_fixed.xml") or data_file.endswith("_fixed_notes.xml")])
+    return index_files
+
+def index_shard(index_files):
+    """ Documents and postings of a list of files: an essay version is one
+    document ('essay', essay ID, word IDs), a comment is one document ('note',
+    essay ID, target, comment).
+    Returns the list of documents and a dictionary of term -> list of
+    (document index, position) pairs.
+    """
+    docs = []
+    postings = {}
+    for semester, path in index_files:
+        essay_id = "_".join([semester] + os.path.basename(path).split("_")[:6])
+        xml_root = load_xml(path)
+        if path.endswith("_notes.xml"):
+            texts = [(("note", essay_id, note.attrib.get("target", ""), note.text), tokenize(note.text))
+                     for note in xml_root.iter("{http://www.tei-c.org/ns/1.0}note") if note.text]
+        else:
+            words = [word for sent in get_essay_sentences(xml_root)["tokens"] for word in sent]
+            texts = [(("essay", essay_id, encode_tokens([word_id for word_id, _ in words])),
+                      [word.lower() for _, word in words])]
+        for doc, tokens in texts:
+            for pos, token in enumerate(tokens):
+                postings.setdefault(token, []).append((len(docs), pos))
+            docs.append(doc)
+    return docs, postings
+
+def encode_varints(values):
+    """ Variable-byte encoding (7 bits per byte, high bit set on all but the
+    last byte of a value) of an array of integers < 2^35.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    nr_bytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 5):
+        nr_bytes += values >= np.uint64(1 << (7 * k))
+    ends = np.cumsum(nr_bytes)
+    value_ix = np.repeat(np.arange(len(values)), nr_bytes)
+    byte_ix = np.arange(ends[-1]) - np.repeat(ends - nr_bytes, nr_bytes)
+    encoded = (values[value_ix] >> (7 * byte_ix).astype(np.uint64)) & np.uint64(127)
+    encoded[byte_ix < nr_bytes[value_ix] - 1] |= np.uint64(128)
+    return encoded.astype(np.uint8).tobytes()
+
+def decode_varints(data):
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(encoded < 128) + 1
+    starts = np.concatenate(([0], ends[:-1]))
+    byte_ix = np.arange(len(encoded)) - np.repeat(starts, ends - starts)
+    parts = (encoded & 127).astype(np.uint64) << (7 * byte_ix).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+def encode_postings(doc_ixs, positions):
+    """ Postings sorted by document and position as varints of (document gap,
+    position gap within the document / position in a new document) pairs.
+    """
+    doc_ixs = np.asarray(doc_ixs, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    doc_gaps = np.diff(doc_ixs, prepend=0)
+    pos_gaps = np.where(doc_gaps == 0, np.diff(positions, prepend=0), positions)
+    pos_gaps[0] = positions[0]
+    return encode_varints(np.column_stack((doc_gaps, pos_gaps)).ravel())
+
+def decode_postings(data):
+    """ Returns arrays of the document indices and positions of encoded postings.
+    """
+    gaps = decode_varints(data).astype(np.int64).reshape(-1, 2)
+    doc_ixs = np.cumsum(gaps[:, 0])
+    new_doc = np.ones(len(gaps), dtype=bool)
+    new_doc[1:] = gaps[1:, 0] > 0
+    sums = np.cumsum(gaps[:, 1])
+    doc_start = np.maximum.accumulate(np.where(new_doc, np.arange(len(gaps)), 0))
+    return doc_ixs, sums - sums[doc_start] + gaps[doc_start, 1]
+
+def build_index(path_to_data, index_file=None, n_jobs=1, nr_shards=None):
+    """ Indexes the corpus in shards of consecutive files (n_jobs worker
+    processes) and merges the shards. Returns the index and saves it to
+    index_file if given.
+    The index is a dictionary with
+    'docs':     list of documents (see index_shard()),
+    'vocab':    term -> (offset, length) of its postings in 'postings',
+    'postings': varint encoded postings of all terms (see encode_postings())
+    """
+    index_files = get_index_files(path_to_data)
+    nr_shards = nr_shards or max(n_jobs * 4, 1)
+    shard_size = -(-len(index_files) // nr_shards) or 1
+    shards = [index_files[ix:ix+shard_size] for ix in range(0, len(index_files), shard_size)]
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            shard_results = list(executor.map(index_shard, shards))
+    else:
+        shard_results = [index_shard(shard) for shard in shards]
+    docs = []
+    merged = {}
+    for shard_docs, shard_postings in shard_results:
+        for term, pairs in shard_postings.items():
+            merged.setdefault(term, []).extend([(len(docs) + doc_ix, pos) for doc_ix, pos in pairs])
+        docs.extend(shard_docs)
+    vocab = {}
+    postings = []
+    offset = 0
+    for term in sorted(merged):
+        doc_ixs, positions = zip(*merged.pop(term))
+        encoded = encode_postings(doc_ixs, positions)
+        vocab[term] = (offset, len(encoded))
+        postings.append(encoded)
+        offset += len(encoded)
+    index = {"docs": docs, "vocab": vocab, "postings": b"".join(postings)}
+    print("{} files, {} documents, {} terms, {} bytes of postings".format(
+          len(index_files), len(docs), len(vocab), offset))
+    if index_file:
+        with open(index_file, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return index
+
+def load_index(index_file):
+    with open(index_file, "rb") as f:
+        return pickle.load(f)
+
+def get_postings(index, term, kind=None):
+    """ Document indices and positions of a term (only documents of the given
+    kind, 'essay' or 'note', if kind is given).
+    """
+    if term not in index["vocab"]:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    offset, length = index["vocab"][term]
+    doc_ixs, positions = decode_postings(index["postings"][offset:offset+length])
+    if kind:
+        if "kinds" not in index:
+            index["kinds"] = np.array([doc_kinds[doc[0]] for doc in index["docs"]], dtype=np.int8)
+        keep = index["kinds"][doc_ixs] == doc_kinds[kind]
+        doc_ixs, positions = doc_ixs[keep], positions[keep]
+    return doc_ixs, positions
+
+def find_phrase(index, phrase, kind=None):
+    """ Occurrences of a phrase (a single term or consecutive terms).
+    Returns a sorted array of keys document index * 2^32 + start position.
+    """
+    matches = None
+    for ix, term in enumerate(tokenize(phrase)):
+        doc_ixs, positions = get_postings(index, term, kind)
+        keep = positions >= ix
+        keys = (doc_ixs[keep] << 32) + positions[keep] - ix
+        matches = keys if matches is None else np.intersect1d(matches, keys, assume_unique=True)
+    return matches if matches is not None else np.zeros(0, dtype=np.int64)
+
+def find_near(index, phrase_a, phrase_b, max_distance=5, ordered=False, kind=None):
+    """ Occurrences of phrase_a with an occurrence of phrase_b starting at most
+    max_distance tokens before or after it (only after it if ordered) in the
+    same document.
+    Returns a list of (document index, position of phrase_a, position of the nearest phrase_b).
+    """
+    keys_a, keys_b = find_phrase(index, phrase_a, kind), find_phrase(index, phrase_b, kind)
+    if not len(keys_a) or not len(keys_b):
+        return []
+    first = np.searchsorted(keys_b, keys_a + 1 if ordered else keys_a - max_distance)
+    last = np.searchsorted(keys_b, keys_a + max_distance, side="right")
+    matches = []
+    for key_a, start, end in zip(keys_a, first, last):
+        near = [key_b for key_b in keys_b[start:end] if key_b >> 32 == key_a >> 32 and key_b != key_a]
+        if near:
+            key_b = min(near, key=lambda key_b: abs(int(key_b) - int(key_a)))
+            matches.append((int(key_a >> 32), int(key_a & 0xFFFFFFFF), int(key_b & 0xFFFFFFFF)))
+    return matches
+
+def count_phrases(index, phrases, kind=None):
+    """ Number of occurrences of each phrase, e.g. of the expressions of a
+    lexicon such as linking_words.txt. Returns a Counter.
+    """
+    return Counter({phrase: len(find_phrase(index, phrase, kind)) for phrase in phrases})
+
+def get_hit(index, doc_ix, position, length=1):
+    """ Readable hit: (essay ID, word IDs) for essays, (essay ID, target, comment) for comments.
+    """
+    doc = index["docs"][doc_ix]
+    if doc[0] == "essay":
+        return doc[1], decode_tokens(doc[2][position:position+length])
+    return doc[1], doc[2], doc[3]
+
+def print_hits(index, keys, length=1, top_n=20):
+    print("{} hits".format(len(keys)))
+    for key in keys[:top_n]:
+        print(*get_hit(index, int(key >> 32), int(key & 0xFFFFFFFF), length), sep="\t")
+
+if __name__ == "__main__":
+    if sys.argv[1] == "build":
+        build_index(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else 1)
+    else:
+        corpus_index = load_index(sys.argv[2])
+        if len(sys.argv) > 4:
+            for doc_ix, pos_a, pos_b in find_near(corpus_index, sys.argv[3], sys.argv[4],
+                                                  int(sys.argv[5]) if len(sys.argv) > 5 else 5)[:20]:
+                print(*get_hit(corpus_index, doc_ix, min(pos_a, pos_b), abs(pos_b - pos_a) + 1), sep="\t")
+        else:
+            print_hits(corpus_index, find_phrase(corpus_index, sys.argv[3]), len(tokenize(sys.argv[3])))
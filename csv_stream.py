@@ -0,0 +1,61 @@
+# Streaming reading of CSV rows and chunked writing of output lines, so that
+# feature extraction (extract_features.py) does not hold whole files in memory
+
+import csv
+from itertools import islice
+
+def iter_rows(data_file, start=0, stop=None, predicate=None, delimiter=","):
+    """ Yields the CSV rows with index start <= index < stop (the first row,
+    e.g. the header, has index 0) for which predicate(row) is true, reading
+    the file row by row and stopping after row stop - 1.
+    @ stop:      None for all rows until the end of the file
+    @ predicate: function(row) -> bool, None keeps all rows
+    """
+    with open(data_file, newline='') as csvfile:
+        for row in islice(csv.reader(csvfile, delimiter=delimiter), start, stop):
+            if predicate is None or predicate(row):
+                yield row
+
+class ChunkedWriter:
+    """ Collects output lines with append() and writes them every chunk_size
+    lines. Plain lines are separated by newlines without a final newline
+    (the same output as writing "\\n".join(lines)); with as_csv, items are
+    lists of values written as CSV rows.
+    Usage:
+        with ChunkedWriter("features.txt") as feature_values:
+            feature_values.append("0.5,3,1")
+    """
+    def __init__(self, file_name, chunk_size=1000, as_csv=False):
+        self.chunk_size = chunk_size
+        self.as_csv = as_csv
+        self.chunk = []
+        self.nr_lines = 0
+        self.f = open(file_name, "w", newline="" if as_csv else None)
+        self.csv_writer = csv.writer(self.f) if as_csv else None
+
+    def append(self, line):
+        self.chunk.append(line)
+        self.nr_lines += 1
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunk:
+            if self.as_csv:
+                self.csv_writer.writerows(self.chunk)
+            else:
+                self.f.write(("\n" if self.nr_lines > len(self.chunk) else "") + "\n".join(self.chunk))
+            self.chunk = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __len__(self):
+        return self.nr_lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
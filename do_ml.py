@@ -1,21 +1,13 @@
 import os
-import random
-import spacy
-import scipy
 import pickle
 import numpy as np
 from extract_features import extract_features, extract_features_LA
+from feat_selection import get_feature_scores, get_top_k_mask, k_sweep, print_k_sweep
+from bootstrap_eval import bootstrap_scores, bootstrap_retrain, get_bootstrap_report, print_bootstrap_report
 from collections import Counter
-from sklearn.dummy import DummyClassifier
-from sklearn.linear_model import LogisticRegression, LinearRegression
-from sklearn.ensemble import RandomForestClassifier
-from sklearn import svm
-from sklearn import preprocessing
-from sklearn.feature_selection import chi2, f_classif, mutual_info_classif, SelectKBest, VarianceThreshold
-from sklearn.model_selection import cross_validate, train_test_split
-import matplotlib
-import matplotlib.pyplot as plt
-from scipy import stats
+# scipy, sklearn and matplotlib are imported by the functions using them
+# to keep the start-up time of scripts not needing them low
+# (check with: python -X importtime -c "import do_ml")
 
 def to_float(feature_vals):
     num_vals = []
@@ -35,7 +27,13 @@ def get_ml_data_stats(X,y):
     for k,v in label_distr.items():
         print(map_back_rs[int(k)], "\t", v)
 
-def load_ml_data(features_file_name, label_file_name, feat_names_fname):
+def load_ml_data(features_file_name, label_file_name, feat_names_fname, comments_file=None, 
+                 n_hash_features=2**18):
+    """ Loads the features, labels and feature names saved by extract_features_LA().
+    Returns (X, y, feature names), and with a comments_file also the hashed 
+    n-gram features of the comments as a sparse matrix (see text_features.py)
+    as fourth element, to be passed to eval_cl() as X_text.
+    """
 
     with open(features_file_name, newline='') as features_file:
         X = np.array([to_float(line.strip("\n").split(",")) for line in features_file.readlines()])
@@ -47,44 +45,113 @@ def load_ml_data(features_file_name, label_file_name, feat_names_fname):
     for name in feature_names:
        print(name)
     print()
+    if comments_file:
+        from text_features import get_hashed_features, iter_comments
+        X_text = get_hashed_features(iter_comments(comments_file), n_hash_features)
+        print("Hashed n-gram features", X_text.shape, X_text.nnz, "non-zero")
+        return (X, y, feature_names, X_text)
     return (X, y, feature_names)
 
-def split_train_test(X, y, test_ratio, balance):
-    """ mimics sklearn's train_test_split() which raises error
-    on dataset.
+def balance_ix(ix, y, ratio, rng):
+    """ Subsamples the indices of the larger classes to at most ratio times the
+    size of the smallest class. Empty index arrays are returned unchanged.
     """
-    random.seed(9)
-    random.shuffle(X)
-    random.shuffle(y)
-    merged = []
-    for ix, x in enumerate(X):
-        inst = np.append(x,float(y[ix]))
-        merged.append(inst)
-    if balance:
-        revised = [x for x in merged if x[-1] == 3.0][:404]
+    if not len(ix):
+        return ix
+    labels, counts = np.unique(y[ix], return_counts=True)
+    max_count = int(round(counts.min() * ratio))
+    kept = [rng.permutation(ix[y[ix] == label])[:max_count] for label in labels]
+    return np.sort(np.concatenate(kept))
+
+def get_split_ix(y, test_ratio=0.2, balance=False, groups=None, seed=9, labels=("3", "0")):
+    """ Index based, stratified train-test split: a share of test_ratio of the
+    instances of each label is used for testing. Only instances with one of 
+    the labels are kept.
+    Returns a tuple of (train indices, test indices).
+    @ balance: False, or the maximum ratio of the size of the other classes to the smallest 
+               class (True = 1.0), applied to train and test set separately
+    @ groups:  group ID per instance (e.g. essay ID), instances of a group are kept in the
+               same set; groups are stratified on the label of their first instance
+    @ seed:    seed or numpy SeedSequence
+    """
+    rng = np.random.default_rng(seed)
+    y = np.asarray(y)
+    ix = np.flatnonzero(np.isin(y, labels))
+    if groups is None:
+        unit_ix = ix                    # one unit per instance
     else:
-        revised = [x for x in merged if x[-1] == 3.0]
-    same = [x for x in merged if x[-1] == 0.0]
-    test_amount_rev = int(round(len(revised)*test_ratio))
-    test_amount_same = int(round(len(same)*test_ratio))
-    X_train = np.array([x[:-1] for x in revised[test_amount_rev:]+same[test_amount_same:]])
-    y_train = np.array([str(x[-1])[0] for x in revised[test_amount_rev:]+same[test_amount_same:]])
-    X_test = np.array([x[:-1] for x in revised[:test_amount_rev]+same[:test_amount_same]])
-    y_test = np.array([str(x[-1])[0] for x in revised[:test_amount_rev]+same[:test_amount_same]])
+        group_ids, first_ix, unit_of = np.unique(np.asarray(groups)[ix], return_index=True, return_inverse=True)
+        unit_ix = ix[first_ix]          # one unit per group, labelled by its first instance
+    test_units = []
+    for label in labels:
+        label_units = np.flatnonzero(y[unit_ix] == label)
+        test_units.append(rng.permutation(label_units)[:int(round(len(label_units)*test_ratio))])
+    is_test = np.zeros(len(unit_ix), dtype=bool)
+    is_test[np.concatenate(test_units)] = True
+    if groups is not None:
+        is_test = is_test[unit_of]
+    train_ix, test_ix = ix[~is_test], ix[is_test]
+    if balance:
+        ratio = 1.0 if balance is True else balance
+        train_ix = balance_ix(train_ix, y, ratio, rng)
+        test_ix = balance_ix(test_ix, y, ratio, rng)
+    return (rng.permutation(train_ix), rng.permutation(test_ix))
+
+def get_splits(y, n_repeats=10, test_ratio=0.2, balance=False, groups=None, seed=9, labels=("3", "0")):
+    """ Independent seeded train-test splits (see get_split_ix()) for repeated experiments.
+    Returns a list of (train indices, test indices).
+    """
+    return [get_split_ix(y, test_ratio, balance, groups, child_seed, labels) 
+            for child_seed in np.random.SeedSequence(seed).spawn(n_repeats)]
+
+def split_train_test(X, y, test_ratio, balance, groups=None, seed=9, return_ix=False):
+    """ mimics sklearn's train_test_split() which raises error
+    on dataset (see get_split_ix()).
+    @ return_ix: also return the train and test indices
+    """
+    train_ix, test_ix = get_split_ix(y, test_ratio, balance, groups, seed)
+    X, y = np.asarray(X), np.asarray(y)
+    X_train, y_train = X[train_ix], y[train_ix]
+    X_test, y_test = X[test_ix], y[test_ix]
     print("Label distr (train)")
     get_ml_data_stats(X_train,y_train)
     print("Label distr (test)")
     get_ml_data_stats(X_test,y_test)
     print()
+    if return_ix:
+        return (X_train, y_train, X_test, y_test, train_ix, test_ix)
     return (X_train, y_train, X_test, y_test)
 
+def eval_repeated(X, y, clfs, n_repeats=10, test_ratio=0.2, balance=False, groups=None, seed=9):
+    """ Test accuracy of each classifier over n_repeats seeded train-test splits
+    (features scaled with the training set statistics of each split).
+    Returns a dictionary of classifier name -> array of accuracies.
+    """
+    from sklearn.base import clone
+    from sklearn.preprocessing import StandardScaler
+    X, y = np.asarray(X, dtype=float), np.asarray(y)
+    accs = {clf_name.strip(): np.zeros(n_repeats) for clf_name, _ in clfs}
+    for rep, (train_ix, test_ix) in enumerate(get_splits(y, n_repeats, test_ratio, balance, groups, seed)):
+        scaler = StandardScaler().fit(X[train_ix])
+        X_train, X_test = scaler.transform(X[train_ix]), scaler.transform(X[test_ix])
+        for clf_name, clf in clfs:
+            accs[clf_name.strip()][rep] = clone(clf).fit(X_train, y[train_ix]).score(X_test, y[test_ix])
+    for clf_name, clf_accs in accs.items():
+        print("{:<12}{:<8}+-{:<8}({} splits)".format(clf_name, round(clf_accs.mean(), 3), 
+                                                    round(clf_accs.std(), 3), n_repeats))
+    return accs
+
 def eval_features(X_train, y_train, feature_names):
+    from sklearn.feature_selection import chi2
     chi2_vals, p_vals = chi2(X_train, y_train)
     for ix, name in enumerate(feature_names):
         print("{:<20}{:<8}{:<8}".format(name, round(chi2_vals[ix], 3), round(p_vals[ix], 3)))
     print()
 
 def get_classifiers(svm_cl=False):
+    from sklearn.dummy import DummyClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn import svm
     b_line = ("Baseline   ", DummyClassifier(strategy="most_frequent"))
     l1_LR_clf = ("Log_Regr   ", LogisticRegression(solver='lbfgs'))
     if svm_cl:
@@ -93,22 +160,53 @@ def get_classifiers(svm_cl=False):
     else:
         return [b_line, l1_LR_clf]
 
-def eval_cl(X,y,clfs,feature_names,cv_folds,test_ratio=0.2, balance=False, select_f=True):
+def eval_cl(X,y,clfs,feature_names,cv_folds,test_ratio=0.2, balance=False, select_f=True,
+            n_boot=0, retrain=False, n_jobs=1, k=12, scorer="mutual_info", score_seed=0, ks=None,
+            groups=None, split_seed=9, X_text=None):
+    """ Trains and evaluates the classifiers on a train-test split.
+    @ balance:    False or maximum class size ratio (see get_split_ix())
+    @ groups:     group ID per instance (e.g. essay ID) kept in the same set
+    @ split_seed: seed of the train-test split
+    @ X_text:     sparse hashed n-gram features (rows as in X, see load_ml_data()), 
+                  stacked after the selected and scaled features
+    @ select_f:   keep only the k best features (scores are cached, see feat_selection.py)
+    @ scorer:     feature scoring function ('mutual_info', 'chi2' or 'f_classif')
+    @ ks:         list of k values to evaluate in addition (k-sweep from the same ranking)
+    @ n_boot:  number of bootstrap resamples for confidence intervals and 
+               paired significance tests (0: single test accuracy only)
+    @ retrain: also retrain classifiers on resampled training sets
+    @ n_jobs:  number of worker processes used for bootstrapping and k-sweep
+    Returns a tuple of (y_test, dictionary of predictions per classifier).
+    """
+    from sklearn import preprocessing
     dev_scores = {} # will contain: {"svm":(acc,f1,prec,recall)} etc
+    X = np.array(X)
     if select_f:
-        selector = SelectKBest(mutual_info_classif, k=12) #chi2 f_classif, mutual_info_classif
+        scores = get_feature_scores(X, y, scorer, seed=score_seed) #chi2 f_classif, mutual_info_classif
         #selector = VarianceThreshold(threshold=(.8 * (1 - .8)))
-        X = selector.fit_transform(X, y)
-        feat_scores = sorted(zip(selector.scores_, feature_names), reverse=True)
+        feat_scores = sorted(zip(scores, feature_names), reverse=True)
         for score, name in feat_scores:
             print("{:<20}\t{:<8}".format(name, round(score, 3))) 
-    X_train, y_train, X_test, y_test = split_train_test(X, y, test_ratio, balance=balance)
+    X_train, y_train, X_test, y_test, train_ix, test_ix = split_train_test(X, y, test_ratio, balance, groups, 
+                                                                           split_seed, return_ix=True)
+    if select_f:
+        if ks:
+            print_k_sweep(k_sweep(X_train, y_train, X_test, y_test, clfs, scores, ks, n_jobs=n_jobs))
+        mask = get_top_k_mask(scores, k)
+        X_train = X_train[:, mask]
+        X_test = X_test[:, mask]
     print(X_train.shape)
     print(X_test.shape)
     #eval_features(X_train, y_train, feature_names)
     X_train = preprocessing.scale(X_train)
     X_test = preprocessing.scale(X_test)
+    if X_text is not None:
+        from text_features import stack_features
+        X_train = stack_features(X_train, X_text[train_ix])
+        X_test = stack_features(X_test, X_text[test_ix])
+        print("With hashed n-grams:", X_train.shape)
 
+    preds = {}
     for clf_tuple in clfs:
         clf_name, clf = clf_tuple
         # train
@@ -117,18 +215,27 @@ def eval_cl(X,y,clfs,feature_names,cv_folds,test_ratio=0.2, balance=False, selec
         y_pred = clf.predict(X_test)
         # evaluate
         print(clf_name, round(clf.score(X_test, y_test),3), "test")
+        preds[clf_name.strip()] = y_pred
+    if n_boot:
+        if retrain:
+            boot_scores = bootstrap_retrain(X_train, y_train, X_test, y_test, clfs, n_boot, n_jobs=n_jobs)
+        else:
+            boot_scores = bootstrap_scores(y_test, preds, n_boot, n_jobs=n_jobs)
+        clf_rows, pair_rows = get_bootstrap_report(y_test, preds, boot_scores)
+        print_bootstrap_report(clf_rows, pair_rows)
+    return (y_test, preds)
 
 def plot_correl(x,y):
+    import matplotlib
+    import matplotlib.pyplot as plt
     matplotlib.style.use('ggplot')
     plt.scatter(x, y)
     plt.show()
 
 def get_vals_per_feat(X, feature_names):
     # get values for all instances per feature
-    vals_per_feat = {}
-    for ix, feature_name in enumerate(feature_names):
-        vals_per_feat[feature_name] = [row[ix] for row in list(X)]
-    return vals_per_feat
+    X = np.asarray(X)
+    return {feature_name: X[:, ix] for ix, feature_name in enumerate(feature_names)}
 
 def map_labels(y, data_type = "rev_suc"):
     labels = []
@@ -150,17 +257,19 @@ def compute_correls(vals_per_feat, labels, feature_names):
     (two (or more) normally distributed interval variables)
     TO DO: map label to continupus (edit dist) 
     """
+    from feature_stats import correl_matrix
     #plot_correl(vals_per_feat["meta_ratio"],y)
     
+    X = np.column_stack(list(vals_per_feat.values()))
+    coefs, pvals = correl_matrix(X, labels, method="spearman")
     print("{:<20}\t{:<8}\t{:<8}\t{:<8}".format("Feat name", "Mean", "Corr", "p"))
-    for feat_name, vals in vals_per_feat.items():
-        #coef, pval = scipy.stats.pearsonr(vals, labels)
-        coef, pval = scipy.stats.spearmanr(vals, labels)
+    for ix, feat_name in enumerate(vals_per_feat):
+        coef, pval = coefs[ix], pvals[ix]
         if pval < 0.05:
-            print("{:<20}\t{:<8}\t{:<8}\t{:<8} *".format(feat_name, round(np.mean(vals), 3), round(coef, 3), round(pval, 3)))
+            print("{:<20}\t{:<8}\t{:<8}\t{:<8} *".format(feat_name, round(np.mean(X[:, ix]), 3), round(coef, 3), round(pval, 3)))
         else:
-            print("{:<20}\t{:<8}\t{:<8}\t{:<8}".format(feat_name, round(np.mean(vals), 3), round(coef, 3), round(pval, 3)))        
-    nr_items = len(vals)
+            print("{:<20}\t{:<8}\t{:<8}\t{:<8}".format(feat_name, round(np.mean(X[:, ix]), 3), round(coef, 3), round(pval, 3)))        
+    nr_items = X.shape[0]
     print("Nr items: ", nr_items)
     print("% of bad", round(len([lb for lb in labels if lb == 2]) / nr_items * 100, 2))
     #print("% of no revision", round(len([lb for lb in labels if lb == 0]) / nr_items * 100, 2))
@@ -171,14 +280,15 @@ def compute_ttest(vals_per_feat, labels):
     Tests whether the mean is the same for an interval dependent variable 
     for two independent groups ('revised' vs. 'same' here).
     """
+    from feature_stats import welch_ttest_matrix
     print("T-test")
     print("{:<20}\t{:<8}\t{:<8}\t{:<8}\t{:<8}\t{:<8}".format("Feat name", "Mean-G", "Mean-B", "Diff", "Stat", "p"))
-    for feat_name, vals in vals_per_feat.items():
-        good = [val for (lbl, val) in zip(labels, vals_per_feat[feat_name]) if lbl == 1]
-        bad = [val for (lbl, val) in zip(labels, vals_per_feat[feat_name]) if lbl == -1]
-        stat, pval = stats.ttest_ind(good,bad, equal_var = False)
-        mean_good = round(np.mean(good), 3)
-        mean_bad = round(np.mean(bad), 3)
+    X = np.column_stack(list(vals_per_feat.values()))
+    means_good, means_bad, t_stats, pvals = welch_ttest_matrix(X, labels)
+    for ix, feat_name in enumerate(vals_per_feat):
+        stat, pval = t_stats[ix], pvals[ix]
+        mean_good = round(means_good[ix], 3)
+        mean_bad = round(means_bad[ix], 3)
         mean_diff = round(mean_good-mean_bad, 3)
         if pval < 0.05:
             print("{:<20}\t{:<8}\t{:<8}\t{:<8}\t{:<8}\t{:<8} **".format(feat_name, mean_good, mean_bad, mean_diff,
@@ -0,0 +1,95 @@
+# Cached feature scoring for univariate feature selection (SelectKBest)
+# and evaluation of multiple k values from the same feature ranking
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import numpy as np
+
+def get_score_func(scorer, seed=0):
+    """ Returns a function computing one score per feature, given X and y.
+    @ scorer: 'mutual_info', 'chi2' or 'f_classif'
+    @ seed:   random state of the (kNN-based) mutual information estimator
+    """
+    from sklearn.feature_selection import chi2, f_classif, mutual_info_classif
+    if scorer == "mutual_info":
+        return lambda X, y: mutual_info_classif(X, y, random_state=seed)
+    elif scorer == "chi2":
+        return lambda X, y: chi2(X, y)[0]
+    elif scorer == "f_classif":
+        return lambda X, y: f_classif(X, y)[0]
+    raise ValueError("Unknown feature scorer: {}".format(scorer))
+
+def get_cache_key(X, y, scorer, seed):
+    """ Hash of the feature matrix, the labels, the scorer and the seed.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    key = hashlib.sha1()
+    key.update(str(X.shape).encode())
+    key.update(X.tobytes())
+    key.update("\n".join([str(lbl) for lbl in y]).encode())
+    key.update("{}_{}".format(scorer, seed).encode())
+    return key.hexdigest()
+
+def get_feature_scores(X, y, scorer="mutual_info", seed=0, cache_dir="feat_score_cache"):
+    """ Returns one score per feature (column of X). Scores are computed only
+    once per (feature set, labels, scorer, seed) and saved to cache_dir.
+    @ cache_dir: folder for cached scores (None to disable caching)
+    """
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, get_cache_key(X, y, scorer, seed) + ".npy")
+        if os.path.exists(cache_file):
+            return np.load(cache_file)
+    scores = np.asarray(get_score_func(scorer, seed)(X, y), dtype=np.float64)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_file, scores)
+    return scores
+
+def get_top_k_mask(scores, k):
+    """ Boolean mask of the k highest scoring features, with the same
+    tie breaking as sklearn's SelectKBest.
+    """
+    mask = np.zeros(len(scores), dtype=bool)
+    if k == "all" or k >= len(scores):
+        mask[:] = True
+    elif k > 0:
+        scores = np.nan_to_num(scores, nan=-np.inf)
+        mask[np.argsort(scores, kind="mergesort")[-k:]] = True
+    return mask
+
+def _eval_k(k, scores, X_train, y_train, X_test, y_test, clfs):
+    """ Test accuracy of each classifier using the k best features only.
+    """
+    from sklearn import preprocessing
+    from sklearn.base import clone
+    mask = get_top_k_mask(scores, k)
+    X_train = preprocessing.scale(X_train[:, mask])
+    X_test = preprocessing.scale(X_test[:, mask])
+    accs = {}
+    for clf_name, clf in clfs:
+        clf = clone(clf).fit(X_train, y_train)
+        accs[clf_name.strip()] = clf.score(X_test, y_test)
+    return accs
+
+def k_sweep(X_train, y_train, X_test, y_test, clfs, scores, ks, n_jobs=1):
+    """ Evaluates the classifiers for several numbers of selected features.
+    Features are ranked once by the (cached) scores, see get_feature_scores().
+    Returns a dictionary with k as key and {classifier name: accuracy} as value.
+    @ ks:     list of the numbers of best features to keep
+    @ n_jobs: number of worker processes (one k value per task)
+    """
+    args = [(k, scores, X_train, y_train, X_test, y_test, clfs) for k in ks]
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_eval_k, *zip(*args)))
+    else:
+        results = [_eval_k(*arg) for arg in args]
+    return dict(zip(ks, results))
+
+def print_k_sweep(sweep_results):
+    clf_names = list(next(iter(sweep_results.values())).keys())
+    print(("{:<6}" + "{:<12}"*len(clf_names)).format("k", *clf_names))
+    for k, accs in sweep_results.items():
+        print(("{:<6}" + "{:<12}"*len(clf_names)).format(k, *[round(accs[name], 3) for name in clf_names]))
+    print()
@@ -0,0 +1,140 @@
+# Functions computing feature statistics (correlations, t-tests)
+# for all columns of the feature matrix at once
+
+import csv
+import numpy as np
+from scipy import stats
+
+STATS_FIELDS = [("feat_name", "U40"), ("mean", "f8"), ("coef", "f8"), ("p_coef", "f8"),
+                ("p_coef_adj", "f8"), ("mean_good", "f8"), ("mean_bad", "f8"), ("diff", "f8"),
+                ("t_stat", "f8"), ("p_ttest", "f8"), ("p_ttest_adj", "f8")]
+
+def rank_columns(X):
+    """ Ranks the values of each column of X separately (ties get
+    their average rank, as in scipy.stats.rankdata).
+    """
+    return stats.rankdata(X, axis=0)
+
+def correl_matrix(X, labels, method="spearman"):
+    """ Computes a Pearson or Spearman correlation coefficient between each
+    column of X and the labels, and the two-sided p-value for testing
+    non-correlation. Returns a tuple of arrays (coefs, p_vals).
+    @ X:      2D array of feature values (instances x features)
+    @ labels: 1D array of numeric labels
+    @ method: 'spearman' or 'pearson'
+    """
+    X = np.asarray(X, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    if method == "spearman":
+        X = rank_columns(X)
+        labels = stats.rankdata(labels)
+    n = X.shape[0]
+    X_c = X - X.mean(axis=0)
+    lbl_c = labels - labels.mean()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coefs = (lbl_c @ X_c) / np.sqrt((X_c**2).sum(axis=0) * (lbl_c**2).sum())
+        coefs = np.clip(coefs, -1.0, 1.0)
+        dof = n - 2
+        t_vals = coefs * np.sqrt(dof / ((1.0 - coefs) * (1.0 + coefs)))
+    p_vals = 2 * stats.t.sf(np.abs(t_vals), dof)
+    return (coefs, p_vals)
+
+def welch_ttest_matrix(X, labels, good_lbl=1, bad_lbl=-1):
+    """ Welch's T-test (unequal variances) for the means of two independent
+    groups ('good' vs. 'bad' revisions) computed for each column of X.
+    Returns a tuple of arrays (mean_good, mean_bad, t_stats, p_vals).
+    """
+    X = np.asarray(X, dtype=float)
+    labels = np.asarray(labels)
+    good = X[labels == good_lbl]
+    bad = X[labels == bad_lbl]
+    n_good, n_bad = good.shape[0], bad.shape[0]
+    mean_good = good.mean(axis=0)
+    mean_bad = bad.mean(axis=0)
+    var_good = good.var(axis=0, ddof=1) / n_good
+    var_bad = bad.var(axis=0, ddof=1) / n_bad
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_stats = (mean_good - mean_bad) / np.sqrt(var_good + var_bad)
+        dof = (var_good + var_bad)**2 / (var_good**2 / (n_good-1) + var_bad**2 / (n_bad-1))
+    p_vals = 2 * stats.t.sf(np.abs(t_stats), dof)
+    return (mean_good, mean_bad, t_stats, p_vals)
+
+def adjust_pvals(p_vals, method="fdr_bh"):
+    """ Corrects p-values for multiple comparisons.
+    @ method: 'bonferroni', 'holm' or 'fdr_bh' (Benjamini-Hochberg);
+              None returns the p-values unchanged
+    """
+    p_vals = np.asarray(p_vals, dtype=float)
+    if not method:
+        return p_vals.copy()
+    adjusted = np.full(p_vals.shape, np.nan)
+    valid = ~np.isnan(p_vals)
+    p = p_vals[valid]
+    m = len(p)
+    if not m:
+        return adjusted
+    if method == "bonferroni":
+        adj = p * m
+    elif method == "holm":
+        order = np.argsort(p)
+        adj_sorted = np.maximum.accumulate((m - np.arange(m)) * p[order])
+        adj = np.empty(m)
+        adj[order] = adj_sorted
+    elif method == "fdr_bh":
+        order = np.argsort(p)[::-1]
+        adj_sorted = np.minimum.accumulate(p[order] * m / np.arange(m, 0, -1))
+        adj = np.empty(m)
+        adj[order] = adj_sorted
+    else:
+        raise ValueError("Unknown correction method: {}".format(method))
+    adjusted[valid] = np.minimum(adj, 1.0)
+    return adjusted
+
+def get_feature_stats(X, labels, feature_names, method="spearman", correction="fdr_bh"):
+    """ Computes means, correlation with the labels and a Welch T-test
+    (good vs. bad revisions) for all features. Returns a structured NumPy
+    array with one record per feature (see STATS_FIELDS).
+    @ X:             2D array of feature values (instances x features)
+    @ labels:        labels mapped with do_ml.map_labels() (1 = good, -1 = bad)
+    @ feature_names: list of feature names, in column order
+    @ method:        correlation coefficient, 'spearman' or 'pearson'
+    @ correction:    multiple comparison correction (see adjust_pvals())
+    """
+    X = np.asarray(X, dtype=float)
+    coefs, p_coefs = correl_matrix(X, labels, method)
+    mean_good, mean_bad, t_stats, p_ttests = welch_ttest_matrix(X, labels)
+    table = np.zeros(X.shape[1], dtype=STATS_FIELDS)
+    table["feat_name"] = feature_names
+    table["mean"] = X.mean(axis=0)
+    table["coef"] = coefs
+    table["p_coef"] = p_coefs
+    table["p_coef_adj"] = adjust_pvals(p_coefs, correction)
+    table["mean_good"] = mean_good
+    table["mean_bad"] = mean_bad
+    table["diff"] = mean_good - mean_bad
+    table["t_stat"] = t_stats
+    table["p_ttest"] = p_ttests
+    table["p_ttest_adj"] = adjust_pvals(p_ttests, correction)
+    return table
+
+def print_stats_table(stats_table, alpha=0.05):
+    """ Prints the feature statistics, significant (adjusted) p-values
+    are marked with '*'.
+    """
+    print(("{:<20}\t" + "{:<8}\t"*9).format("Feat name", "Mean", "Corr", "p", "p_adj",
+                                             "Mean-G", "Mean-B", "Diff", "Stat", "p_adj"))
+    for rec in stats_table:
+        vals = [round(float(rec[field]), 3) for field in ["mean", "coef", "p_coef", "p_coef_adj",
+                                                          "mean_good", "mean_bad", "diff",
+                                                          "t_stat", "p_ttest_adj"]]
+        marks = ("*" if rec["p_coef_adj"] < alpha else " ") + (" **" if rec["p_ttest_adj"] < alpha else "")
+        print(("{:<20}\t" + "{:<8}\t"*9 + "{}").format(rec["feat_name"], *vals, marks))
+
+def write_stats_table(stats_table, csv_file):
+    """ Saves the feature statistics to a CSV file (one row per feature).
+    """
+    with open(csv_file, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(stats_table.dtype.names)
+        for rec in stats_table:
+            csv_writer.writerow(rec.tolist())
@@ -0,0 +1,104 @@
+# SQLite storage of the feedback records collected by process_corpus.get_data()
+
+import sqlite3
+
+COLUMNS = ["essay_id", "semester", "error_cat", "comment", "target_tokens", "rev_type", "rev_effort",
+           "st_sent", "st_rev_sent", "more_context", "more_context_rev"]
+INDEXED_COLUMNS = ["essay_id", "error_cat", "rev_type", "semester"]
+
+def open_db(db_file):
+    """ Opens (and if needed creates) the SQLite database with the
+    feedback table and its indexes. Returns the connection.
+    """
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS feedback (
+                        id INTEGER PRIMARY KEY,
+                        {},
+                        UNIQUE (essay_id, error_cat, target_tokens, comment))""".format(
+                 ",\n".join([col + " TEXT" for col in COLUMNS])))
+    for col in INDEXED_COLUMNS:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_{0} ON feedback ({0})".format(col))
+    conn.commit()
+    return conn
+
+def to_db_row(error_cat, record):
+    """ Maps a get_data() record (list of essay ID, comment, target tokens,
+    revision type, revision effort, sentences and contexts) to a database row.
+    The semester is the first element of the essay ID.
+    """
+    semester = record[0].split("_")[0]
+    return [record[0], semester, error_cat] + list(record[1:9])
+
+def upsert_records(conn, records, batch_size=1000):
+    """ Inserts records into the database, replacing the values of records
+    already stored with the same (essay ID, error category, target tokens,
+    comment). Committed in batches of batch_size rows.
+    @ records: iterable of (error_cat, get_data() record) tuples
+    """
+    update_cols = [col for col in COLUMNS if col not in ["essay_id", "error_cat", "target_tokens", "comment"]]
+    sql = """INSERT INTO feedback ({}) VALUES ({})
+             ON CONFLICT (essay_id, error_cat, target_tokens, comment) DO UPDATE SET {}""".format(
+          ", ".join(COLUMNS), ", ".join(["?"]*len(COLUMNS)),
+          ", ".join(["{0}=excluded.{0}".format(col) for col in update_cols]))
+    batch = []
+    for error_cat, record in records:
+        batch.append(to_db_row(error_cat, record))
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+
+def query_records(conn, columns=None, essay_id=None, error_cat=None, rev_type=None, semester=None,
+                  limit=None):
+    """ Returns the rows matching all the given criteria (None: no restriction)
+    as a list of tuples. A criterion can be a single value or a list of values.
+    e.g. query_records(conn, error_cat="open_ended", semester="2008-09A", rev_type="replace")
+    @ columns: list of columns to return (default: all in COLUMNS)
+    """
+    columns = columns or COLUMNS
+    for col in columns:
+        if col not in COLUMNS:
+            raise ValueError("Unknown column: {}".format(col))
+    conditions = []
+    params = []
+    for col, val in [("essay_id", essay_id), ("error_cat", error_cat),
+                     ("rev_type", rev_type), ("semester", semester)]:
+        if val is None:
+            continue
+        if isinstance(val, (list, tuple, set)):
+            conditions.append("{} IN ({})".format(col, ", ".join(["?"]*len(val))))
+            params.extend(val)
+        else:
+            conditions.append("{} = ?".format(col))
+            params.append(val)
+    sql = "SELECT {} FROM feedback".format(", ".join(columns))
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+def count_records(conn, group_by="error_cat"):
+    """ Returns the number of records per value of the group_by column.
+    """
+    if group_by not in COLUMNS:
+        raise ValueError("Unknown column: {}".format(group_by))
+    sql = "SELECT {0}, COUNT(*) FROM feedback GROUP BY {0} ORDER BY {0}".format(group_by)
+    return conn.execute(sql).fetchall()
+
+def import_comments(db_file, comments):
+    """ Saves an already collected comments dictionary (e.g. loaded from
+    the pickle saved by get_data()) to the database.
+    @ comments: dictionary with error category as key and list of records as value
+    """
+    conn = open_db(db_file)
+    upsert_records(conn, ((error_cat, record) for error_cat, records in comments.items()
+                          for record in records))
+    conn.close()
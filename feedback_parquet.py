@@ -0,0 +1,60 @@
+# Columnar (Apache Arrow / Parquet) storage of the feedback records
+# collected by process_corpus.get_data(), one row group per semester
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema([("semester", pa.dictionary(pa.int32(), pa.string())),
+                    ("essay_id", pa.string()),
+                    ("error_cat", pa.dictionary(pa.int32(), pa.string())),
+                    ("comment", pa.string()),
+                    ("target_tokens", pa.list_(pa.string())),
+                    ("rev_type", pa.dictionary(pa.int8(), pa.string())),
+                    ("rev_effort", pa.int8()),
+                    ("st_sent", pa.string()),
+                    ("st_rev_sent", pa.string()),
+                    ("more_context", pa.string()),
+                    ("more_context_rev", pa.string())])
+
+def open_parquet_writer(parquet_file, compression="zstd"):
+    """ Returns a writer to which row groups can be added as the
+    extraction progresses (see write_row_group()).
+    """
+    return pq.ParquetWriter(parquet_file, SCHEMA, compression=compression)
+
+def to_table(records):
+    """ Converts (error_cat, get_data() record) tuples to an Arrow table
+    with typed columns.
+    @ records: list of (error category, [essay ID, comment, target tokens,
+               revision type, revision effort, original sentence, revised sentence,
+               context, revised context]) tuples
+    """
+    columns = {name: [] for name in SCHEMA.names}
+    for error_cat, record in records:
+        columns["semester"].append(record[0].split("_")[0])
+        columns["essay_id"].append(record[0])
+        columns["error_cat"].append(error_cat)
+        columns["comment"].append(record[1])
+        columns["target_tokens"].append(record[2].split(",") if record[2] else [])
+        columns["rev_type"].append(record[3])
+        columns["rev_effort"].append(int(record[4]) if record[4] not in [None, ""] else None)
+        for ix, name in enumerate(["st_sent", "st_rev_sent", "more_context", "more_context_rev"]):
+            columns[name].append(record[5+ix])
+    return pa.table(columns, schema=SCHEMA)
+
+def write_row_group(writer, records):
+    """ Writes the records (e.g. all records of a semester) as a single row group.
+    """
+    if records:
+        table = to_table(records)
+        writer.write_table(table, row_group_size=table.num_rows)
+
+def read_records(parquet_file, columns=None, filters=None):
+    """ Reads only the requested columns, skipping row groups and rows that
+    do not match the filters (predicate pushdown). Returns an Arrow table
+    (use .to_pylist() or .to_pandas() for further processing).
+    e.g. read_records(f, columns=["comment", "rev_type"],
+                      filters=[("semester", "=", "2008-09A"), ("rev_type", "=", "replace")])
+    @ filters: list of (column, operator, value) tuples, see pyarrow.parquet.read_table()
+    """
+    return pq.read_table(parquet_file, columns=columns, filters=filters)
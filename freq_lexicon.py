@@ -0,0 +1,137 @@
+# Compiled, memory-mapped n-gram frequency lexicon
+# (replaces reading the plain text frequency files into dictionaries)
+#
+# File layout (little-endian):
+#   magic (8 bytes) | nr of n-grams n (uint64) | offsets (n+1 x uint64)
+#   | counts (n x int64) | UTF-8 n-grams sorted by bytes, concatenated
+#
+# Build once with:  python freq_lexicon.py freq_unigrams freq_bigrams
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"NGRLEX1\x00"
+HEADER = struct.Struct("<8sQ")
+
+def read_ngram_counts(ngram_file):
+    """ Reads a frequency file in the format of process_corpus.load_grams()
+    (one 'count<TAB>n-gram' per line). Returns a dictionary.
+    """
+    ngrams_dict = {}
+    with open(ngram_file, "r") as f:
+        for line in f:
+            if line.replace(" ", "") != "\n":
+                line_el = line.split("\t")
+                try:
+                    count = int(line_el[0])
+                except ValueError:
+                    print(line_el)
+                    continue
+                ngrams_dict[line_el[1].strip("\n")] = count
+    return ngrams_dict
+
+def build_lexicon(ngram_counts, lex_file):
+    """ Writes a compiled lexicon file.
+    @ ngram_counts: dictionary with n-gram as key and count as value,
+                    or path to a plain text frequency file
+    """
+    if isinstance(ngram_counts, str):
+        ngram_counts = read_ngram_counts(ngram_counts)
+    entries = sorted([(ngram.encode("utf-8"), count) for ngram, count in ngram_counts.items()])
+    offsets = array("Q", [0])
+    counts = array("q")
+    for key, count in entries:
+        offsets.append(offsets[-1] + len(key))
+        counts.append(count)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        counts.byteswap()
+    tmp_file = lex_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        offsets.tofile(f)
+        counts.tofile(f)
+        for key, count in entries:
+            f.write(key)
+    os.replace(tmp_file, lex_file)
+
+class FreqLexicon:
+    """ Read-only, dictionary-like view (get, in, [], len) on a compiled
+    lexicon file. The file is memory-mapped, so opening it costs almost
+    nothing and the pages are shared between processes; lookups are
+    binary searches over the sorted n-grams (O(log n)).
+    """
+    def __init__(self, lex_file):
+        with open(lex_file, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an n-gram lexicon file: {}".format(lex_file))
+        view = memoryview(self._mm)
+        offsets_start = HEADER.size
+        counts_start = offsets_start + 8 * (self._n + 1)
+        self._keys_start = counts_start + 8 * self._n
+        if sys.byteorder == "little":
+            self._offsets = view[offsets_start:counts_start].cast("Q")
+            self._counts = view[counts_start:self._keys_start].cast("q")
+        else:
+            self._offsets = array("Q", view[offsets_start:counts_start])
+            self._offsets.byteswap()
+            self._counts = array("q", view[counts_start:self._keys_start])
+            self._counts.byteswap()
+
+    def __len__(self):
+        return self._n
+
+    def _key(self, ix):
+        return self._mm[self._keys_start + self._offsets[ix]:self._keys_start + self._offsets[ix+1]]
+
+    def _find(self, ngram):
+        key = ngram.encode("utf-8")
+        low, high = 0, self._n
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self._n and self._key(low) == key:
+            return low
+        return -1
+
+    def get(self, ngram, default=None):
+        ix = self._find(ngram)
+        if ix < 0:
+            return default
+        return self._counts[ix]
+
+    def __getitem__(self, ngram):
+        ix = self._find(ngram)
+        if ix < 0:
+            raise KeyError(ngram)
+        return self._counts[ix]
+
+    def __contains__(self, ngram):
+        return self._find(ngram) >= 0
+
+    def items(self):
+        for ix in range(self._n):
+            yield (self._key(ix).decode("utf-8"), self._counts[ix])
+
+def load_lexicon(ngram_file, lex_file=None):
+    """ Opens the compiled lexicon of a plain text frequency file, (re)building
+    it first if it is missing or older than the frequency file.
+    """
+    lex_file = lex_file or ngram_file + ".lex"
+    if not os.path.exists(lex_file) or (os.path.exists(ngram_file) and
+                                        os.path.getmtime(lex_file) < os.path.getmtime(ngram_file)):
+        build_lexicon(ngram_file, lex_file)
+    return FreqLexicon(lex_file)
+
+if __name__ == "__main__":
+    for ngram_file in sys.argv[1:]:
+        build_lexicon(ngram_file, ngram_file + ".lex")
+        print("Lexicon saved to {}.lex".format(ngram_file))
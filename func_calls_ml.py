@@ -1,30 +1,52 @@
 import os
-from extract_features import extract_features, extract_features_LA
-from sklearn.linear_model import LinearRegression
+import sys
+from extract_features import extract_features, extract_features_LA, get_nlp
 from do_ml import *
 
 # Function calls
+# Run all steps or only some of them, e.g.: python func_calls_ml.py stats
+# (spaCy, sklearn and scipy are loaded only by the steps needing them)
 
-nlp = spacy.load("en_core_web_sm", disable=["ner", "textcat"])
 path = '/Users/ildiko/Documents/work/projects/CityU/venv_fbgen/results/' 
 
 data_file = "/Users/ildikop/Documents/projects/CityU/venv_fbgen/annotation/annotated/all_annot_info2.csv"
 features_file_name = path + "revision_success2.data"
 label_file_name = path + "revision_success2.target"
 feature_names_fname = path + "feature_names.txt"
-extract_features_LA(data_file, features_file_name, label_file_name, feature_names_fname, nlp, add_extra_var=True)
-
-X, y, feature_names = load_ml_data(features_file_name, label_file_name, "")
-clfs = get_classifiers(svm_cl=True)
-eval_cl(X,y,clfs,feature_names,cv_folds=3, balance=True, select_f=True)
-get_ml_data_stats(X,y)
-
-vals_per_feat = get_vals_per_feat(X, feature_names)
-labels = map_labels(y)
-compute_correls(vals_per_feat, labels, feature_names) # do on sent_align only (labels = interval)
-compute_ttest(vals_per_feat, labels)
-reg = LinearRegression().fit(X, y)
-print(reg.score(X, labels))
-print(reg.intercept_)
-for coef, fn in sorted(zip(reg.coef_, feature_names), reverse=True):
-   print("{:<20}\t{:<10}".format(fn, round(coef, 2)))
+
+def run_extract():
+    extract_features_LA(data_file, features_file_name, label_file_name, feature_names_fname, get_nlp(), add_extra_var=True)
+
+def run_ml():
+    X, y, feature_names = load_ml_data(features_file_name, label_file_name, "")
+    clfs = get_classifiers(svm_cl=True)
+    eval_cl(X,y,clfs,feature_names,cv_folds=3, balance=True, select_f=True, n_boot=5000, n_jobs=4,
+            k=12, ks=[4, 6, 8, 10, 12, 14])
+    get_ml_data_stats(X,y)
+
+def run_stats():
+    from feature_stats import get_feature_stats, print_stats_table, write_stats_table
+    X, y, feature_names = load_ml_data(features_file_name, label_file_name, "")
+    vals_per_feat = get_vals_per_feat(X, feature_names)
+    labels = map_labels(y)
+    compute_correls(vals_per_feat, labels, feature_names) # do on sent_align only (labels = interval)
+    compute_ttest(vals_per_feat, labels)
+    stats_table = get_feature_stats(X, labels, feature_names, method="spearman", correction="fdr_bh")
+    print_stats_table(stats_table)
+    write_stats_table(stats_table, path + "feature_stats.csv")
+
+def run_regression():
+    from sklearn.linear_model import LinearRegression
+    X, y, feature_names = load_ml_data(features_file_name, label_file_name, "")
+    labels = map_labels(y)
+    reg = LinearRegression().fit(X, y)
+    print(reg.score(X, labels))
+    print(reg.intercept_)
+    for coef, fn in sorted(zip(reg.coef_, feature_names), reverse=True):
+       print("{:<20}\t{:<10}".format(fn, round(coef, 2)))
+
+steps = {"extract": run_extract, "ml": run_ml, "stats": run_stats, "regression": run_regression}
+
+if __name__ == "__main__":
+    for step in sys.argv[1:] or steps:
+        steps[step]()
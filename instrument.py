@@ -0,0 +1,120 @@
+# Lightweight timing and counter instrumentation (e.g. for get_data() stages)
+
+import json
+import math
+import sys
+import time
+from collections import Counter
+
+class Stats:
+    """ Collects wall time per stage (count, total, max and a histogram with
+    power of 2 microsecond buckets) and named counters. Emits them as JSON
+    at the end of a run (emit()) or periodically (tick()).
+    Usage:
+        t0 = stats.start()
+        ...
+        stats.add_time("parse_xml", t0)
+        stats.count("notes_seen")
+    @ json_file: file to write the JSON to (default: stderr)
+    @ every:     minimum number of seconds between two periodic emissions (None: only at the end)
+    """
+    enabled = True
+
+    def __init__(self, json_file=None, every=None):
+        self.json_file = json_file
+        self.every = every
+        self.counters = Counter()
+        self.timings = {}
+        self.created = time.perf_counter()
+        self.last_emit = self.created
+
+    def start(self):
+        return time.perf_counter()
+
+    def add_time(self, stage, t0):
+        elapsed = time.perf_counter() - t0
+        timing = self.timings.get(stage)
+        if timing is None:
+            timing = self.timings[stage] = {"count": 0, "total_s": 0.0, "max_s": 0.0, "hist_us": Counter()}
+        timing["count"] += 1
+        timing["total_s"] += elapsed
+        if elapsed > timing["max_s"]:
+            timing["max_s"] = elapsed
+        bucket = 2 ** max(0, math.ceil(math.log2(max(elapsed * 1e6, 1))))
+        timing["hist_us"][bucket] += 1
+        return elapsed
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def count_nlp(self, nlp_pipeline):
+        """ Wraps a spaCy pipeline so that each call is counted as 'spacy_calls'.
+        """
+        if nlp_pipeline is None:
+            return None
+        def counted_nlp(text, *args, **kwargs):
+            self.counters["spacy_calls"] += 1
+            t0 = time.perf_counter()
+            doc = nlp_pipeline(text, *args, **kwargs)
+            self.add_time("spacy", t0)
+            return doc
+        return counted_nlp
+
+    def to_dict(self):
+        stages = {}
+        for stage, timing in self.timings.items():
+            stages[stage] = {"count": timing["count"],
+                             "total_s": round(timing["total_s"], 6),
+                             "mean_ms": round(timing["total_s"] / timing["count"] * 1000, 4),
+                             "max_ms": round(timing["max_s"] * 1000, 4),
+                             "hist_us": {str(b): n for b, n in sorted(timing["hist_us"].items())}}
+        return {"elapsed_s": round(time.perf_counter() - self.created, 6),
+                "stages": stages,
+                "counters": dict(self.counters)}
+
+    def emit(self, final=True):
+        """ Writes the current statistics as one JSON line.
+        """
+        report = self.to_dict()
+        report["final"] = final
+        line = json.dumps(report)
+        if self.json_file:
+            with open(self.json_file, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+        self.last_emit = time.perf_counter()
+
+    def tick(self):
+        """ Emits the statistics if at least 'every' seconds passed since the last emission.
+        """
+        if self.every and time.perf_counter() - self.last_emit >= self.every:
+            self.emit(final=False)
+
+class NullStats:
+    """ Same interface as Stats, doing nothing (used when instrumentation is disabled).
+    """
+    enabled = False
+
+    def start(self):
+        return 0
+
+    def add_time(self, stage, t0):
+        return 0
+
+    def count(self, name, n=1):
+        pass
+
+    def count_nlp(self, nlp_pipeline):
+        return nlp_pipeline
+
+    def to_dict(self):
+        return {}
+
+    def emit(self, final=True):
+        pass
+
+    def tick(self):
+        pass
+
+null_stats = NullStats()
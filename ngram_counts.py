@@ -0,0 +1,157 @@
+# Word n-gram frequency tables (freq_unigrams, freq_bigrams, ...) counted from
+# the teacher comments (and optionally the student essays) of the TEI corpus.
+# Files are counted in parallel shards and the counts merged; higher orders
+# can be counted approximately with a count-min sketch to cap memory.
+#
+# Run: python ngram_counts.py path_to_data [out_folder] [n_jobs]
+
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from process_corpus import filter_files, load_xml, get_essay_sentences
+
+freq_file_names = {1: "freq_unigrams", 2: "freq_bigrams"}
+
+def get_corpus_files(path_to_data, comments=True, student_text=False):
+    """ Paths of the notes files and / or the essay files of the corpus.
+    """
+    corpus_files = []
+    for dirpath, dirnames, filenames in os.walk(path_to_data):
+        dirnames.sort()
+        for file_name in filter_files(dirpath) if filenames else []:
+            if (comments and file_name.endswith("_fixed_notes.xml")) or \
+               (student_text and file_name.endswith("_fixed.xml")):
+                corpus_files.append(os.path.join(dirpath, file_name))
+    return corpus_files
+
+def iter_texts(path):
+    """ Texts of a corpus file: the open-ended comments of a notes file or the
+    sentences of an essay.
+    """
+    root = load_xml(path)
+    if path.endswith("_notes.xml"):
+        for note in root.iter("{http://www.tei-c.org/ns/1.0}note"):
+            if note.text:
+                yield note.text
+    else:
+        for sent in get_essay_sentences(root)["sents"]:
+            yield sent
+
+def tokenize(text):
+    return re.findall(r"[\w']+", text.lower())
+
+def get_sketch_ix(ngram, depth, width):
+    """ Column of the n-gram in each row of a count-min sketch (CRC32 with a
+    different start value per row, the same in all worker processes).
+    """
+    key = ngram.encode("utf-8")
+    return [zlib.crc32(key, row * 0x9E3779B1 & 0xFFFFFFFF) % width for row in range(depth)]
+
+def prune(counts, max_keys):
+    """ Keeps the max_keys // 2 most frequent n-grams (candidate heavy hitters).
+    """
+    kept = counts.most_common(max_keys // 2)
+    counts.clear()
+    counts.update(dict(kept))
+
+def count_shard(paths, orders=(1, 2), sketch_from=None, width=2**20, depth=4, max_keys=200000):
+    """ Counts the n-grams of the given orders in the texts of the files.
+    Returns a dictionary of order -> Counter for exact orders, and
+    order -> (sketch, Counter of candidate n-grams) for orders >= sketch_from.
+    """
+    counts = {n: Counter() for n in orders}
+    sketches = {n: np.zeros((depth, width), dtype=np.uint32) for n in orders
+                if sketch_from and n >= sketch_from}
+    rows = np.arange(depth)
+    for path in paths:
+        for text in iter_texts(path):
+            tokens = tokenize(text)
+            for n in orders:
+                ngrams = [" ".join(tokens[i:i+n]) for i in range(len(tokens)-n+1)]
+                counts[n].update(ngrams)
+                if n in sketches:
+                    for ngram in ngrams:
+                        sketches[n][rows, get_sketch_ix(ngram, depth, width)] += 1
+                    if len(counts[n]) > max_keys:
+                        prune(counts[n], max_keys)
+    return {n: (sketches[n], counts[n]) if n in sketches else counts[n] for n in orders}
+
+def merge_counts(shard_results, orders, max_keys=200000):
+    """ Sums the exact counts and the sketches of the shards, one shard result
+    at a time (shard_results can be an iterator, e.g. of results as they arrive
+    from worker processes). Sketch orders get the (over-)estimated count of each
+    candidate n-gram from the merged sketch.
+    Returns a dictionary of order -> Counter.
+    """
+    merged = {n: Counter() for n in orders}
+    sketches = {}
+    candidates = {n: set() for n in orders}
+    for shard in shard_results:
+        for n in orders:
+            if isinstance(shard[n], tuple):
+                sketch, shard_counts = shard[n]
+                if n in sketches:
+                    sketches[n] += sketch
+                else:
+                    sketches[n] = sketch.astype(np.uint64)
+                candidates[n].update(shard_counts)
+            else:
+                merged[n].update(shard[n])
+    for n, sketch in sketches.items():
+        depth, width = sketch.shape
+        merged[n] = Counter({ngram: int(sketch[np.arange(depth), get_sketch_ix(ngram, depth, width)].min())
+                             for ngram in candidates[n]})
+        if len(merged[n]) > max_keys:
+            prune(merged[n], 2 * max_keys)
+    return merged
+
+def count_ngrams(paths, orders=(1, 2), n_jobs=1, sketch_from=None, width=2**20, depth=4,
+                 max_keys=200000, nr_shards=None):
+    """ Counts n-grams in the files split into shards (one task per shard,
+    n_jobs worker processes) and merges the shard counts as the shards are done.
+    @ sketch_from: lowest order counted with a count-min sketch (None: all exact); counts are
+                   upper bounds and only the max_keys most frequent n-grams per shard are kept
+    @ width, depth: size of the count-min sketch (memory per order: 4 * width * depth bytes
+                    per worker and per finished shard not yet merged, 8 * width * depth bytes
+                    for the merged sketch)
+    """
+    nr_shards = nr_shards or max(n_jobs * 4, 1)
+    shards = [paths[ix::nr_shards] for ix in range(nr_shards) if paths[ix::nr_shards]]
+    args = [(shard, orders, sketch_from, width, depth, max_keys) for shard in shards]
+    if n_jobs > 1 and args:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            return merge_counts(executor.map(count_shard, *zip(*args)), orders, max_keys)
+    return merge_counts((count_shard(*arg) for arg in args), orders, max_keys)
+
+def write_counts(counts, out_file, min_count=1):
+    """ Saves counts in the format read by process_corpus.load_grams()
+    ('count<TAB>n-gram' per line, most frequent first).
+    """
+    with open(out_file, "w") as f:
+        for ngram, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            if count >= min_count:
+                f.write("{}\t{}\n".format(count, ngram))
+
+def build_freq_files(path_to_data, out_folder=".", orders=(1, 2), comments=True, student_text=False,
+                     n_jobs=1, sketch_from=None, min_count=1, **kwargs):
+    """ Counts the n-grams of the corpus and saves one frequency file per order
+    (freq_unigrams, freq_bigrams, freq_<n>grams) to out_folder.
+    @ comments:     count the open-ended teacher comments
+    @ student_text: count the sentences of the student essays (all versions)
+    (see count_ngrams() for the other arguments)
+    """
+    paths = get_corpus_files(path_to_data, comments, student_text)
+    counts = count_ngrams(paths, orders, n_jobs, sketch_from, **kwargs)
+    for n in orders:
+        out_file = os.path.join(out_folder, freq_file_names.get(n, "freq_{}grams".format(n)))
+        write_counts(counts[n], out_file, min_count)
+        print("{} files, {} {}-grams saved to {}".format(len(paths), len(counts[n]), n, out_file))
+    return counts
+
+if __name__ == "__main__":
+    build_freq_files(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else ".",
+                     n_jobs=int(sys.argv[3]) if len(sys.argv) > 3 else 1)
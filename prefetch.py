@@ -0,0 +1,65 @@
+# Background reading of the files of upcoming items (e.g. the XML files of the
+# next essay bundles in process_corpus.get_data_multi()), so that file reads
+# overlap with processing
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def read_files(paths):
+    """ Raw bytes per path (None for missing files).
+    """
+    files = {}
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                files[path] = f.read()
+        except FileNotFoundError:
+            files[path] = None
+    return files
+
+def get_file_size(paths):
+    """ Total size of the existing files.
+    """
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+def prefetch_files(keys, get_paths, max_ahead=8, max_bytes=256*2**20, n_threads=4):
+    """ Yields (key, files) for each key in order, where files is a dictionary of
+    path -> raw bytes (None if missing) of the paths returned by get_paths(key).
+    The files of up to max_ahead following keys are read by a thread pool while
+    the current one is processed. The size of the files of a key is counted
+    (from the file system) when their read is started, and no read is started that
+    would make the files being read or read but not yet yielded exceed max_bytes
+    (the files of the next key are always read if nothing else is pending).
+    With max_ahead = 0 nothing is read and files is None.
+    """
+    if max_ahead <= 0:
+        for key in keys:
+            yield key, None
+        return
+    keys = list(keys)
+    pending = deque()
+    next_ix = 0
+    next_paths = None
+    buffered = 0
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        while next_ix < len(keys) or pending:
+            while next_ix < len(keys) and len(pending) < max_ahead:
+                if next_paths is None:
+                    next_paths = get_paths(keys[next_ix])
+                    next_size = get_file_size(next_paths)
+                if pending and buffered + next_size > max_bytes:
+                    break
+                pending.append((keys[next_ix], next_size, executor.submit(read_files, next_paths)))
+                buffered += next_size
+                next_ix += 1
+                next_paths = None
+            key, size, future = pending.popleft()
+            buffered -= size
+            yield key, future.result()
@@ -13,7 +13,8 @@ def get_directness(annot_csv_file, delimiter=",", print_info=True):
     annotations = {}
     with open(annot_csv_file, newline="") as csvfile:
         csv_reader = csv.reader(csvfile, delimiter=delimiter)
-        for row in list(csv_reader)[1:]:
+        next(csv_reader, None)  # header
+        for row in csv_reader:
             if row:
                 if row[0]:
                     if len(row) > 2:
@@ -38,7 +39,8 @@ def get_revision_success(annot_csv_file, delimiter=",", print_info=True):
     annotations = {}
     with open(annot_csv_file, newline="") as csvfile:
         csv_reader = csv.reader(csvfile, delimiter=delimiter)
-        for row in list(csv_reader)[1:]:
+        next(csv_reader, None)  # header
+        for row in csv_reader:
             #print(row)
             if row:
                 try:
@@ -121,10 +123,11 @@ def get_kappa(labels_A1, labels_A2, kappa_metric, print_info=True):
         print("Kappa: \t", kappa)
     return kappa
 
-def get_confusion_matrix(labels_A1, labels_A2, label_names, confusion_matrix, np, sns, plt):
+def get_confusion_matrix(labels_A1, labels_A2, label_names, confusion_matrix, np, sns, plt, out_file=None):
     """ Creates a confusion matrix over the annotation labels used.
     @ np: imported numpy module
     @ sns: imported sns module
+    @ out_file: save the heatmap to this file instead of showing it (batch runs)
     Returns an array with [n_lables, n_labels], see the sklearn documentation for more:
     <http://scikit-learn.org/stable/modules/generated/sklearn.metrics.confusion_matrix.html#sklearn.metrics.confusion_matrix>
     """
@@ -132,39 +135,87 @@ def get_confusion_matrix(labels_A1, labels_A2, label_names, confusion_matrix, np
     with sns.axes_style("white"):
         ax = sns.heatmap(cm, vmin=0, vmax=50, xticklabels=label_names, yticklabels=label_names,
                     annot=True, fmt="d", cmap="Blues")
-    plt.show()
+    if out_file:
+        plt.savefig(out_file, bbox_inches="tight")
+        plt.close()
+    else:
+        plt.show()
     return cm
 
-def compute_iaa(all_annotations, kappa_metric, label_names, confusion_matrix, np, sns, plt):
+def compute_iaa(all_annotations, kappa_metric, label_names, confusion_matrix, np, sns, plt, cm_file=None):
     """ Sums annotation data across annotators, computes percentage 
-    agreement and Cohen's kappa. 
+    agreement and Cohen's kappa. (For more than two annotators and 
+    other agreement metrics see agreement.py.)
     @ all_annotations: list of dictionary objects with annotation
     data per annotator.
     @ kappa_metric:    sklearn.metrics.cohen_kappa_score
+    @ cm_file:         file to save the confusion matrix heatmap to (no display)
     """
     summed_annot_data = sum_annot_data(all_annotations)
     get_disagreements(summed_annot_data)
     labels_A1, labels_A2 = get_ordered_labels(summed_annot_data)
     get_kappa(labels_A1, labels_A2, kappa_metric)
-    get_confusion_matrix(labels_A1, labels_A2, label_names, confusion_matrix, np, sns, plt)
+    get_confusion_matrix(labels_A1, labels_A2, label_names, confusion_matrix, np, sns, plt, cm_file)
 
 
+def iter_info_rows(info_csv_files):
+    """ Streams the rows of the info CSV files one after the other.
+    Yields (is_header, row) tuples; only the header of the first
+    file is kept.
+    """
+    for file_ix, info_csv in enumerate(info_csv_files):
+        with open(info_csv, newline="") as csvfile:
+            csv_reader = csv.reader(csvfile)
+            header = next(csv_reader, None)
+            if header is not None and not file_ix:
+                yield (True, header)
+            for row in csv_reader:
+                yield (False, row)
+
+def pad_annot(labels, nr_annotators=2):
+    """ Returns a copy of the list of annotation labels for an item 
+    padded with empty labels for missing annotators.
+    """
+    labels = list(labels) if labels else []
+    return labels + [""] * (nr_annotators-len(labels))
+
+def load_merged_ids(out_csvfile_name):
+    """ Collects the item ids and the item locations (essay ID + target 
+    token) already saved in a merged annotation file.
+    """
+    item_ids = set()
+    locations = set()
+    with open(out_csvfile_name, newline="") as csvfile:
+        csv_reader = csv.reader(csvfile)
+        next(csv_reader, None)  # header
+        for row in csv_reader:
+            if row:
+                item_ids.add(row[0])
+                locations.add(row[1] + row[2])
+    return (item_ids, locations)
+
 def merge_all_annot_info(open_info_csv, tag_info_csv, same_rem_annot, annot_DIR_A1_csv, annot_DIR_A2_csv, 
-                         annot_RS_A1_csv, annot_RS_A2_csv, annot_RS_A2_csv_part2):
+                         annot_RS_A1_csv, annot_RS_A2_csv, annot_RS_A2_csv_part2, 
+                         out_csvfile_name="all_annot_info.csv", append=False):
     """ Creates a CSV file containing all annotation information and the original location
     of each annotation item.
     Items can be located in the original corpus data based on (i) column B ('essay ID') which 
     corresponds to the semester folder + the XML filename and (ii) column C ('target token')
     indicating the relevant XML <w> elements' xml:id attribute.
+    Info files are streamed and joined with the annotations on the item id (via dictionaries),
+    duplicate locations are skipped using a set, so the merge runs in linear time. 
     @ open_info_csv:  file with info (e.g. location) for feedback with open-ended comments
     @ tag_info_csv:   file with info (e.g. location) for feedback with Commentbank tags,
                       ids c700 up  
     @ same_rem_annot: includes items with 'same' / 'rem' annotation (preceeding the actual annotation)
                       ids from c1300 up
+    @ append:         add only new items (new annotation batches) to an existing output file
     """
-    info_list = []
-    ids = []
+    seen_locations = set()
+    written_ids = set()
+    nr_rows = 0
     nr_open = 0
+    nr_dupl = 0
     # directness
     annotations_DIR_A1 = get_directness(annot_DIR_A1_csv)
     annotations_DIR_A2 = get_directness(annot_DIR_A2_csv)
@@ -174,80 +225,74 @@ def merge_all_annot_info(open_info_csv, tag_info_csv, same_rem_annot, annot_DIR_
     annotations_RS_A2 = get_revision_success(annot_RS_A2_csv)
     annotations_RS_A1.update(get_revision_success(annot_RS_A2_csv_part2))
     summed_annot_data_RS = sum_annot_data([annotations_RS_A1, annotations_RS_A2])
-    # annotated open-ended and tagged feedback
-    with open(open_info_csv, newline="") as csvfile:
-        csv_reader = list(csv.reader(csvfile))#[:10]
-        with open(tag_info_csv, newline="") as csvfile:
-            csv_reader_tag = list(csv.reader(csvfile))
-        csv_reader.extend(csv_reader_tag[1:])    
-        new_row = []
-        for ix, row in enumerate(csv_reader):
+    if append and os.path.exists(out_csvfile_name):
+        written_ids, seen_locations = load_merged_ids(out_csvfile_name)
+        mode = "a"
+    else:
+        append = False
+        mode = "w"
+    with open(out_csvfile_name, mode, newline="") as out_csvfile:
+        csv_writer = csv.writer(out_csvfile)
+        # annotated open-ended and tagged feedback
+        for is_header, row in iter_info_rows([open_info_csv, tag_info_csv]):
             new_row = [row[0], row[3], row[4], row[1]]      # ids, location, comment
-            if ix:
-                if row[3] + row[4] not in ids:
-                    ids.append(row[3] + row[4])
-                    # directness annot
-                    if int(row[0][1:]) < 700:               # directness for open
-                        nr_open += 1
-                        directness_annot = summed_annot_data_DIR.get(row[0])
-                        if directness_annot:     
-                            for i in range(2-len(directness_annot)):
-                                directness_annot.append("")
-                        else:
-                            directness_annot = ["", ""]
-                        gold_directness = directness_annot[1]
-                        directness_annot.append(gold_directness)
-                        new_row.extend(directness_annot)
-                    else:
-                        new_row.extend(["", "", row[2]])    # directness for tagged
-                    # revision success annot
-                    rev_succ_annot = summed_annot_data_RS.get(row[0])
-                    if rev_succ_annot:     
-                        for i in range(2-len(rev_succ_annot)):
-                            rev_succ_annot.append("")
-                    else:
-                        rev_succ_annot = ["", ""]
-                    gold_rev_succ = rev_succ_annot[0]
-                    rev_succ_annot.append(gold_rev_succ)
-                    new_row.extend(rev_succ_annot)
+            if is_header:
+                if not append:
+                    new_row.extend(["direct_A1", "direct_A2", "gold_dir", 
+                                    "rev_succ_A1", "rev_succ_A2", "gold_rev_succ"])
                     new_row.extend([row[7], row[8], row[10], row[11]]) # original and revised
-                    info_list.append(new_row)
+                    csv_writer.writerow(new_row)
+                continue
+            location = row[3] + row[4]
+            if location in seen_locations:
+                nr_dupl += 1
+                continue
+            seen_locations.add(location)
+            if append and row[0] in written_ids:   # already in the existing output file
+                continue
+            # directness annot
+            if int(row[0][1:]) < 700:               # directness for open
+                nr_open += 1
+                directness_annot = pad_annot(summed_annot_data_DIR.get(row[0]))
+                gold_directness = directness_annot[1]
+                directness_annot.append(gold_directness)
+                new_row.extend(directness_annot)
             else:
-                new_row.extend(["direct_A1", "direct_A2", "gold_dir", 
-                                "rev_succ_A1", "rev_succ_A2", "gold_rev_succ"])
-                new_row.extend([row[7], row[8], row[10], row[11]]) # original and revised
-                info_list.append(new_row)
-
-    # adding tagged pre-annotated with 'same' and 'rem'
-    with open(same_rem_annot, newline="") as csvfile:
-        csv_reader_tag_pre_annot = list(csv.reader(csvfile))#[:10]
-        new_row = []
-        nr_preannot = 0
-        for ix, row in enumerate(csv_reader_tag_pre_annot[1:]):
-            # revision success
-            rev_succ_pre_annot = row[5]
-            if rev_succ_pre_annot in ["same", "rem"]:
-                nr_preannot += 1
-                item_id = "c"+str(1300+nr_preannot)
-                if item_id not in ids:
-                    ids.append(row[0] + row[2])
-                    new_row = [item_id, row[0], row[2], row[1]] # ids, location, comment
-                    # directness
-                    if row[1] == "Delete this (unnecessary)":            
-                        new_row.extend(["", "", "dir"])
-                    else:
-                        new_row.extend(["", "", "ind"])
-                    new_row.extend(["", "", rev_succ_pre_annot])     # revision success (same/rem)
-                    new_row.extend([row[6], row[7], row[8], row[9]]) # original and revised
-                    info_list.append(new_row)
-    print("Nr of LA-relevant datapoints: ", len(info_list))
+                new_row.extend(["", "", row[2]])    # directness for tagged
+            # revision success annot
+            rev_succ_annot = pad_annot(summed_annot_data_RS.get(row[0]))
+            gold_rev_succ = rev_succ_annot[0]
+            rev_succ_annot.append(gold_rev_succ)
+            new_row.extend(rev_succ_annot)
+            new_row.extend([row[7], row[8], row[10], row[11]]) # original and revised
+            csv_writer.writerow(new_row)
+            written_ids.add(row[0])
+            nr_rows += 1
+
+        # adding tagged pre-annotated with 'same' and 'rem'
+        with open(same_rem_annot, newline="") as csvfile:
+            csv_reader_tag_pre_annot = csv.reader(csvfile)
+            next(csv_reader_tag_pre_annot, None)  # header
+            nr_preannot = 0
+            for row in csv_reader_tag_pre_annot:
+                # revision success
+                rev_succ_pre_annot = row[5]
+                if rev_succ_pre_annot in ["same", "rem"]:
+                    nr_preannot += 1
+                    item_id = "c"+str(1300+nr_preannot)
+                    if not (append and item_id in written_ids):
+                        new_row = [item_id, row[0], row[2], row[1]] # ids, location, comment
+                        # directness
+                        if row[1] == "Delete this (unnecessary)":            
+                            new_row.extend(["", "", "dir"])
+                        else:
+                            new_row.extend(["", "", "ind"])
+                        new_row.extend(["", "", rev_succ_pre_annot])     # revision success (same/rem)
+                        new_row.extend([row[6], row[7], row[8], row[9]]) # original and revised
+                        csv_writer.writerow(new_row)
+                        written_ids.add(item_id)
+                        nr_rows += 1
+    print("Nr of LA-relevant datapoints: ", nr_rows)
     print("Nr open-ended:", nr_open)
-    print(len(ids), len(set(ids)))
-    # save output    
-    out_csvfile_name = "all_annot_info.csv"
-    with open(out_csvfile_name, "w", newline="") as out_csvfile:
-        csv_writer = csv.writer(out_csvfile)
-        for out_row in info_list:
-            csv_writer.writerow(out_row) 
+    print("Nr of duplicate locations skipped:", nr_dupl)
     print("Annotation results saved in {}".format(out_csvfile_name))
-    
\ No newline at end of file
@@ -5,8 +5,16 @@ import xml.etree.ElementTree as ET
 import csv
 import pickle
 import re
+from itertools import groupby
 from linking_adverbials import linking_adv, is_linking_adv, is_linking_adv_stud, add_low_fr_to_terms
 from filtering import filter_comment, get_praise_phrases, no_local_rev_requirement
+from feedback_db import open_db, upsert_records
+from freq_lexicon import load_lexicon
+from instrument import null_stats
+from word_align import align_words
+from records import Record, TextTable
+from prefetch import prefetch_files
+from reservoir import StratifiedSampler
 
 #########################
 # Load and save functions
@@ -134,43 +142,101 @@ def add_more_context(sents, target_sent, first_trg_ix, last_trg_ix, more_context
     #    add_more_context(sents, target_sent, first_trg_ix, last_trg_ix, more_context)
     return (first_trg_ix, last_trg_ix, more_context)
 
-def get_st_sentence(xml_root, target_tokens):
-    """ Get student sentence in which most target 'tokens' for the error appear.
-    Returns also the previous sentence if any.
+def get_essay_sentences(xml_root):
+    """ Precomputes the sentences of an essay once, so that the sentence(s) and
+    context windows of each note can be looked up without scanning the essay again.
+    Returns a dictionary with
+    'tokens':     list of (word ID, word) tuples per sentence,
+    'sents':      sentences as strings,
+    'word_sent':  word ID -> sentence index,
+    'text':       all sentences joined with a space,
+    'offsets':    cumulative character offsets of the sentences in 'text' (n+1 values),
+    'paragraphs': (first, last) sentence index of the paragraph of each sentence
+    @ xml_root: loaded TEI XML of a student essay
     """
-    sents = []
-    target_sents = []
+    tokens = []
+    paragraph_of = {}
+    for p_ix, paragraph in enumerate(xml_root.iter("{http://www.tei-c.org/ns/1.0}p")):
+        for sentence in paragraph.iter("{http://www.tei-c.org/ns/1.0}s"):
+            paragraph_of[sentence] = p_ix
+    sent_paragraphs = []
     for sentence in xml_root.iter("{http://www.tei-c.org/ns/1.0}s"):
         sent = []
-        match_count = 0
         for element in sentence:
             if element.tag == "{http://www.tei-c.org/ns/1.0}w":
-                if element.text:
-                    if "{http://www.w3.org/XML/1998/namespace}id" in element.attrib:
-                        el_id = element.attrib["{http://www.w3.org/XML/1998/namespace}id"]
-                        if el_id in target_tokens:
-                            sent.append("[[" + element.text + "]]")
-                            match_count += 1
-                        else:
-                            sent.append(element.text)
-            else: # handle if sentence is highlighted 
-                for highlighted_w in element:
-                    if highlighted_w.tag == "{http://www.tei-c.org/ns/1.0}w":
-                        if highlighted_w.text:
-                            if "{http://www.w3.org/XML/1998/namespace}id" in highlighted_w.attrib:
-                                if highlighted_w.attrib["{http://www.w3.org/XML/1998/namespace}id"] in target_tokens:
-                                    sent.append("[[" + highlighted_w.text + "]]")
-                                    match_count += 1
-                                else:
-                                    sent.append(highlighted_w.text)
-        sent_str = " ".join(sent)
-        sents.append((match_count, sent_str))
-
-    target_sents = [(ix, sent) for ix, (count,sent) in enumerate(sents) if count]
-    target_sent = " ".join([sent for ix, sent in target_sents])
-    if target_sents:
-        first_trg_ix = target_sents[0][0]
-        last_trg_ix = target_sents[-1][0]
+                words = [element]
+            else: # handle if sentence is highlighted
+                words = [w for w in element if w.tag == "{http://www.tei-c.org/ns/1.0}w"]
+            for w in words:
+                if w.text and "{http://www.w3.org/XML/1998/namespace}id" in w.attrib:
+                    sent.append((w.attrib["{http://www.w3.org/XML/1998/namespace}id"], w.text))
+        tokens.append(sent)
+        # sentences outside of <p> are treated as a paragraph of their own
+        sent_paragraphs.append(paragraph_of.get(sentence, ("s", len(tokens))))
+    sents = [" ".join([word for _, word in sent]) for sent in tokens]
+    word_sent = {word_id: ix for ix, sent in enumerate(tokens) for word_id, _ in sent}
+    offsets = [0]
+    for sent in sents:
+        offsets.append(offsets[-1] + len(sent) + 1)
+    paragraph_spans = {}
+    for ix, p_ix in enumerate(sent_paragraphs):
+        first, _ = paragraph_spans.get(p_ix, (ix, ix))
+        paragraph_spans[p_ix] = (first, ix)
+    return {"tokens": tokens, "sents": sents, "word_sent": word_sent, "text": " ".join(sents),
+            "offsets": offsets, "paragraphs": [paragraph_spans[p_ix] for p_ix in sent_paragraphs]}
+
+def get_target_sents(essay, target_tokens):
+    """ Indices of the sentences containing target tokens and these sentences
+    joined with the target tokens marked as [[token]].
+    @ essay: output of get_essay_sentences()
+    """
+    target_ixs = sorted(set([essay["word_sent"][word_id] for word_id in target_tokens 
+                             if word_id in essay["word_sent"]]))
+    target_sent = " ".join([" ".join(["[[" + word + "]]" if word_id in target_tokens else word 
+                                      for word_id, word in essay["tokens"][ix]]) for ix in target_ixs])
+    return target_ixs, target_sent
+
+def get_context_windows(essay, target_tokens, widths=(1, 2, "p")):
+    """ Context windows around the sentence(s) with the target tokens, one per
+    requested width: an integer k adds k sentences before and after, 'p' the rest
+    of the paragraph(s). Each window is sliced from the joined essay text using
+    the precomputed sentence offsets, so its cost does not depend on the essay length.
+    Returns a list of strings (empty strings if no target token is found).
+    @ essay:         output of get_essay_sentences()
+    @ target_tokens: list of word IDs
+    @ widths:        context widths
+    """
+    target_ixs, target_sent = get_target_sents(essay, target_tokens)
+    if not target_ixs:
+        return ["" for _ in widths]
+    first_trg_ix, last_trg_ix = target_ixs[0], target_ixs[-1]
+    text, offsets = essay["text"], essay["offsets"]
+    windows = []
+    for width in widths:
+        if width == "p":
+            first_ix = essay["paragraphs"][first_trg_ix][0]
+            last_ix = essay["paragraphs"][last_trg_ix][1]
+        else:
+            first_ix = max(first_trg_ix - width, 0)
+            last_ix = min(last_trg_ix + width, len(essay["sents"]) - 1)
+        before = text[offsets[first_ix]:offsets[first_trg_ix]]
+        after = text[offsets[last_trg_ix+1]-1:offsets[last_ix+1]-1]
+        windows.append(before + target_sent + after)
+    return windows
+
+def get_st_sentence(xml_root, target_tokens, essay=None):
+    """ Get student sentence in which most target 'tokens' for the error appear.
+    Returns also the previous sentence if any.
+    @ essay: output of get_essay_sentences() for xml_root, if already computed
+    """
+    if essay is None:
+        essay = get_essay_sentences(xml_root)
+    target_ixs, target_sent = get_target_sents(essay, target_tokens)
+    if target_ixs:
+        # add_more_context() only uses the sentences around the target sentences
+        sents = [(0, sent) for sent in essay["sents"]]
+        first_trg_ix = target_ixs[0]
+        last_trg_ix = target_ixs[-1]
         # complete incomplete target sentence (sentence split issues during data extraction due to encoding problems)
         if target_sent[0] in ["?", "[[?]]"] or target_sent[0].islower() or len(target_sent.replace("[", "").replace("]","")) < 20:
             first_trg_ix, last_trg_ix, target_sent = add_more_context(sents, target_sent, first_trg_ix, last_trg_ix)
@@ -180,34 +246,41 @@ def get_st_sentence(xml_root, target_tokens):
         more_context = ""
     return target_sent, more_context
 
-def load_revision(path_to_original):
-    """ Loads the revised student essay corresponding to the original version
-    under the provided path. Returns a tuple of the path to the revised version
-    and its loaded XML. 
+def get_revision_paths(path_to_original):
+    """ Paths where the revised version of the original essay can be: the next 
+    version, then the final version.
     # version0, 1, 2
     @ path_to_original: path to file with original (pre-revision) version of student essay 
-    """ 
+    """
     fn_elem = path_to_original.split("_")
     version_ix = None
     for ix, elem in enumerate(fn_elem):
         if "version" in elem:
             version_ix = ix
-    if version_ix:
-        next_version = fn_elem[version_ix][:-1] + str(int(fn_elem[version_ix][-1])+1)
-        fn_elem[version_ix] = next_version
-        # Revisions in the non-final version
+    if not version_ix:
+        return []
+    next_version = fn_elem[version_ix][:-1] + str(int(fn_elem[version_ix][-1])+1)
+    # Revisions in the non-final version
+    fn_elem[version_ix] = next_version
+    rev_paths = ["_".join(fn_elem)]
+    # Revisions in the final version if any 
+    fn_elem[version_ix] = next_version[:-1] + "final"
+    rev_paths.append("_".join(fn_elem))
+    return rev_paths
+
+def load_revision(path_to_original, load=load_xml):
+    """ Loads the revised student essay corresponding to the original version
+    under the provided path. Returns a tuple of the path to the revised version
+    and its loaded XML (None if there is no subsequent version). 
+    @ path_to_original: path to file with original (pre-revision) version of student essay 
+    @ load:             function loading an XML file
+    """ 
+    for rev_fn in get_revision_paths(path_to_original):
         try:
-            rev_fn = "_".join(fn_elem)
-            return (rev_fn,load_xml(rev_fn))
+            return (rev_fn, load(rev_fn))
         except FileNotFoundError:
-            # Revisions in the final version if any 
-            try: 
-                fn_elem[version_ix] = next_version[:-1] + "final"
-                rev_fn = "_".join(fn_elem)
-                return (rev_fn, load_xml(rev_fn))
-            # no subsequent version
-            except FileNotFoundError:       
-                return None
+            pass
+    return None
 
 def get_revision_cost(revision_types):
     """ Maps revision types to a cost reflecting the student's amount of effort 
@@ -296,15 +369,302 @@ def get_revision_info(loaded_alignments, loaded_revisions, target_tokens, max_wi
     revision_effort = str(get_revision_cost(revision_types))
     return (revision_type, revision_effort, revised_tokens) # to do: check if st_rev_sent token ids only 
 
+#################################
+# Error type detectors for notes
+#################################
+
+connector_cats = ["Adverb needed - Part of speech Incorrect",
+                  "Coherence - signposting", 
+                  "Coherence - logical sequence",
+                  #"Coherence - drawing a parallel between clauses", 
+                  "Conjunction - Wrong Use", 
+                  "Conjunction Missing", 
+                  "Conjunction missing OR wrong use",
+                  "Delete this (unnecessary)",
+                  #"Reference",
+                  #"Reference - missing or unclear",
+                  #"Sentence - Fragment",
+                  #"Sentence - New sentence",
+                  "Word choice",
+                  "Word choice - Level of formality",
+                  "Word order"]
+
+def detect_any_error(note_info, resources):
+    return True
+
+def is_linking_adv_category(feedback_type, error_cat, comment, resources):
+    """ Tagged errors can only be linking adverbial errors with a connector related category.
+    """
+    return feedback_type == "open" or comment in resources["connector_cats"]
+
+def detect_linking_adv(note_info, resources):
+    """ Open-ended comments about linking adverbials (see is_linking_adv()) or 
+    notes where the student revised a linking adverbial (see is_linking_adv_stud()).
+    """
+    #stud only: and is_linking_adv(comment, terminology, link_words, unigrams, bigrams))
+    #both: or is_linking_adv_stud(st_sent, st_rev_sent, linking_adv, nlp_pipeline, error_cat, target_tok_list))
+    if note_info["feedback_type"] == "open" and is_linking_adv(note_info["comment"], resources["terminology"], 
+                                                               resources["link_words"], resources["unigrams"], 
+                                                               resources["bigrams"]):
+        return True
+    return is_linking_adv_stud(note_info["st_sent"], note_info["st_rev_sent"], resources["linking_adv"], 
+                               resources["nlp_pipeline"], note_info["error_cat"], note_info["target_tokens"])
+
+# error type -> (preselect, detect), see register_error_type()
+error_type_detectors = {"ALL": (None, detect_any_error),
+                        "LA":  (is_linking_adv_category, detect_linking_adv)}
+
+def register_error_type(name, detect, preselect=None):
+    """ Adds an error type that get_data() / get_data_multi() can collect.
+    @ name:      error type name used in the configurations (e.g. 'LA')
+    @ detect:    function(note_info, resources) returning whether a note is of this error type;
+                 note_info has 'feedback_type', 'error_cat', 'comment', 'target_tokens', 'st_sent', 
+                 'st_rev_sent', 'rev_type'; resources are the lexicons and NLP pipeline loaded by get_data_multi()
+    @ preselect: optional function(feedback_type, error_cat, comment, resources) returning False for 
+                 notes that can not be of this type (called before the sentence and revision lookup)
+    """
+    error_type_detectors[name] = (preselect, detect)
+
+#####################
+# Processing of notes
+#####################
+
+def get_error_cat(note, semester, error_cats):
+    """ Commentbank category of a note, 'open_ended' for notes without category,
+    None for anomalous error codes (e.g. multiple codes).
+    """
+    note_type = note.attrib.get("type")
+    if note_type is None:
+        return "open_ended"
+    try:
+        return error_cats[(semester, note_type.split(":")[1].lstrip("0"))]
+    except (KeyError, IndexError):
+        return None
+
+def get_bundle_paths(path_to_comment_file):
+    """ Paths of all files load_bundle() may read for a '_fixed_notes' file.
+    """
+    path_to_st_file = path_to_comment_file.replace("_notes", "")
+    rev_paths = get_revision_paths(path_to_st_file)
+    return [path_to_comment_file, path_to_st_file] + rev_paths + \
+           [rev_path.replace("_fixed", "_fixed_wordAlign") for rev_path in rev_paths]
+
+def get_bundle_keys(path_to_data):
+    """ (semester, course, assignment, path to the '_fixed_notes' file) of all essay 
+    versions with teacher notes, in the order of the corpus traversal.
+    """
+    bundle_keys = []
+    for semester in filter_files(path_to_data):
+        for course in filter_files(os.path.join(path_to_data,semester)):
+            for assignment in filter_files(os.path.join(path_to_data,semester,course)):
+                #if "CTL_0011_3210_Asgn_2" in data_file:
+                #version 0 has no teacher comments 
+                bundle_keys.extend([(semester, course, assignment, 
+                                     os.path.join(path_to_data,semester,course,assignment, data_file))
+                                    for data_file in filter_files(os.path.join(path_to_data,semester,course,assignment))
+                                    if data_file[-3:] == "xml" and "fixed_notes" in data_file 
+                                       and "version0" not in data_file and "final" not in data_file])
+    return bundle_keys
+
+def load_bundle(path_to_comment_file, stats=null_stats, word_align_fallback=True, cache_word_align=False,
+                files=None):
+    """ Loads the teacher notes of an essay version together with the student's
+    original and revised version, the word alignment between them and their
+    sentences (see get_essay_sentences()). Missing files are None.
+    @ path_to_comment_file: path to the '_fixed_notes' file
+    @ files:                already read files as path -> raw bytes (None if missing), 
+                            e.g. from prefetch.prefetch_files(); other files are read from disk
+    """
+    def load_xml_file(path):
+        if files is None or path not in files:
+            return load_xml(path)
+        if files[path] is None:
+            raise FileNotFoundError(path)
+        return ET.fromstring(files[path])
+    bundle = {"st_resp": None, "st_rev": None, "word_alignments": None, "st_essay": None, "rev_essay": None}
+    # load student original version
+    path_to_st_file = path_to_comment_file.replace("_notes", "")
+    t0 = stats.start()
+    try:
+        bundle["st_resp"] = load_xml_file(path_to_st_file)
+        stats.count("files_parsed")
+    except FileNotFoundError:
+        pass
+    # load revised version
+    rev = load_revision(path_to_st_file, load_xml_file)
+    if rev:
+        path_to_st_rev, bundle["st_rev"] = rev
+        # load word alignment file
+        path_to_alig = path_to_st_rev.replace("_fixed", "_fixed_wordAlign")
+        try:
+            bundle["word_alignments"] = load_xml_file(path_to_alig)
+            stats.count("files_parsed", 2)
+        except FileNotFoundError:
+            stats.count("files_parsed")
+            if word_align_fallback and bundle["st_resp"]:
+                bundle["word_alignments"] = align_words(bundle["st_resp"], bundle["st_rev"], path_to_st_file, 
+                                                        path_to_st_rev, path_to_alig if cache_word_align else None)
+                stats.count("word_align_fallback")
+    bundle["notes"] = load_xml_file(path_to_comment_file)
+    stats.count("files_parsed")
+    stats.add_time("parse_xml", t0)
+    # sentences of both versions are split only once per essay
+    if bundle["st_resp"]:
+        bundle["st_essay"] = get_essay_sentences(bundle["st_resp"])
+    if bundle["st_rev"]:
+        bundle["rev_essay"] = get_essay_sentences(bundle["st_rev"])
+    return bundle
+
+def get_note_revision(bundle, target_tok_list, stats=null_stats):
+    """ Original and revised sentence(s) and revision information for the target 
+    tokens of a note. Returns a dictionary or a string with the reason why the 
+    note can not be used ('no_original', 'no_revision', 'buggy_sentence' for a too short
+    revised sentence with unknown characters, 'no_sentence' if the original sentence is empty,
+    'no_revision_type' if the revision type could not be determined).
+    """
+    st_resp, st_rev, word_alignments = bundle["st_resp"], bundle["st_rev"], bundle["word_alignments"]
+    if not st_resp:
+        return "no_original"
+    if not (word_alignments and st_rev):
+        return "no_revision"
+    t0 = stats.start()
+    st_sent, more_context = get_st_sentence(st_resp, target_tok_list, bundle["st_essay"])
+    stats.add_time("sentence", t0)
+    t0 = stats.start()
+    rev_type, rev_effort, revised_tokens = get_revision_info(word_alignments, st_rev, target_tok_list)
+    stats.add_time("alignment", t0)
+    # get revised student sentence
+    t0 = stats.start()
+    st_rev_sent, more_context_rev = get_st_sentence(st_rev, revised_tokens, bundle["rev_essay"])
+    stats.add_time("sentence", t0)
+    st_rev_sent = fix_unicode(st_rev_sent)
+    buggy_sent = False
+    if st_rev_sent:
+        if "[[?]]" in st_rev_sent and len(st_rev_sent) < 10:
+            buggy_sent = True
+    else:
+        rev_type = "removed"
+    if buggy_sent:
+        return "buggy_sentence"
+    if not st_sent:
+        return "no_sentence"
+    if not rev_type:
+        return "no_revision_type"
+    return {"st_sent": st_sent, "more_context": more_context, "rev_type": rev_type, "rev_effort": rev_effort,
+            "revised_tokens": revised_tokens, "st_rev_sent": st_rev_sent, "more_context_rev": more_context_rev}
+
+def process_note(note, bundle, semester, course, essay_id, configs, resources, stats=null_stats,
+                 sampler=None, sample_key=None):
+    """ Checks a teacher note against all (feedback_type, error_type) configurations 
+    at once; the sentences and revision information are looked up only once per note.
+    Returns a list of ((feedback_type, error_type), error category, record) tuples,
+    one per configuration collecting the note.
+    @ sampler:    reservoir.StratifiedSampler; notes that can not enter the sample of any of their 
+                  configurations with sample_key are dropped before the sentence and revision lookup
+    """
+    stats.count("notes_seen")
+    feedback_type = "open" if note.text else "tagged"
+    error_types = [error_type for config_type, error_type in configs if config_type == feedback_type]
+    if not error_types:
+        stats.count("notes_dropped:feedback_type")
+        return []
+    error_cat = get_error_cat(note, semester, resources["error_cats"])
+    if error_cat is None:
+        stats.count("anomalous_error_code")
+        return []
+    # comment per error type (the praise phrases used for filtering depend on the error type)
+    type_comments = {}
+    filtered = {}
+    for error_type in error_types:
+        if feedback_type == "open":
+            praise_phrases = resources["praise_phrases"][error_type]
+            if id(praise_phrases) not in filtered:
+                t0 = stats.start()
+                filtered[id(praise_phrases)] = filter_comment(note.text, course, resources["filter_no_lrr"], 
+                                                              praise_phrases)
+                stats.add_time("filter", t0)
+                #comment = note.text # to avoid filtering
+            comment = filtered[id(praise_phrases)]
+        else:
+            comment = error_cat
+        if comment:
+            type_comments[error_type] = comment
+    if not type_comments:
+        stats.count("notes_dropped:filtered_comment")
+        return []
+    # open-ended comments only without error category, then error type specific preselection
+    type_comments = {error_type: comment for error_type, comment in type_comments.items()
+                     if (feedback_type == "tagged" or error_cat == "open_ended") and 
+                        (error_type_detectors[error_type][0] is None or 
+                         error_type_detectors[error_type][0](feedback_type, error_cat, comment, resources))}
+    if not type_comments:
+        stats.count("notes_dropped:error_category")
+        return []
+    try:
+        target_tok = note.attrib.get("target").split("#")[1] #range(w29,w32) or w32
+    except AttributeError:
+        target_tok = None
+    target_tok_list = get_target_tokens(target_tok)
+    # exclude instances without target tokens or too many target tokens
+    if not target_tok_list:
+        stats.count("notes_dropped:no_target_tokens")
+        return []
+    if len(target_tok_list) >= resources["max_error_span"]:
+        stats.count("notes_dropped:error_span_too_long")
+        return []
+    if sampler and not any([sampler.accepts(sampler.get_stratum((feedback_type, error_type), error_cat, semester), 
+                                            sample_key) for error_type in type_comments]):
+        stats.count("notes_dropped:not_sampled")
+        return []
+    revision = get_note_revision(bundle, target_tok_list, stats)
+    if isinstance(revision, str):
+        stats.count("notes_dropped:" + revision)
+        return []
+    t0 = stats.start()
+    matches = []
+    for error_type, comment in type_comments.items():
+        note_info = {"feedback_type": feedback_type, "error_cat": error_cat, "comment": comment,
+                     "target_tokens": target_tok_list, "st_sent": revision["st_sent"], 
+                     "st_rev_sent": revision["st_rev_sent"], "rev_type": revision["rev_type"]}
+        if error_type_detectors[error_type][1](note_info, resources):
+            matches.append((error_type, comment))
+    stats.add_time("error_type", t0)
+    if not matches:
+        stats.count("notes_dropped:error_type")
+        return []
+    stats.count("notes_kept")
+    context_widths = resources["context_widths"]
+    if context_widths:
+        windows = zip(get_context_windows(bundle["st_essay"], target_tok_list, context_widths),
+                      get_context_windows(bundle["rev_essay"], revision["revised_tokens"], context_widths))
+        extra = [window for pair in windows for window in pair]
+    else:
+        extra = ()
+    records = {}
+    output = []
+    for error_type, comment in matches:
+        if comment not in records:
+            records[comment] = Record(essay_id, comment, target_tok_list, revision["rev_type"], 
+                                      revision["rev_effort"], revision["st_sent"], revision["st_rev_sent"], 
+                                      revision["more_context"], revision["more_context_rev"], extra, 
+                                      resources["text_table"])
+        output.append(((feedback_type, error_type), error_cat, records[comment]))
+    return output
+
 def get_data(path_to_data, path_to_error_cats, result_folder, nlp_pipeline, filter_no_lrr=False, 
              low_fr_to_terms=True, feedback_type="open", error_type="ALL", linking_adv=linking_adv, 
-             max_error_span=10):
+             max_error_span=10, db_file=None, parquet_file=None, stats=None, 
+             context_widths=None, word_align_fallback=True, cache_word_align=False, prefetch=0, 
+             sample_size=None, sample_by_semester=False, seed=9):
     """ Collects student errors marked by teachers via error tags ('tagged') or 
     open-ended comments ('open'). 
     Collects informaiton and saves it to both a CSV and a pickled Python object. CSV columns:
     (A) on essay ID, (B) error tag / comment, (C) error location (relevant tokens), (D) revision type, 
     (E) revision effort, (F) original student sentence(s), (G) revised student sentence(s), 
     (H) original student sentence preceding the relevant sentence.
+    Returns a dictionary of error category -> list of records.Record (behaving like lists of the column values;
+    loading the pickled object requires records.py).
+    (See get_data_multi() for collecting several feedback_type / error_type combinations in one pass.)
     @ path_to_data: 
     @ path_to_error_cats: CSV file with Commentbank category IDs per semester
     @ result_folder:      path to folder where output files should be saved
@@ -313,157 +673,164 @@ def get_data(path_to_data, path_to_error_cats, result_folder, nlp_pipeline, filt
     @ feedback_type:      'tagged' for errors with Commentbank categories,
                           'open' for errors with open-ended comments 
                           (mixed tag and open-ended are excluded in both cases)
-    @ error_type:         whether to filter for any specific error types (only 'LA' linking adverbials implemented) 
-                          or collect any error type ('ALL') that satisfies filtering criteria
+    @ error_type:         whether to filter for any specific error types ('LA' linking adverbials or 
+                          types added with register_error_type()) or collect any error type ('ALL') 
+                          that satisfies filtering criteria
     @ linking_adv:        linking adverbials (see linking_adverbials.py)
     @ max_error_span:     span of the error, i.e. how many tokens can be indicated for an error by teachers 
+    @ db_file:            SQLite database to also save records to (see feedback_db.py), records are
+                          upserted in batches after each assignment folder
+    @ parquet_file:       Parquet file to also save records to with typed columns (see feedback_parquet.py), 
+                          written as one row group per semester (requires pyarrow)
+    @ stats:              instrument.Stats object collecting the time spent per stage (XML parsing, 
+                          sentence reconstruction, alignment scanning, comment filtering, error type 
+                          (linking adverbial) detection, spaCy calls) and counters (files parsed, notes seen / dropped per 
+                          reason, spaCy calls); None disables instrumentation
+    @ context_widths:     additional context windows around the original and the revised sentence(s), 
+                          e.g. (1, 2, 'p') for +-1, +-2 sentences and the paragraph (see get_context_windows());
+                          appended as two columns per width (original, revised)
+    @ word_align_fallback: align the tokens of the original and revised version with word_align.py
+                          if the '_fixed_wordAlign' file of a revision is missing (otherwise its notes are skipped)
+    @ cache_word_align:   save these alignments as '_fixed_wordAlign' files next to the revision
+    @ prefetch:           number of following essay bundles whose files are read in background threads 
+                          (see get_data_multi())
+    @ sample_size:        collect a uniform random sample of at most sample_size records per error category 
+                          (per error category and semester if sample_by_semester) in one pass instead of 
+                          all records; notes that can not enter the sample are skipped before the sentence, 
+                          revision and error type lookup (see reservoir.py)
+    @ seed:               seed of the sample
+    """
+    return get_data_multi(path_to_data, path_to_error_cats, result_folder, nlp_pipeline, 
+                          [(feedback_type, error_type)], filter_no_lrr, low_fr_to_terms, linking_adv, 
+                          max_error_span, db_file, parquet_file, stats, context_widths, 
+                          word_align_fallback, cache_word_align, prefetch, sample_size=sample_size, 
+                          sample_by_semester=sample_by_semester, seed=seed)[(feedback_type, error_type)]
+
+def get_data_multi(path_to_data, path_to_error_cats, result_folder, nlp_pipeline, 
+                   configs=(("open", "LA"), ("tagged", "LA"), ("open", "ALL"), ("tagged", "ALL")), 
+                   filter_no_lrr=False, low_fr_to_terms=True, linking_adv=linking_adv, max_error_span=10, 
+                   db_file=None, parquet_file=None, stats=None, context_widths=None, 
+                   word_align_fallback=True, cache_word_align=False, prefetch=0, prefetch_bytes=256*2**20,
+                   sample_size=None, sample_by_semester=False, seed=9):
+    """ Same as get_data() for several (feedback_type, error_type) configurations:
+    the corpus is traversed and parsed once and each note is sent to every matching 
+    configuration. Saves a CSV and a pickled object per configuration 
+    ('<feedback_type>_<error_type>'). Records collected by several configurations
+    are saved only once to the database / Parquet file. 
+    Returns a dictionary of (feedback_type, error_type) -> error category -> list of records.
+    @ configs:        list of (feedback_type, error_type) pairs, error types must be in error_type_detectors
+    @ prefetch:       number of following essay bundles whose files are read in background threads
+                      while the current one is processed, across assignment folders (0: no prefetching)
+    @ prefetch_bytes: maximum size of the prefetched files not processed yet
+    @ sample_size:    sample per configuration and error category (and semester); the sampled records are 
+                      saved to the database / Parquet file (one row group) after the traversal
+    (see get_data() for the other parameters)
     """
+    configs = [tuple(config) for config in configs]
+    for _, error_type in configs:
+        if error_type not in error_type_detectors:
+            raise ValueError("Unknown error type: {}".format(error_type))
     terminology = ["linker", "linking", "linked", "linkage", "linkng", "linkere", "logical link",
                "connector", "connective", "signpost", "signposting", "joining word", 
                "transition", "discourse marker", "sequence marker", "conjunct ", "adjunct",
                "linking adverbial"]
-    connector_cats = ["Adverb needed - Part of speech Incorrect",
-                      "Coherence - signposting", 
-                      "Coherence - logical sequence",
-                      #"Coherence - drawing a parallel between clauses", 
-                      "Conjunction - Wrong Use", 
-                      "Conjunction Missing", 
-                      "Conjunction missing OR wrong use",
-                      "Delete this (unnecessary)",
-                      #"Reference",
-                      #"Reference - missing or unclear",
-                      #"Sentence - Fragment",
-                      #"Sentence - New sentence",
-                      "Word choice",
-                      "Word choice - Level of formality",
-                      "Word order"]
     adjs = ["good", "great", "nice", "excellent", "wonderful"]
-    comments = {}
-    anomalous_ecode = 0
+    outputs = {config: {} for config in configs}
     error_cats = load_error_cats(path_to_error_cats)
-    unigrams = load_grams("freq_unigrams")
-    bigrams = load_grams("freq_bigrams")
-    praise_phrases = get_praise_phrases(adjs, error_type)
+    unigrams = load_lexicon("freq_unigrams")      # compiled and memory-mapped, see freq_lexicon.py
+    bigrams = load_lexicon("freq_bigrams")
+    # praise phrases per error type, the same list object for error types with the same phrases
+    praise_phrases = {}
+    for _, error_type in configs:
+        phrases = get_praise_phrases(adjs, error_type)
+        for other_phrases in praise_phrases.values():
+            if other_phrases == phrases:
+                phrases = other_phrases
+        praise_phrases[error_type] = phrases
     #nlp = spacy.load("en_core_web_sm", disable=["ner", "textcat"])
     if low_fr_to_terms:                                     
         terminology, link_words = add_low_fr_to_terms(terminology, linking_adv, unigrams, bigrams)
     else:
         link_words = list(set(linking_adv["band1"] + linking_adv["band2"] + linking_adv["band3"]))
+    if db_file:
+        db_conn = open_db(db_file)
+    else:
+        db_conn = None
+    if parquet_file:
+        from feedback_parquet import open_parquet_writer, write_row_group
+        parquet_writer = open_parquet_writer(parquet_file)
+    else:
+        parquet_writer = None
+    new_records = []
+    if stats is None:
+        stats = null_stats
+    resources = {"error_cats": error_cats, "praise_phrases": praise_phrases, "filter_no_lrr": filter_no_lrr,
+                 "max_error_span": max_error_span, "context_widths": context_widths, 
+                 "terminology": terminology, "link_words": link_words, "unigrams": unigrams, "bigrams": bigrams,
+                 "linking_adv": linking_adv, "nlp_pipeline": stats.count_nlp(nlp_pipeline), 
+                 "connector_cats": connector_cats, "text_table": TextTable()}
+    sampler = StratifiedSampler(sample_size, sample_by_semester, seed) if sample_size else None
     #exit()
-    for semester in filter_files(path_to_data):
-        for course in filter_files(os.path.join(path_to_data,semester)):
-            for assignment in filter_files(os.path.join(path_to_data,semester,course)):
-                print(semester, course, assignment)
-                for data_file in filter_files(os.path.join(path_to_data,semester,
-                                                           course,assignment)):
-                    if data_file[-3:] == "xml":
-                        #if "CTL_0011_3210_Asgn_2" in data_file:
-                        if "fixed_notes" in data_file and "version0" not in data_file \
-                                                      and "final" not in data_file:
-                            #version 0 has no teacher comments 
-                            path_to_comment_file = os.path.join(path_to_data,semester,course,
-                                                                assignment, data_file)
-                            # load student original version
-                            path_to_st_file = path_to_comment_file.replace("_notes", "")
-                            try:
-                                st_resp = load_xml(path_to_st_file)
-                            except FileNotFoundError:
-                                st_resp = None
-                            # load revised version
-                            rev = load_revision(path_to_st_file)
-                            if rev:
-                                path_to_st_rev, st_rev = rev
-                                # load word alignment file
-                                path_to_alig = path_to_st_rev.replace("_fixed", "_fixed_wordAlign")
-                                word_alignments = load_xml(path_to_alig)
-                            else:
-                                word_alignments = None
-                                st_rev = None
-                            with open(path_to_comment_file) as f:
-                                tree = ET.parse(f)
-                                root = tree.getroot()
-                                for note in root.iter("{http://www.tei-c.org/ns/1.0}note"):
-                                    #*if note.text:            # only <note> with an open-ended comment 
-                                    if (note.text and feedback_type == "open") or (not note.text and feedback_type == "tagged"):                                            
-                                        try:
-                                            try:
-                                                error_cat = error_cats[(semester, 
-                                                            note.attrib.get("type").split(":")[1].lstrip("0"))]
-                                            except KeyError: # handling anomalous error codes (e.g. multiple codes)
-                                                #print(note.attrib.get("type").split(":")[1].lstrip("0"))
-                                                anomalous_ecode += 1
-                                        except AttributeError:        # handling lack of error category -> open-ended
-                                            error_cat = "open_ended"   
-                                        if feedback_type == "open":
-                                            comment = filter_comment(note.text, course, filter_no_lrr, praise_phrases)
-                                            #comment = note.text # to avoid filtering
-                                        else:
-                                            comment = error_cat
-                                        if comment:
-                                            #if linking_adv: # for getting ALL open-ended comments 
-                                            if (feedback_type == "open" and error_cat == "open_ended") or  \
-                                               (feedback_type == "tagged" and error_type == "ALL") or      \
-                                               (feedback_type == "tagged" and error_type == "LA" and comment in connector_cats): # including only open ended comments
-                                                try:
-                                                    target_tok = note.attrib.get("target").split("#")[1] #range(w29,w32) or w32
-                                                except AttributeError:
-                                                    target_tok = None
-                                                target_tok_list = get_target_tokens(target_tok)
-                                                if target_tok_list: # exclude instances without target tokens or too many target tokens
-                                                    if len(target_tok_list) < max_error_span:
-                                                        essay_id = "_".join([semester] + data_file.split("_")[:6])
-                                                        if st_resp:
-                                                            s = get_st_sentence(st_resp, target_tok_list)
-                                                            if s:
-                                                                st_sent, more_context = s 
-                                                            else:
-                                                                st_sent = s
-                                                            if word_alignments and st_rev:
-                                                                rev_type, rev_effort, revised_tokens = get_revision_info(word_alignments, st_rev, 
-                                                                                                        target_tok_list)
-                                                                # get revised student sentence
-                                                                rs = get_st_sentence(st_rev, revised_tokens)
-                                                                if rs:
-                                                                    st_rev_sent, more_context_rev = rs
-                                                                    st_rev_sent = fix_unicode(st_rev_sent)
-                                                                else:
-                                                                    st_rev_sent = rs
-                                                                buggy_sent = False
-                                                                if st_rev_sent:
-                                                                    if "[[?]]" in st_rev_sent and len(st_rev_sent) < 10:
-                                                                        buggy_sent = True
-                                                                else:
-                                                                    rev_type = "removed"
-                                                                if rev_type and st_sent and not buggy_sent:
-                                                                                                #stud only: and is_linking_adv(comment, terminology, link_words, unigrams, bigrams))
-                                                                                                #both: or is_linking_adv_stud(st_sent, st_rev_sent, linking_adv, nlp_pipeline, error_cat, target_tok_list))
-                                                                    if error_type == "ALL" or (error_type == "LA" and feedback_type == "open"              \
-                                                                                               and (is_linking_adv(comment, terminology, link_words, unigrams, bigrams) \
-                                                                                               or is_linking_adv_stud(st_sent, st_rev_sent, linking_adv, nlp_pipeline, error_cat, target_tok_list))) \
-                                                                                           or (error_type == "LA" and feedback_type == "tagged" and        \
-                                                                                              is_linking_adv_stud(st_sent, st_rev_sent, linking_adv, nlp_pipeline, error_cat, target_tok_list)):
-                                                                        if error_cat in comments:
-                                                                            comments[error_cat].append([essay_id, comment, 
-                                                                                                        ",".join(target_tok_list), 
-                                                                                                        rev_type, rev_effort, st_sent, st_rev_sent, more_context, more_context_rev])
-                                                                        else:
-                                                                            comments[error_cat] = [[essay_id, comment, 
-                                                                                                    ",".join(target_tok_list), 
-                                                                                                    rev_type, rev_effort, st_sent, st_rev_sent, more_context, more_context_rev]]
-                                                                        #if is_linking_adv(comment, terminology, link_words, unigrams, bigrams):
-                                                                        #    if no_local_rev_requirement(comment, praise_phrases, error_type):
-                                                                        #        pass
-                                                                                #print("S:\t", comment)
-                                                                            #else:
-                                                                            #    print("NS:\t", comment)
-    output = []
-    for error_cat, comments_list in comments.items():
-        print(error_cat, len(comments_list))
-        output.extend(comments_list)
-    out_file_name = feedback_type + "_" + error_type
-    write_to_csv(result_folder + out_file_name + ".csv", output)
-    with open(result_folder + out_file_name + ".pkl", "wb") as pickle_file:
-        pickle.dump(comments, pickle_file)
-    print("Output saved to {}.pkl/.csv".format(out_file_name))
-    return comments
-
+    # one prefetching pipeline for the whole traversal, grouped by semester and assignment folder
+    bundles = prefetch_files(get_bundle_keys(path_to_data), lambda key: get_bundle_paths(key[3]), 
+                             prefetch, prefetch_bytes)
+    for semester, semester_bundles in groupby(bundles, key=lambda bundle: bundle[0][0]):
+        semester_records = []
+        for (_, course, assignment), assignment_bundles in groupby(semester_bundles, 
+                                                                     key=lambda bundle: bundle[0][:3]):
+            print(semester, course, assignment)
+            for (_, _, _, path_to_comment_file), files in assignment_bundles:
+                bundle = load_bundle(path_to_comment_file, stats, word_align_fallback, cache_word_align, files)
+                essay_id = "_".join([semester] + os.path.basename(path_to_comment_file).split("_")[:6])
+                for note in bundle["notes"].iter("{http://www.tei-c.org/ns/1.0}note"):
+                    stored = set()
+                    sample_key = sampler.draw() if sampler else None
+                    for config, error_cat, record in process_note(note, bundle, semester, course, essay_id, 
+                                                                  configs, resources, stats, 
+                                                                  sampler, sample_key):
+                        if sampler:
+                            sampler.offer(sampler.get_stratum(config, error_cat, semester), sample_key, 
+                                          (config, error_cat, record))
+                            continue
+                        outputs[config].setdefault(error_cat, []).append(record)
+                        if (db_conn or parquet_writer) and id(record) not in stored:
+                            new_records.append((error_cat, record))
+                            stored.add(id(record))
+            if db_conn:
+                upsert_records(db_conn, new_records)
+            if parquet_writer:
+                semester_records.extend(new_records)
+            new_records = []
+            stats.tick()
+        if parquet_writer:
+            write_row_group(parquet_writer, semester_records)
+    if sampler:
+        stored = set()
+        for _, (config, error_cat, record) in sampler.get_items():
+            outputs[config].setdefault(error_cat, []).append(record)
+            if id(record) not in stored:
+                new_records.append((error_cat, record))
+                stored.add(id(record))
+        if db_conn:
+            upsert_records(db_conn, new_records)
+        if parquet_writer:
+            write_row_group(parquet_writer, new_records)
+    if db_conn:
+        db_conn.close()
+    if parquet_writer:
+        parquet_writer.close()
+    stats.emit()
+    resources["text_table"].compact()
+    for (feedback_type, error_type), comments in outputs.items():
+        output = []
+        for error_cat, comments_list in comments.items():
+            print(error_cat, len(comments_list))
+            output.extend(comments_list)
+        out_file_name = feedback_type + "_" + error_type
+        # records are decoded to lists of column values one at a time
+        write_to_csv(result_folder + out_file_name + ".csv", (record.to_list() for record in output))
+        # the pickled records (and their shared records.TextTable) need records.py to be loaded
+        with open(result_folder + out_file_name + ".pkl", "wb") as pickle_file:
+            pickle.dump(comments, pickle_file)
+        print("Output saved to {}.pkl/.csv".format(out_file_name))
+    return outputs
@@ -0,0 +1,285 @@
+# Compact representation of the records collected by process_corpus.get_data()
+
+import re
+import sys
+from array import array
+
+word_id_pattern = re.compile(r"w[1-9][0-9]*$")
+# texts are split at the spaces after sentence final punctuation (and a leading space),
+# so that the sentences of an essay become pieces shared by all texts containing them
+piece_separator = re.compile(r"(?:^|(?<=[.!?])) ")
+NO_TEXT = 0xFFFFFFFF
+MARKED = 0x80000000
+
+def encode_tokens(target_tokens):
+    """ Stores word IDs of the form 'w<nr>' as an array of unsigned integers,
+    other IDs as a tuple of interned strings.
+    """
+    if all([word_id_pattern.match(tok) for tok in target_tokens]):
+        return array("I", [int(tok[1:]) for tok in target_tokens])
+    return tuple([sys.intern(tok) for tok in target_tokens])
+
+def decode_tokens(tokens):
+    if isinstance(tokens, array):
+        return ["w" + str(nr) for nr in tokens]
+    return list(tokens)
+
+def mark_words(sentence, marks):
+    """ Sentence with the words at the given positions marked as [[word]].
+    """
+    words = sentence.split(" ")
+    for ix in marks:
+        words[ix] = "[[" + words[ix] + "]]"
+    return " ".join(words)
+
+class TextTable:
+    """ Stores each distinct piece (mostly a sentence) of the record texts once;
+    a text is a list of piece numbers whose pieces joined with a space give the
+    text again. Sentences shared by the context windows of the notes of an
+    essay and by the versions of an essay are thereby stored once. A sentence
+    with target tokens marked as [[word]] is stored as the unmarked piece
+    (MARKED | piece number), the number of marks and the marked word positions.
+    Pieces are stored as the numbers of their (space separated) words, 2 bytes
+    per word (4 if a word number does not fit) after a type code byte;
+    compact() packs them into one buffer with offsets.
+    @ cache_size: number of recently encoded pieces whose piece number is looked 
+                  up without encoding the piece
+    """
+    def __init__(self, cache_size=10000):
+        self.words = []
+        self.word_ids = {}
+        self.pieces = []
+        self.piece_ids = {}
+        self.buffer = None
+        self.offsets = None
+        self.cache_size = cache_size
+        self.recent = {}
+
+    def get_piece_id(self, piece):
+        piece_id = self.recent.get(piece)
+        if piece_id is not None:
+            return piece_id
+        word_ids = []
+        for word in piece.split(" "):
+            word_id = self.word_ids.get(word)
+            if word_id is None:
+                word_id = self.word_ids[word] = len(self.words)
+                self.words.append(word)
+            word_ids.append(word_id)
+        typecode = "H" if max(word_ids) < 2**16 else "I"
+        encoded = typecode.encode("ascii") + array(typecode, word_ids).tobytes()
+        piece_id = self.piece_ids.get(encoded)
+        if piece_id is None:
+            piece_id = self.piece_ids[encoded] = len(self.pieces)
+            self.pieces.append(encoded)
+        if len(self.recent) >= self.cache_size:
+            self.recent.clear()
+        self.recent[piece] = piece_id
+        return piece_id
+
+    def get_piece(self, piece_id):
+        if self.buffer is None:
+            encoded = self.pieces[piece_id]
+        else:
+            encoded = self.buffer[self.offsets[piece_id]:self.offsets[piece_id+1]]
+        words = self.words
+        return " ".join([words[word_id] for word_id in array(chr(encoded[0]), encoded[1:])])
+
+    def encode(self, text):
+        if self.buffer is not None:
+            self.pieces = [self.buffer[self.offsets[ix]:self.offsets[ix+1]] for ix in range(len(self.offsets) - 1)]
+            self.buffer = self.offsets = None
+        if self.piece_ids is None:
+            self.piece_ids = {piece: ix for ix, piece in enumerate(self.pieces)}
+            self.word_ids = {word: ix for ix, word in enumerate(self.words)}
+        ids = []
+        for piece in piece_separator.split(text):
+            if "[[" in piece:
+                words = piece.split(" ")
+                marks = [ix for ix, word in enumerate(words) 
+                         if len(word) > 4 and word.startswith("[[") and word.endswith("]]")]
+                plain = " ".join([word[2:-2] if ix in marks else word for ix, word in enumerate(words)])
+                if marks and mark_words(plain, marks) == piece:
+                    ids.extend([MARKED | self.get_piece_id(plain), len(marks)] + marks)
+                    continue
+            ids.append(self.get_piece_id(piece))
+        return ids
+
+    def decode(self, ids, decoded=None):
+        """ Text of the entries of encode().
+        @ decoded: dictionary of piece number -> piece to reuse pieces decoded before
+        """
+        if decoded is None:
+            decoded = {}
+        pieces = []
+        ix = 0
+        while ix < len(ids):
+            piece_id = ids[ix] & ~MARKED
+            piece = decoded.get(piece_id)
+            if piece is None:
+                piece = decoded[piece_id] = self.get_piece(piece_id)
+            if ids[ix] & MARKED:
+                nr_marks = ids[ix+1]
+                pieces.append(mark_words(piece, ids[ix+2:ix+2+nr_marks]))
+                ix += 2 + nr_marks
+            else:
+                pieces.append(piece)
+                ix += 1
+        return " ".join(pieces)
+
+    def compact(self):
+        """ Packs the pieces into one buffer and frees the lookups of piece and word
+        numbers once all records are created (encode() unpacks them again).
+        """
+        if self.buffer is not None:
+            return
+        self.offsets = array("Q", [0])
+        for piece in self.pieces:
+            self.offsets.append(self.offsets[-1] + len(piece))
+        self.buffer = b"".join(self.pieces)
+        self.pieces = self.piece_ids = self.word_ids = None
+        self.recent = {}
+
+shared_table = TextTable()
+
+class Record:
+    """ One comment of get_data() with its revision information. The categorical
+    values (essay ID, comment / error tag, revision type and effort) are interned;
+    the target tokens (integer coded) and the sentences and contexts (as pieces
+    of a TextTable) are stored in a single array. Behaves like the list
+    [essay ID, comment, target tokens, revision type, revision effort, original
+    sentence, revised sentence, context, revised context, (extra columns)]
+    for indexing, slicing and iteration, e.g. when writing it to a CSV.
+    @ table: TextTable shared by the records of a run (default: shared_table)
+    """
+    __slots__ = ["essay_id", "comment", "rev_type", "rev_effort", "data", "table"]
+
+    def __init__(self, essay_id, comment, target_tokens, rev_type, rev_effort, st_sent,
+                 st_rev_sent, more_context, more_context_rev, extra=(), table=None):
+        self.essay_id = sys.intern(essay_id)
+        self.comment = sys.intern(comment)
+        self.rev_type = sys.intern(rev_type) if isinstance(rev_type, str) else rev_type
+        self.rev_effort = sys.intern(rev_effort) if isinstance(rev_effort, str) else rev_effort
+        self.table = table if table is not None else shared_table
+        # target tokens: their number and the numbers of 'w<nr>' word IDs (or NO_TEXT and the 
+        # comma separated IDs as a text), then per text: number of entries and the entries of 
+        # TextTable.encode() (NO_TEXT for None)
+        data = array("I")
+        if all([word_id_pattern.match(tok) for tok in target_tokens]):
+            data.append(len(target_tokens))
+            data.extend([int(tok[1:]) for tok in target_tokens])
+        else:
+            data.append(NO_TEXT)
+            self.add_text(data, ",".join(target_tokens))
+        for text in [st_sent, st_rev_sent, more_context, more_context_rev] + list(extra):
+            self.add_text(data, text)
+        self.data = data
+
+    def add_text(self, data, text):
+        if text is None:
+            data.append(NO_TEXT)
+        else:
+            ids = self.table.encode(text)
+            data.append(len(ids))
+            data.extend(ids)
+
+    def get_fields(self, last=None):
+        """ Target tokens (list of word IDs) followed by the texts (sentences,
+        contexts and extra columns), up to the field with index last.
+        """
+        data = self.data
+        decoded = {}
+        if data[0] == NO_TEXT:
+            ix = 2 + data[1]
+            fields = [self.table.decode(data[2:ix], decoded).split(",")]
+        else:
+            ix = 1 + data[0]
+            fields = [["w" + str(nr) for nr in data[1:ix]]]
+        while ix < len(data) and (last is None or len(fields) <= last):
+            if data[ix] == NO_TEXT:
+                fields.append(None)
+                ix += 1
+            else:
+                end = ix + 1 + data[ix]
+                fields.append(self.table.decode(data[ix+1:end], decoded))
+                ix = end
+        return fields
+
+    @property
+    def target_tokens(self):
+        return self.get_fields(0)[0]
+
+    def get_text(self, text_ix):
+        fields = self.get_fields(text_ix + 1)
+        if text_ix < 0 or len(fields) <= text_ix + 1:
+            raise IndexError("Record index out of range")
+        return fields[text_ix + 1]
+
+    st_sent = property(lambda self: self.get_text(0))
+    st_rev_sent = property(lambda self: self.get_text(1))
+    more_context = property(lambda self: self.get_text(2))
+    more_context_rev = property(lambda self: self.get_text(3))
+    extra = property(lambda self: tuple(self.get_fields()[5:]))
+
+    def to_list(self):
+        fields = self.get_fields()
+        return [self.essay_id, self.comment, ",".join(fields[0]), self.rev_type, self.rev_effort] + fields[1:]
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return self.to_list()[ix]
+        if ix < 0:
+            ix += len(self)
+        if ix == 0:
+            return self.essay_id
+        if ix == 1:
+            return self.comment
+        if ix == 2:
+            return ",".join(self.target_tokens)
+        if ix == 3:
+            return self.rev_type
+        if ix == 4:
+            return self.rev_effort
+        return self.get_text(ix - 5)
+
+    def __len__(self):
+        data = self.data
+        ix = 2 + data[1] if data[0] == NO_TEXT else 1 + data[0]
+        nr_texts = 0
+        while ix < len(data):
+            ix += 1 if data[ix] == NO_TEXT else 1 + data[ix]
+            nr_texts += 1
+        return 5 + nr_texts
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "Record({})".format(self.to_list())
+
+def get_size(records):
+    """ Approximate memory (in bytes) of a list of records, counting
+    every distinct object once (the pieces of TextTables included).
+    """
+    seen = set()
+    size = 0
+    stack = list(records)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, Record):
+            stack.extend([getattr(obj, slot) for slot in Record.__slots__])
+        elif isinstance(obj, TextTable):
+            stack.extend([obj.words, obj.word_ids, obj.pieces, obj.piece_ids, obj.buffer, obj.offsets, obj.recent])
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+    return size
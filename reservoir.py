@@ -0,0 +1,55 @@
+# Stratified reservoir sampling in one pass (e.g. per error category in
+# process_corpus.get_data_multi()), deciding whether an item can still enter
+# the sample before it is built
+
+import heapq
+import random
+
+class StratifiedSampler:
+    """ Uniform random sample of at most size items per stratum. Each item gets
+    a random key (draw()) and a stratum keeps the items with the size smallest
+    keys, so an item whose key is not smaller than the largest key of a full
+    stratum can be skipped without building it (accepts()).
+    Usage:
+        key = sampler.draw()
+        if sampler.accepts(stratum, key):
+            sampler.offer(stratum, key, build_item())
+    @ size:        number of items per stratum
+    @ by_semester: strata of get_stratum() also depend on the semester
+    @ seed:        seed of the random keys
+    """
+    def __init__(self, size, by_semester=False, seed=9):
+        self.size = size
+        self.by_semester = by_semester
+        self.rng = random.Random(seed)
+        self.reservoirs = {}
+        self.nr_offered = 0
+
+    def draw(self):
+        return self.rng.random()
+
+    def get_stratum(self, config, error_cat, semester):
+        return (config, error_cat, semester) if self.by_semester else (config, error_cat)
+
+    def accepts(self, stratum, key):
+        reservoir = self.reservoirs.get(stratum, [])
+        return len(reservoir) < self.size or key < -reservoir[0][0]
+
+    def offer(self, stratum, key, item):
+        """ Adds the item to the sample of the stratum if its key is small enough,
+        removing the item with the largest key of a full stratum.
+        """
+        reservoir = self.reservoirs.setdefault(stratum, [])
+        entry = (-key, self.nr_offered, item)
+        self.nr_offered += 1
+        if len(reservoir) < self.size:
+            heapq.heappush(reservoir, entry)
+        elif key < -reservoir[0][0]:
+            heapq.heapreplace(reservoir, entry)
+
+    def get_items(self):
+        """ All sampled (stratum, item) pairs in the order they were offered.
+        """
+        entries = [(order, stratum, item) for stratum, reservoir in self.reservoirs.items()
+                   for _, order, item in reservoir]
+        return [(stratum, item) for _, stratum, item in sorted(entries, key=lambda entry: entry[0])]
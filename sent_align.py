@@ -0,0 +1,238 @@
+# Sentence alignment between consecutive versions of the student essays
+# (the '_fixed' TEI files) and creation of the sentence aligned dataset
+# read by extract_features.extract_features()
+#
+# Run: python sent_align.py path_to_data out.csv [error_cats.csv] [n_jobs]
+
+import bisect
+import csv
+import difflib
+import os
+import sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from process_corpus import (filter_files, load_xml, load_revision, load_error_cats,
+                            get_essay_sentences, get_target_tokens)
+
+header = ["align_type", "comment_type", "original", "revised", "comment/tag", "essay_id",
+          "orig_sent_id", "target_token", "bug", "annotation"]
+
+def normalize(sent):
+    return " ".join(sent.lower().split())
+
+def get_in_order(pairs):
+    """ Longest subsequence of (original index, revised index) pairs with
+    increasing revised indices (pairs are sorted by original index).
+    Returns the set of pairs in it.
+    """
+    tails = []      # smallest revised index ending an increasing subsequence of each length
+    tail_ixs = []
+    prev = [None] * len(pairs)
+    for ix, (_, rev_ix) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, rev_ix)
+        if pos == len(tails):
+            tails.append(rev_ix)
+            tail_ixs.append(ix)
+        else:
+            tails[pos] = rev_ix
+            tail_ixs[pos] = ix
+        prev[ix] = tail_ixs[pos-1] if pos else None
+    in_order = set()
+    ix = tail_ixs[-1] if tail_ixs else None
+    while ix is not None:
+        in_order.add(pairs[ix])
+        ix = prev[ix]
+    return in_order
+
+def match_identical(orig_sents, rev_sents):
+    """ Pairs identical sentences (after lowercasing and whitespace normalization)
+    in linear time using a hash table of the revised sentences. Each original
+    sentence is paired with the first unused identical revised sentence.
+    Returns the pairs keeping their relative order and the moved ones.
+    """
+    positions = defaultdict(deque)
+    for rev_ix, sent in enumerate(rev_sents):
+        positions[normalize(sent)].append(rev_ix)
+    pairs = []
+    for orig_ix, sent in enumerate(orig_sents):
+        rev_ixs = positions.get(normalize(sent))
+        if rev_ixs:
+            pairs.append((orig_ix, rev_ixs.popleft()))
+    in_order = get_in_order(pairs)
+    return sorted(in_order), [pair for pair in pairs if pair not in in_order]
+
+def similarity(tokens_a, tokens_b):
+    matcher = difflib.SequenceMatcher(None, tokens_a, tokens_b, autojunk=False)
+    if matcher.real_quick_ratio() == 0:
+        return 0.0
+    return matcher.ratio()
+
+def align_gap(orig_ixs, rev_ixs, orig_tokens, rev_tokens, window=3, min_sim=0.5):
+    """ Aligns the unmatched sentences between two identical anchors. Each
+    original sentence is compared to at most 'window' following unused revised
+    sentences, as a replacement (1:1), a split (1:2) or a merge (2:1).
+    Returns a list of (align_type, original indices, revised indices).
+    """
+    alignments = []
+    i = j = 0
+    while i < len(orig_ixs):
+        o = orig_ixs[i]
+        best = None
+        for k in range(j, min(j + window, len(rev_ixs))):
+            r = rev_ixs[k]
+            sim = similarity(orig_tokens[o], rev_tokens[r])
+            candidates = [("replace", [o], [r], sim)]
+            # split / merge only if more similar than each of the sentences alone
+            if k+1 < len(rev_ixs) and rev_ixs[k+1] == r+1:
+                split_sim = similarity(orig_tokens[o], rev_tokens[r] + rev_tokens[r+1])
+                if split_sim > max(sim, similarity(orig_tokens[o], rev_tokens[r+1])):
+                    candidates.append(("split", [o], [r, r+1], split_sim))
+            if i+1 < len(orig_ixs) and orig_ixs[i+1] == o+1:
+                merge_sim = similarity(orig_tokens[o] + orig_tokens[o+1], rev_tokens[r])
+                if merge_sim > max(sim, similarity(orig_tokens[o+1], rev_tokens[r])):
+                    candidates.append(("merge", [o, o+1], [r], merge_sim))
+            for align_type, o_ixs, r_ixs, sim in candidates:
+                if sim >= min_sim and (best is None or sim > best[3]):
+                    best = (align_type, o_ixs, r_ixs, sim, k)
+        if best:
+            align_type, o_ixs, r_ixs, _, k = best
+            for skipped in rev_ixs[j:k]:
+                alignments.append(("insert", [], [skipped]))
+            alignments.append((align_type, o_ixs, r_ixs))
+            i += len(o_ixs)
+            j = k + len(r_ixs)
+        else:
+            alignments.append(("delete", [o], []))
+            i += 1
+    for skipped in rev_ixs[j:]:
+        alignments.append(("insert", [], [skipped]))
+    return alignments
+
+def align_sentences(orig_tokens, rev_tokens, window=3, min_sim=0.5):
+    """ Aligns the sentences of an original and a revised essay version.
+    Identical sentences are matched first by hashing; moved identical
+    sentences are labelled 'swap'. The remaining sentences between two
+    identical ones are aligned with a bounded similarity search (see align_gap()).
+    Returns a list of (align_type, original indices, revised indices) with
+    align_type 'identical', 'swap', 'replace', 'split', 'merge', 'delete' or 'insert'.
+    @ orig_tokens: list of token lists, one per original sentence
+    @ rev_tokens:  list of token lists, one per revised sentence
+    @ window:      number of revised sentences compared to an original sentence
+    @ min_sim:     minimum similarity (difflib ratio on tokens) for a replacement
+    """
+    orig_sents = [" ".join(tokens) for tokens in orig_tokens]
+    rev_sents = [" ".join(tokens) for tokens in rev_tokens]
+    in_order, moved = match_identical(orig_sents, rev_sents)
+    used_orig = set([o for o, _ in in_order + moved])
+    used_rev = set([r for _, r in in_order + moved])
+    alignments = []
+    anchors = [(-1, -1)] + in_order + [(len(orig_sents), len(rev_sents))]
+    for (o_start, r_start), (o_end, r_end) in zip(anchors, anchors[1:]):
+        orig_ixs = [o for o in range(o_start+1, o_end) if o not in used_orig]
+        rev_ixs = [r for r in range(r_start+1, r_end) if r not in used_rev]
+        if orig_ixs or rev_ixs:
+            alignments.extend(align_gap(orig_ixs, rev_ixs, orig_tokens, rev_tokens, window, min_sim))
+        if o_end < len(orig_sents):
+            alignments.append(("identical", [o_end], [r_end]))
+    # moved sentences at their original position, insertions after the preceding original sentence
+    order = []
+    last_orig_ix = -1
+    for alignment in alignments:
+        if alignment[1]:
+            last_orig_ix = alignment[1][0]
+        order.append(last_orig_ix)
+    alignments = [alignment for _, _, alignment in 
+                  sorted(zip(order + [o for o, _ in moved], range(len(order) + len(moved)),
+                             alignments + [("swap", [o], [r]) for o, r in moved]))]
+    return alignments
+
+def align_essay(path_to_comment_file, semester, error_cats=None, window=3, min_sim=0.5):
+    """ Aligns an essay with teacher notes to its revised version and returns
+    one row (see header) per note, with the alignment of the sentence
+    containing the first target token of the note.
+    @ path_to_comment_file: path to the '_fixed_notes' file of the essay
+    @ semester:             semester of the essay (for mapping error codes)
+    @ error_cats:           output of process_corpus.load_error_cats() (None: error codes are kept)
+    """
+    path_to_st_file = path_to_comment_file.replace("_notes", "")
+    rev = load_revision(path_to_st_file)
+    if not rev or not os.path.exists(path_to_st_file):
+        return []
+    orig_essay = get_essay_sentences(load_xml(path_to_st_file))
+    rev_essay = get_essay_sentences(rev[1])
+    orig_tokens = [[word for _, word in sent] for sent in orig_essay["tokens"]]
+    rev_tokens = [[word for _, word in sent] for sent in rev_essay["tokens"]]
+    alignment_of = {}
+    for alignment in align_sentences(orig_tokens, rev_tokens, window, min_sim):
+        for orig_ix in alignment[1]:
+            alignment_of[orig_ix] = alignment
+    data_file = os.path.basename(path_to_comment_file)
+    essay_id = "_".join([semester] + data_file.split("_")[:6])
+    rows = []
+    for note in load_xml(path_to_comment_file).iter("{http://www.tei-c.org/ns/1.0}note"):
+        try:
+            target_tok = note.attrib.get("target").split("#")[1]
+        except AttributeError:
+            continue
+        target_tok_list = get_target_tokens(target_tok)
+        sent_ixs = [orig_essay["word_sent"][tok] for tok in target_tok_list if tok in orig_essay["word_sent"]]
+        if not sent_ixs:
+            continue
+        align_type, o_ixs, r_ixs = alignment_of[sent_ixs[0]]
+        if note.text:
+            comment_type, comment = "open", note.text
+        else:
+            comment_type = "tagged"
+            comment = note.attrib.get("type", "")
+            if error_cats and ":" in comment:
+                comment = error_cats.get((semester, comment.split(":")[1].lstrip("0")), comment)
+        rows.append([align_type, comment_type,
+                     " ".join([orig_essay["sents"][ix] for ix in o_ixs]),
+                     " ".join([rev_essay["sents"][ix] for ix in r_ixs]),
+                     comment, essay_id, sent_ixs[0], ",".join(target_tok_list), "", ""])
+    return rows
+
+def get_essay_files(path_to_data):
+    """ (path to notes file, semester) of all essays with teacher notes and a revision.
+    """
+    essay_files = []
+    for semester in filter_files(path_to_data):
+        for course in filter_files(os.path.join(path_to_data, semester)):
+            for assignment in filter_files(os.path.join(path_to_data, semester, course)):
+                folder = os.path.join(path_to_data, semester, course, assignment)
+                for data_file in filter_files(folder):
+                    if data_file.endswith("fixed_notes.xml") and "version0" not in data_file \
+                                                             and "final" not in data_file:
+                        essay_files.append((os.path.join(folder, data_file), semester))
+    return essay_files
+
+def align_corpus(path_to_data, out_csv, path_to_error_cats=None, n_jobs=1, window=3, min_sim=0.5):
+    """ Aligns all essays with teacher notes to their revised version (in
+    parallel with n_jobs worker processes, one essay per task) and saves one row
+    per note to out_csv, with a header row, in the format read by
+    extract_features.extract_features(). Returns the number of rows written.
+    """
+    error_cats = load_error_cats(path_to_error_cats) if path_to_error_cats else None
+    essay_files = get_essay_files(path_to_data)
+    args = [(path, semester, error_cats, window, min_sim) for path, semester in essay_files]
+    nr_rows = 0
+    with open(out_csv, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(header)
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = executor.map(align_essay, *zip(*args), chunksize=16) if args else []
+                for rows in results:
+                    csv_writer.writerows(rows)
+                    nr_rows += len(rows)
+        else:
+            for arg in args:
+                rows = align_essay(*arg)
+                csv_writer.writerows(rows)
+                nr_rows += len(rows)
+    print("{} essays aligned, {} rows saved to {}".format(len(essay_files), nr_rows, out_csv))
+    return nr_rows
+
+if __name__ == "__main__":
+    align_corpus(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None,
+                 int(sys.argv[4]) if len(sys.argv) > 4 else 1)
@@ -0,0 +1,276 @@
+# Local inference service keeping the spaCy pipeline, the comment lexicons
+# and a trained revision success classifier loaded between requests
+#
+# Start:   python serve.py --model model.pkl [--port 8765]
+#          (train and save a model first with train_model() and save_model())
+# Query:   curl -d '{"comment": "Use a linking word here."}' localhost:8765/predict
+#          curl -d '{"comments": [{"comment": "...", "essay_id": "...", "target_token": "w3,w4",
+#                                  "original": "...", "revised": "..."}]}' localhost:8765/features
+#          curl localhost:8765/metrics
+
+import argparse
+import json
+import pickle
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from extract_features import (get_nlp, load_meta_ling_terms, hedging_words,
+                              get_comment_features_LA, get_learner_features)
+
+def train_model(features_file, label_file, fname_file, svm_cl=False, select_f=True, k=12,
+                scorer="mutual_info", score_seed=0):
+    """ Trains a revision success classifier on the output of
+    extract_features.extract_features_LA(), with the feature selection and
+    scaling of do_ml.eval_cl() (but on all instances). Returns a dictionary
+    with the fitted scaler, the classifier, the mask of the selected features
+    over all feature names and the selected feature names (in column order).
+    @ select_f: keep only the k best features (scorer and score_seed as in eval_cl()),
+                otherwise all features are used
+    """
+    from sklearn.preprocessing import StandardScaler
+    from do_ml import load_ml_data, get_classifiers
+    from feat_selection import get_feature_scores, get_top_k_mask
+    X, y, all_feature_names = load_ml_data(features_file, label_file, fname_file)
+    if select_f:
+        mask = get_top_k_mask(get_feature_scores(X, y, scorer, seed=score_seed), k)
+    else:
+        mask = np.ones(len(all_feature_names), dtype=bool)
+    X = X[:, mask]
+    scaler = StandardScaler().fit(X)
+    clf_name, clf = get_classifiers(svm_cl)[-1]
+    clf.fit(scaler.transform(X), y)
+    return {"clf_name": clf_name.strip(), "clf": clf, "scaler": scaler, "mask": mask,
+            "all_feature_names": all_feature_names,
+            "feature_names": [name for name, keep in zip(all_feature_names, mask) if keep]}
+
+def save_model(model, model_file):
+    with open(model_file, "wb") as pickle_file:
+        pickle.dump(model, pickle_file)
+
+def load_model(model_file):
+    with open(model_file, "rb") as pickle_file:
+        return pickle.load(pickle_file)
+
+def get_features(items, nlp, meta_ling_terms):
+    """ Computes the feature values for a batch of comments (one spaCy
+    nlp.pipe() call per batch). Returns a list of dictionaries.
+    @ items: list of dictionaries with a 'comment' and optionally 'essay_id',
+             'target_token', 'original' and 'revised' (for learner features and change ratio)
+    """
+    features = []
+    parsed_comments = nlp.pipe([item["comment"] for item in items])
+    for item, parsed_comment in zip(items, parsed_comments):
+        values = get_comment_features_LA(item["comment"], parsed_comment, meta_ling_terms, hedging_words)
+        if item.get("essay_id") and item.get("target_token"):
+            values.update(get_learner_features(item["essay_id"], item["target_token"]))
+        if item.get("original") and item.get("revised") is not None:
+            import nltk
+            edit_dist = nltk.edit_distance(item["original"], item["revised"])
+            values["change_ratio"] = round(edit_dist / len(item["original"]), 2)
+        features.append({name: float(val) for name, val in values.items()})
+    return features
+
+def predict(model, features):
+    """ Predicted revision success label per feature dictionary, using the
+    features selected by the mask of the model. Selected features missing from
+    a request are set to their training mean (0 after scaling).
+    Returns a list of (label, missing feature names) tuples.
+    """
+    feature_names = model["feature_names"]
+    X = np.array([[values.get(name, np.nan) for name in model["all_feature_names"]]
+                  for values in features]).reshape(len(features), -1)[:, model["mask"]]
+    X = np.where(np.isnan(X), model["scaler"].mean_, X)
+    labels = model["clf"].predict(model["scaler"].transform(X))
+    return [(str(label), [name for name in feature_names if name not in values])
+            for label, values in zip(labels, features)]
+
+class Batcher:
+    """ Collects the comments of concurrent requests and processes them
+    together: waits at most max_wait seconds for up to max_batch comments.
+    Keeps the latency of the last requests for the /metrics endpoint.
+    """
+    def __init__(self, nlp, meta_ling_terms, model=None, max_batch=64, max_wait=0.005):
+        self.nlp = nlp
+        self.meta_ling_terms = meta_ling_terms
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = {"features": deque(maxlen=10000), "predict": deque(maxlen=10000)}
+        self.batch_sizes = deque(maxlen=10000)
+        self.nr_requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, items, with_prediction):
+        """ Queues the comments of a request and blocks until they are processed.
+        """
+        start = time.perf_counter()
+        done = threading.Event()
+        result = {}
+        self.requests.put((items, with_prediction, done, result))
+        done.wait()
+        endpoint = "predict" if with_prediction else "features"
+        with self.lock:
+            self.latencies[endpoint].append(time.perf_counter() - start)
+            self.nr_requests += 1
+        if "error" in result:
+            raise result["error"]
+        return result["output"]
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            nr_items = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while nr_items < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                nr_items += len(request[0])
+            self.process(batch)
+            with self.lock:
+                self.batch_sizes.append(nr_items)
+
+    def get_outputs(self, batch):
+        """ Output per request of a batch (features and optionally the prediction per comment).
+        """
+        all_items = [item for items, _, _, _ in batch for item in items]
+        features = get_features(all_items, self.nlp, self.meta_ling_terms)
+        if self.model and features and any([with_pred for _, with_pred, _, _ in batch]):
+            predictions = predict(self.model, features)
+        else:
+            predictions = None
+        outputs = []
+        start = 0
+        for items, with_prediction, _, _ in batch:
+            output = []
+            for ix in range(start, start+len(items)):
+                out = {"features": features[ix]}
+                if with_prediction:
+                    out["rev_success"], out["missing_features"] = predictions[ix]
+                output.append(out)
+            outputs.append(output)
+            start += len(items)
+        return outputs
+
+    def process(self, batch):
+        """ Processes the requests of a batch together; if that fails, each request
+        is processed on its own so that a bad comment only fails its own request.
+        """
+        try:
+            outputs = self.get_outputs(batch)
+        except Exception:
+            outputs = []
+            for request in batch:
+                try:
+                    outputs.extend(self.get_outputs([request]))
+                except Exception as e:
+                    outputs.append(e)
+        for (_, _, done, result), output in zip(batch, outputs):
+            if isinstance(output, Exception):
+                result["error"] = output
+            else:
+                result["output"] = output
+            done.set()
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = {"nr_requests": self.nr_requests}
+            for endpoint, latencies in self.latencies.items():
+                if latencies:
+                    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+                    metrics[endpoint] = {"p50_ms": round(p50, 2), "p99_ms": round(p99, 2),
+                                         "nr": len(latencies)}
+            if self.batch_sizes:
+                metrics["mean_batch_size"] = round(float(np.mean(self.batch_sizes)), 2)
+        return metrics
+
+def get_items(request):
+    """ Comments of a request body: a JSON object with a list of 'comments' or a
+    single comment (see get_features() for the fields of an item).
+    Raises a ValueError if the request does not have this form.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("the request must be a JSON object")
+    items = request["comments"] if "comments" in request else [request]
+    if not isinstance(items, list):
+        raise ValueError("'comments' must be a list")
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("comment"), str) or not item["comment"]:
+            raise ValueError("every item needs a non-empty 'comment'")
+        for field in ["essay_id", "target_token", "original", "revised"]:
+            if item.get(field) is not None and not isinstance(item[field], str):
+                raise ValueError("'{}' must be a string".format(field))
+    return items
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self.send_json(200, batcher.get_metrics())
+            elif self.path == "/health":
+                self.send_json(200, {"status": "ok", "model": bool(batcher.model)})
+            else:
+                self.send_json(404, {"error": "unknown path"})
+
+        def do_POST(self):
+            if self.path not in ["/features", "/predict"]:
+                self.send_json(404, {"error": "unknown path"})
+                return
+            if self.path == "/predict" and not batcher.model:
+                self.send_json(400, {"error": "no model loaded"})
+                return
+            try:
+                items = get_items(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            try:
+                output = batcher.submit(items, self.path == "/predict")
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+                return
+            self.send_json(200, {"results": output})
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+def serve(model_file=None, host="127.0.0.1", port=8765, spacy_model="en_core_web_sm",
+          max_batch=64, max_wait=0.005):
+    """ Loads the NLP pipeline, lexicons and model once and answers requests
+    until interrupted.
+    """
+    model = load_model(model_file) if model_file else None
+    batcher = Batcher(get_nlp(spacy_model), load_meta_ling_terms(), model, max_batch, max_wait)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print("Serving on http://{}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", help="pickled model (see train_model() and save_model())")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--spacy_model", default="en_core_web_sm")
+    parser.add_argument("--max_batch", type=int, default=64)
+    parser.add_argument("--max_wait_ms", type=float, default=5)
+    args = parser.parse_args()
+    serve(args.model, args.host, args.port, args.spacy_model, args.max_batch, args.max_wait_ms / 1000)
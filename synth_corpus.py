@@ -0,0 +1,247 @@
+# Generator of a synthetic L2 feedback corpus in the folder and TEI layout
+# read by process_corpus.get_data() (for testing and benchmarking without
+# the private corpus)
+#
+# Layout: <root>/<semester>/<course>/<assignment>/ with per essay
+#   <essay>_version0_fixed.xml              first draft (no teacher notes)
+#   <essay>_version1_fixed.xml              draft with teacher notes ...
+#   <essay>_version1_fixed_notes.xml        ... <note target type> on its tokens
+#   <essay>_version2_fixed.xml              revised draft
+#   <essay>_version2_fixed_wordAlign.xml    word alignment version1 -> version2
+#   ...                                     (the last version is named 'versionfinal')
+
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+from linking_adverbials import linking_adv
+from process_corpus import write_to_csv
+
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+WORDS = ["the", "student", "essay", "argument", "result", "data", "people", "society", "research",
+         "government", "problem", "solution", "important", "many", "different", "should", "can",
+         "is", "are", "was", "have", "show", "think", "believe", "because", "and", "but", "which",
+         "economic", "social", "clear", "new", "increase", "reduce", "example", "study", "in", "of",
+         "to", "for", "with", "on", "this", "that", "these", "their", "it", "we", "they", "a"]
+LINK_WORDS = [lw for lw in linking_adv["band1"] + linking_adv["band2"] if " " not in lw]
+OPEN_COMMENTS = ["Use a linking word to connect these ideas.",
+                 "This transition is not logical, try '{lw}' instead.",
+                 "Signposting is missing here: how is this related to the previous point?",
+                 "Do you mean \"{lw}\"? The connector does not fit the meaning.",
+                 "Check the word order in this sentence.",
+                 "Wrong tense, the study was conducted in the past.",
+                 "Subject-verb agreement: the data {w} not clear.",
+                 "Consider splitting this sentence, it is too long and hard to follow.",
+                 "Word choice: '{w}' is too informal for an academic essay.",
+                 "Please give an example to support this claim."]
+ERROR_CATS = ["Adverb needed - Part of speech Incorrect", "Coherence - signposting",
+              "Coherence - logical sequence", "Conjunction - Wrong Use", "Conjunction Missing",
+              "Delete this (unnecessary)", "Word choice", "Word choice - Level of formality",
+              "Word order", "Article missing", "Subject-verb agreement", "Tense", "Spelling",
+              "Punctuation", "Preposition"]
+
+def get_sentences(rng, nr_sents, link_ratio=0.3):
+    """ Random sentences (lists of words), some starting with a linking adverbial.
+    """
+    sents = []
+    for _ in range(nr_sents):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 20))]
+        if rng.random() < link_ratio:
+            words = [rng.choice(LINK_WORDS)] + words
+        words[0] = words[0].capitalize()
+        sents.append(words + ["."])
+    return sents
+
+def revise(rng, sents, edit_rate=0.1):
+    """ Applies random edits to the tokens of an essay. Returns the revised
+    sentences and the alignment as a list of (type, original token nr,
+    revised token nr) tuples (token nr None for insertions / deletions).
+    """
+    rev_sents = []
+    links = []
+    orig_nr = 0
+    rev_nr = 0
+    for sent in sents:
+        rev_sent = []
+        for word in sent:
+            orig_nr += 1
+            edit = rng.random()
+            if edit < edit_rate * 0.4:
+                rev_nr += 1
+                rev_sent.append(rng.choice(WORDS + LINK_WORDS))
+                links.append(("replace", orig_nr, rev_nr))
+            elif edit < edit_rate * 0.7:
+                links.append(("delete", orig_nr, None))
+            else:
+                rev_nr += 1
+                rev_sent.append(word)
+                links.append(("identical", orig_nr, rev_nr))
+                if edit > 1 - edit_rate * 0.3:
+                    rev_nr += 1
+                    rev_sent.append(rng.choice(WORDS + LINK_WORDS))
+                    links.append(("insert", None, rev_nr))
+        if rev_sent:
+            rev_sents.append(rev_sent)
+    return (rev_sents, links)
+
+def essay_xml(sents, highlight_rate=0.05, rng=None):
+    """ TEI XML of an essay with one <s> per sentence and one <w xml:id> per token.
+    Some tokens are wrapped in <hi> (highlighted by the teacher).
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<TEI xmlns="{}">'.format(TEI_NS),
+             '<teiHeader><fileDesc><titleStmt><title>synthetic</title></titleStmt></fileDesc></teiHeader>',
+             '<text><body><p>']
+    tok_nr = 0
+    for sent in sents:
+        words = []
+        for word in sent:
+            tok_nr += 1
+            w_el = '<w xml:id="w{}">{}</w>'.format(tok_nr, escape(word))
+            if rng and rng.random() < highlight_rate:
+                w_el = '<hi rend="highlight">{}</hi>'.format(w_el)
+            words.append(w_el)
+        lines.append("<s>" + "".join(words) + "</s>")
+    lines.append("</p></body></text></TEI>")
+    return "\n".join(lines)
+
+def notes_xml(notes):
+    """ TEI XML with the teacher notes (target, type, text) of an essay.
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<TEI xmlns="{}">'.format(TEI_NS),
+             '<text><body>']
+    for target, note_type, text in notes:
+        attribs = 'target="{}"'.format(target)
+        if note_type:
+            attribs += ' type="{}"'.format(note_type)
+        lines.append('<note {}>{}</note>'.format(attribs, escape(text) if text else ""))
+    lines.append("</body></text></TEI>")
+    return "\n".join(lines)
+
+def align_xml(orig_file, rev_file, links):
+    """ TEI XML word alignment between two versions, with the same link
+    types as the corpus (identical, replace, delete, insert).
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<TEI xmlns="{}">'.format(TEI_NS),
+             '<teiHeader><fileDesc><sourceDesc>',
+             '<link type="from_file" target="{}"/>'.format(orig_file),
+             '<link type="to_file" target="{}"/>'.format(rev_file),
+             '</sourceDesc></fileDesc></teiHeader>',
+             '<text><body><linkGrp>']
+    for link_type, orig_nr, rev_nr in links:
+        attribs = 'type="{}"'.format(link_type)
+        if orig_nr:
+            attribs += ' prev="{}#w{}"'.format(orig_file, orig_nr)
+        if rev_nr:
+            attribs += ' next="{}#w{}"'.format(rev_file, rev_nr)
+        lines.append("<link {}/>".format(attribs))
+    lines.append("</linkGrp></body></text></TEI>")
+    return "\n".join(lines)
+
+def get_notes(rng, sents, semester_cat_ids, nr_notes, tagged_ratio=0.5, max_span=4):
+    """ Random teacher notes on the tokens of an essay: open-ended comments
+    (no type) or Commentbank tags (type 'cb:<id>', no text).
+    """
+    nr_tokens = sum([len(sent) for sent in sents])
+    notes = []
+    for _ in range(nr_notes):
+        start = rng.randint(1, nr_tokens)
+        end = min(start + rng.randint(0, max_span-1), nr_tokens)
+        if start == end:
+            target = "#w{}".format(start)
+        else:
+            target = "#range(w{},w{})".format(start, end)
+        if rng.random() < tagged_ratio:
+            cat_id = rng.choice(list(semester_cat_ids.values()))
+            notes.append((target, "cb:{:03d}".format(int(cat_id)), None))
+        else:
+            comment = rng.choice(OPEN_COMMENTS).format(lw=rng.choice(LINK_WORDS), w=rng.choice(WORDS))
+            notes.append((target, None, comment))
+    return notes
+
+def write_file(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+def generate_corpus(root, nr_semesters=2, nr_courses=2, nr_assignments=2, nr_students=5,
+                    nr_versions=3, sents_per_essay=20, notes_per_essay=8, edit_rate=0.1, seed=9):
+    """ Writes a synthetic corpus under root, the Commentbank category file
+    (root/error_cats.csv) and n-gram frequency files (root/freq_unigrams,
+    root/freq_bigrams). Returns the path to the data folder.
+    Size grows linearly with nr_semesters * nr_courses * nr_assignments * nr_students.
+    """
+    rng = random.Random(seed)
+    data_root = os.path.join(root, "data")
+    os.makedirs(data_root, exist_ok=True)
+    semesters = ["{}-{:02d}{}".format(2007 + ix//2, (8 + ix//2) % 100, "AB"[ix % 2])
+                 for ix in range(nr_semesters)]
+    # category ids differ between semesters
+    cat_ids = {}
+    for semester in semesters:
+        ids = rng.sample(range(1, 200), len(ERROR_CATS))
+        cat_ids[semester] = {cat: str(cat_id) for cat, cat_id in zip(ERROR_CATS, ids)}
+    write_to_csv(os.path.join(root, "error_cats.csv"),
+                 [["category"] + semesters] + [[cat] + [cat_ids[sem][cat] for sem in semesters]
+                                               for cat in ERROR_CATS])
+    for semester in semesters:
+        for course_ix in range(nr_courses):
+            course = "{}{:04d}".format(["CTL", "ENG", "BCH"][course_ix % 3], 1000 + course_ix)
+            for asgn_ix in range(nr_assignments):
+                assignment = "Asgn{}".format(asgn_ix + 1)
+                folder = os.path.join(data_root, semester, course, assignment)
+                os.makedirs(folder, exist_ok=True)
+                for student in range(nr_students):
+                    essay = "{}_{}_S{:04d}_T{:02d}_essay".format(course, assignment, student, course_ix)
+                    versions = ["version{}".format(v) for v in range(nr_versions-1)] + ["versionfinal"]
+                    sents = get_sentences(rng, sents_per_essay)
+                    for v_ix, version in enumerate(versions):
+                        fname = "{}_{}_fixed.xml".format(essay, version)
+                        write_file(os.path.join(folder, fname), essay_xml(sents, rng=rng))
+                        if v_ix + 1 < len(versions):
+                            next_fname = "{}_{}_fixed.xml".format(essay, versions[v_ix+1])
+                            if v_ix:    # version0 has no teacher notes
+                                notes = get_notes(rng, sents, cat_ids[semester], notes_per_essay)
+                                write_file(os.path.join(folder, fname.replace("_fixed", "_fixed_notes")),
+                                           notes_xml(notes))
+                            sents, links = revise(rng, sents, edit_rate)
+                            write_file(os.path.join(folder, next_fname.replace("_fixed", "_fixed_wordAlign")),
+                                       align_xml(fname, next_fname, links))
+    write_freq_files(root, rng)
+    return data_root
+
+def write_freq_files(root, rng):
+    """ Frequency files in the format read by process_corpus.load_grams().
+    """
+    vocab = WORDS + linking_adv["band1"] + linking_adv["band2"] + linking_adv["band3"]
+    with open(os.path.join(root, "freq_unigrams"), "w") as f:
+        for word in sorted(set([w for w in vocab if " " not in w])):
+            f.write("{}\t{}\n".format(rng.randint(1, 500), word))
+    with open(os.path.join(root, "freq_bigrams"), "w") as f:
+        for words in sorted(set([w for w in vocab if len(w.split(" ")) == 2])):
+            f.write("{}\t{}\n".format(rng.randint(1, 50), words))
+
+def write_annot_csv(csv_file, nr_items=500, seed=9):
+    """ Synthetic merged annotation file in the format of
+    process_annot.merge_all_annot_info() (input of extract_features_LA()).
+    """
+    rng = random.Random(seed)
+    rows = [["ID", "essay ID", "target token", "comment", "direct_A1", "direct_A2", "gold_dir",
+             "rev_succ_A1", "rev_succ_A2", "gold_rev_succ", "original", "revised", "original+", "revised+"]]
+    for ix in range(nr_items):
+        sents = get_sentences(rng, 2)
+        original = " ".join(sents[0])
+        revised = " ".join(revise(rng, [sents[0]], 0.3)[0][0])
+        start = rng.randint(1, 200)
+        rev_succ = rng.choice(["good", "bad", "alt", "same", "?"])
+        comment = rng.choice(OPEN_COMMENTS).format(lw=rng.choice(LINK_WORDS), w=rng.choice(WORDS))
+        rows.append(["c{}".format(ix+1), "2007-08A_CTL1000_Asgn1_S{:04d}_T01_version1".format(ix),
+                     "w{},w{}".format(start, start+1), comment, "dir", "ind", "ind", rev_succ, rev_succ,
+                     rev_succ, original, revised, " ".join(sents[1]) + " " + original, revised])
+    write_to_csv(csv_file, rows)
+
+if __name__ == "__main__":
+    out_root = sys.argv[1] if len(sys.argv) > 1 else "synthetic_corpus"
+    nr_students = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print("Corpus saved to", generate_corpus(out_root, nr_students=nr_students))
@@ -0,0 +1,52 @@
+# Hashed word and character n-gram features of the comments (sparse),
+# stacked with the handcrafted features in do_ml.eval_cl()
+
+import csv
+from itertools import islice
+
+def iter_comments(comments_file):
+    """ Comments saved by extract_features.extract_features_LA() (comments_file,
+    one CSV row per instance, in the order of the features file).
+    """
+    with open(comments_file, newline="") as csvfile:
+        for row in csv.reader(csvfile):
+            yield row[0] if row else ""
+
+def get_vectorizers(n_features=2**18, word_ngrams=(1, 2), char_ngrams=(2, 4)):
+    """ Hashing vectorizers (no vocabulary to fit or store) for word and
+    character n-grams (within word boundaries); None n-gram ranges are left out.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizers = []
+    if word_ngrams:
+        vectorizers.append(HashingVectorizer(n_features=n_features, analyzer="word", ngram_range=word_ngrams,
+                                             alternate_sign=False, lowercase=True))
+    if char_ngrams:
+        vectorizers.append(HashingVectorizer(n_features=n_features, analyzer="char_wb", ngram_range=char_ngrams,
+                                             alternate_sign=False, lowercase=True))
+    return vectorizers
+
+def get_hashed_features(comments, n_features=2**18, word_ngrams=(1, 2), char_ngrams=(2, 4), chunk_size=5000):
+    """ Sparse n-gram features of comments, vectorized chunk by chunk.
+    Returns a scipy CSR matrix with one row per comment and n_features columns
+    per n-gram type (each row L2-normalized per n-gram type).
+    @ comments: iterable of comments (e.g. iter_comments())
+    """
+    from scipy import sparse
+    vectorizers = get_vectorizers(n_features, word_ngrams, char_ngrams)
+    comments = iter(comments)
+    chunks = []
+    while True:
+        chunk = list(islice(comments, chunk_size))
+        if not chunk:
+            break
+        chunks.append(sparse.hstack([vectorizer.transform(chunk) for vectorizer in vectorizers], format="csr"))
+    if not chunks:
+        return sparse.csr_matrix((0, n_features * len(vectorizers)))
+    return sparse.vstack(chunks, format="csr")
+
+def stack_features(X_dense, X_sparse):
+    """ Dense (e.g. scaled handcrafted) features followed by the sparse columns, as CSR.
+    """
+    from scipy import sparse
+    return sparse.hstack([sparse.csr_matrix(X_dense), X_sparse], format="csr")
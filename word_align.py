@@ -0,0 +1,174 @@
+# Token level alignment between two versions of a student essay, used when
+# the corpus has no '_fixed_wordAlign' file for a revision. The alignment has
+# the same structure and link types as the corpus files (see get_revision_info()).
+
+import os
+import xml.etree.ElementTree as ET
+
+TEI = "{http://www.tei-c.org/ns/1.0}"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+def get_token_stream(xml_root):
+    """ (word ID, word) of all tokens of an essay in document order.
+    """
+    return [(w.attrib[XML_ID], w.text or "") for w in xml_root.iter(TEI + "w") if XML_ID in w.attrib]
+
+def intern_tokens(orig_words, rev_words):
+    """ Maps the words of both versions to integer IDs (same word -> same ID),
+    so that the diff compares integers instead of strings.
+    """
+    vocab = {}
+    orig_ids = [vocab.setdefault(word, len(vocab)) for word in orig_words]
+    rev_ids = [vocab.setdefault(word, len(vocab)) for word in rev_words]
+    return orig_ids, rev_ids
+
+def myers_diff(a, b):
+    """ Shortest edit script between the sequences a and b (Myers' O((N+M)D)
+    algorithm). Returns a list of (op, index in a, index in b) in order, with
+    op 'equal', 'delete' (index in b None) or 'insert' (index in a None).
+    """
+    # common prefix and suffix need no search
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a-1] == b[end_b-1]:
+        end_a -= 1
+        end_b -= 1
+    ops = [("equal", ix, ix) for ix in range(start)]
+    a_mid, b_mid = a[start:end_a], b[start:end_b]
+    n, m = len(a_mid), len(b_mid)
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    found = n == 0 and m == 0
+    d = 0
+    while not found:
+        trace.append(v[:])
+        for k in range(-d, d+1, 2):
+            if k == -d or (k != d and v[offset+k-1] < v[offset+k+1]):
+                x = v[offset+k+1]       # insertion (move down)
+            else:
+                x = v[offset+k-1] + 1   # deletion (move right)
+            y = x - k
+            while x < n and y < m and a_mid[x] == b_mid[y]:
+                x += 1
+                y += 1
+            v[offset+k] = x
+            if x >= n and y >= m:
+                found = True
+                break
+        else:
+            d += 1
+    # backtrack from the end through the saved V arrays
+    mid_ops = []
+    x, y = n, m
+    for d in range(len(trace)-1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset+k-1] < v[offset+k+1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[offset+prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            mid_ops.append(("equal", start+x, start+y))
+        if d > 0:
+            if x == prev_x:
+                mid_ops.append(("insert", None, start+y-1))
+            else:
+                mid_ops.append(("delete", start+x-1, None))
+        x, y = prev_x, prev_y
+    ops.extend(reversed(mid_ops))
+    ops.extend([("equal", end_a+ix, end_b+ix) for ix in range(len(a) - end_a)])
+    return ops
+
+def get_links(orig_tokens, rev_tokens):
+    """ Word alignment links between two token streams.
+    Deleted tokens reinserted elsewhere are 'shift' links, the remaining
+    deletions and insertions of the same changed region are paired as 'replace'.
+    Returns a list of (link type, original word ID, revised word ID) in
+    document order (None for missing IDs).
+    @ orig_tokens, rev_tokens: output of get_token_stream()
+    """
+    orig_ids, rev_ids = intern_tokens([word for _, word in orig_tokens], [word for _, word in rev_tokens])
+    ops = myers_diff(orig_ids, rev_ids)
+    # changed regions between equal tokens
+    regions = []
+    region = None
+    for op, i, j in ops:
+        if op == "equal":
+            regions.append(("equal", i, j))
+            region = None
+        else:
+            if region is None:
+                region = ([], [])
+                regions.append(region)
+            region[0 if op == "delete" else 1].append(i if op == "delete" else j)
+    # shifts: same word deleted in one place and inserted in another
+    inserted = {}
+    for region in regions:
+        if region[0] != "equal":
+            for j in region[1]:
+                inserted.setdefault(rev_ids[j], []).append(j)
+    shifted = {}
+    for region in regions:
+        if region[0] != "equal":
+            for i in region[0]:
+                if inserted.get(orig_ids[i]):
+                    shifted[i] = inserted[orig_ids[i]].pop(0)
+    shift_targets = set(shifted.values())
+    links = []
+    for region in regions:
+        if region[0] == "equal":
+            links.append(("identical", orig_tokens[region[1]][0], rev_tokens[region[2]][0]))
+            continue
+        deleted = [i for i in region[0] if i not in shifted]
+        added = [j for j in region[1] if j not in shift_targets]
+        for i in region[0]:
+            if i in shifted:
+                links.append(("shift", orig_tokens[i][0], rev_tokens[shifted[i]][0]))
+        for ix in range(max(len(deleted), len(added))):
+            if ix < len(deleted) and ix < len(added):
+                links.append(("replace", orig_tokens[deleted[ix]][0], rev_tokens[added[ix]][0]))
+            elif ix < len(deleted):
+                links.append(("delete", orig_tokens[deleted[ix]][0], None))
+            else:
+                links.append(("insert", None, rev_tokens[added[ix]][0]))
+    return links
+
+def build_alignment_xml(links, orig_file, rev_file):
+    """ Word alignment as a TEI tree in the format of the '_fixed_wordAlign' files.
+    """
+    orig_file, rev_file = os.path.basename(orig_file), os.path.basename(rev_file)
+    root = ET.Element(TEI + "TEI")
+    source_desc = ET.SubElement(ET.SubElement(ET.SubElement(root, TEI + "teiHeader"), TEI + "fileDesc"),
+                                TEI + "sourceDesc")
+    ET.SubElement(source_desc, TEI + "link", {"type": "from_file", "target": orig_file})
+    ET.SubElement(source_desc, TEI + "link", {"type": "to_file", "target": rev_file})
+    link_grp = ET.SubElement(ET.SubElement(ET.SubElement(root, TEI + "text"), TEI + "body"), TEI + "linkGrp")
+    for link_type, orig_id, rev_id in links:
+        attribs = {"type": link_type}
+        if orig_id:
+            attribs["prev"] = orig_file + "#" + orig_id
+        if rev_id:
+            attribs["next"] = rev_file + "#" + rev_id
+        ET.SubElement(link_grp, TEI + "link", attribs)
+    return root
+
+def align_words(orig_root, rev_root, orig_file, rev_file, cache_file=None):
+    """ Aligns the tokens of two essay versions. Returns the alignment as a
+    loaded '_fixed_wordAlign' XML root, which can be passed to get_revision_info().
+    @ orig_root, rev_root: loaded TEI XML of the original and the revised version
+    @ orig_file, rev_file: file names of the versions (used in the link targets)
+    @ cache_file:          if given, the alignment is also saved to this file
+    """
+    links = get_links(get_token_stream(orig_root), get_token_stream(rev_root))
+    root = build_alignment_xml(links, orig_file, rev_file)
+    if cache_file:
+        ET.register_namespace("", TEI[1:-1])
+        ET.ElementTree(root).write(cache_file, encoding="UTF-8", xml_declaration=True)
+    return root